@@ -141,6 +141,13 @@ REST_FRAMEWORK = {
 }
 
 
+# 每個 worker 的 ShogiGame LRU cache (Shogi/cache.py)
+SHOGI_GAME_CACHE = {
+    'MAX_ENTRIES': 512,
+    'MAX_SIZE': 32 * 1024 * 1024,  # bytes，依估計的大小計算
+}
+
+
 # Daphne
 ASGI_APPLICATION = 'Django_Shogi.asgi.application'
 CHANNEL_LAYERS = {
@@ -150,4 +157,12 @@ CHANNEL_LAYERS = {
             "hosts": [('127.0.0.1', 6379)],
         },
     },
-}
\ No newline at end of file
+}
+
+# 排行榜等快取由所有 worker 共用，使用與 channel layer 相同的 Redis (db 1)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+}
@@ -50,8 +50,12 @@ urlpatterns = [
     path('api/logout/', views.LogoutView.as_view(), name='api-logout'),
     path('api/check-login/', views.CheckLoginStatusView.as_view(), name='check-login'),
     path('api/player/<str:username>/', views.PlayerView.as_view(), name='player-detail-by-username'),
+    path('api/leaderboard/', views.LeaderboardView.as_view(), name='leaderboard'),
+    path('api/leaderboard/<str:username>/', views.PlayerRankView.as_view(), name='leaderboard-player'),
     path('api/game/', views.GameCreateView.as_view(), name='game-create'),
     path('api/games/', views.GameListView.as_view(), name='game-list'),
+    path('api/games/export/', views.GameExportView.as_view(), name='game-export'),
+    path('api/games/cache/', views.GameCacheStatsView.as_view(), name='game-cache-stats'),
     path('api/games/<uuid:uid>/', views.GameDetailDeleteView.as_view(), name='game-detail-delete'),
     path('api/games/join/', views.GameJoinView.as_view(), name='game-join'),
     path('api/games/move/', views.GameMoveView.as_view(), name='game-move'),
@@ -1,9 +1,30 @@
-from typing import Tuple, List, Set
-from .utils import parse_string_to_pos, parse_drop_to_string
+from typing import Tuple, List, Set, Dict, Optional
+from collections import Counter
+from .move import encode_drop, decode_move, SQUARE_POS, MOVE_DST_SHIFT, MOVE_SQUARE_MASK
 from .piece import *
-from .player import ShogiPlayer
+from .player import ShogiPlayer, ShogiHand
+from .sfen import board_to_sfen, parse_sfen
+from .codec import pack_position, unpack_position
+
+import random
+
+# Zobrist hashing: 固定的亂數種子，讓不同的 process 算出相同的 hash
+_zobrist_random = random.Random(20231015)
+
+# (棋子種類, team, 是否升變) -> 每個格子的 key
+ZOBRIST_PIECE_KEYS = {
+    (kind, team, promoted): [_zobrist_random.getrandbits(64) for _ in range(81)]
+    for kind, promoted in MOVE_PATTERNS
+    for team in (1, -1)
+}
+# (持有的 team, 棋子種類) -> 第 n 個持駒的 key (index 0 不使用)
+ZOBRIST_HAND_KEYS = {
+    (team, kind): [_zobrist_random.getrandbits(64) for _ in range(19)]
+    for kind in 'KRBGSNLP'
+    for team in (1, -1)
+}
+ZOBRIST_SIDE_KEY = _zobrist_random.getrandbits(64)
 
-import copy
 
 class ShogiBoard:
     PIECES = {'K': King, 'R': Rook, 'B': Bishop, 'G': GGeneral, 'S': SGeneral, 'N': Knight, 'L': Lance, 'P': Pawn}
@@ -23,6 +44,27 @@ class ShogiBoard:
     PAWN_PIECE_NAME = ['p', 'P']
     KINGHT_LANCE_PIECE_NAME = ['n', 'l', 'N', 'L']
 
+    # 反向查詢攻擊者用: (棋子種類, 是否升變) -> 走一步的方向 (以 team = 1 的視角)
+    ATTACK_STEP_PATTERNS = {
+        ('K', False): frozenset(King._king_pattern),
+        ('G', False): frozenset(ShogiPiece._GGeneral_pattern),
+        ('S', False): frozenset(SGeneral._SGeneral_pattern),
+        ('N', False): frozenset(Knight._Kinght_pattern),
+        ('P', False): frozenset(Pawn._Pawn_pattern),
+        ('R', True): frozenset(Rook._king_pattern),
+        ('B', True): frozenset(Bishop._king_pattern),
+        ('S', True): frozenset(ShogiPiece._GGeneral_pattern),
+        ('N', True): frozenset(ShogiPiece._GGeneral_pattern),
+        ('L', True): frozenset(ShogiPiece._GGeneral_pattern),
+        ('P', True): frozenset(ShogiPiece._GGeneral_pattern),
+    }
+    ATTACK_STEP_OFFSETS = King._king_pattern + Knight._Kinght_pattern
+
+    ROOK_RAYS = Rook._rook_pattern
+    BISHOP_RAYS = Bishop._bishop_pattern
+
+    REPETITION_LIMIT = 4  # 千日手: 同一局面出現四次
+
 
     def __init__(self, our_player: ShogiPlayer, opponent_player: ShogiPlayer) -> None:
         self.board = [[None for _ in range(9)] for _ in range(9)]
@@ -30,7 +72,10 @@ class ShogiBoard:
         self._opponent_player = opponent_player
         self.our_king_pos = (8, 4)
         self.opponent_king_pos = (0, 4)
+        self._undo_stack = []
+        self._check_cache = {}  # team -> 是否被將軍，盤面改變時清除
         self.init_board()
+        self._reset_position_history()
 
 
     @property
@@ -105,8 +150,101 @@ class ShogiBoard:
         self.board[8] = [Lance('l', 1), Knight('n', 1), SGeneral('s', 1), GGeneral('g', 1), King('k', 1), GGeneral('g', 1), SGeneral('s', 1), Knight('n', 1), Lance('l', 1)]
 
     
-    def insert_board(self, customization_board):
+    def insert_board(self, customization_board, side_to_move: int = 1):
         self.board = customization_board
+        self._reset_position_history(side_to_move)
+
+
+    def insert_sfen(self, sfen: str) -> int:
+        '''
+        從 SFEN 載入盤面、雙方持駒與輪到的一方，回傳手數
+        '''
+        board, our_hand, opponent_hand, side_to_move, move_number = parse_sfen(sfen)
+        self._insert_position(board, our_hand, opponent_hand, side_to_move)
+
+        return move_number
+
+
+    def insert_packed(self, data: bytes, side_to_move: Optional[int] = None) -> None:
+        '''
+        從 codec.py 的 32 bytes 編碼載入局面 (不包含手數)
+        王被吃掉的局面沒有保存輪到的一方，需由 side_to_move 指定
+        '''
+        board, our_hand, opponent_hand, packed_side_to_move = unpack_position(data)
+        self._insert_position(board, our_hand, opponent_hand, side_to_move or packed_side_to_move)
+
+
+    def _insert_position(self, board, our_hand: ShogiHand, opponent_hand: ShogiHand, side_to_move: int) -> None:
+        self._our_player.hand = our_hand
+        if self._opponent_player:
+            self._opponent_player.hand = opponent_hand
+
+        for r, row in enumerate(board):
+            for c, piece in enumerate(row):
+                if piece and piece.kind == 'K':
+                    if piece.team == 1:
+                        self.our_king_pos = (r, c)
+                    else:
+                        self.opponent_king_pos = (r, c)
+
+        self.insert_board(board, side_to_move)
+
+
+    def to_sfen(self, move_number: int = 1) -> str:
+        opponent_hand = self._opponent_player.hand if self._opponent_player else None
+        return board_to_sfen(self.board, self._our_player.hand, opponent_hand, self.side_to_move, move_number)
+
+
+    def to_packed(self) -> bytes:
+        opponent_hand = self._opponent_player.hand if self._opponent_player else None
+        return pack_position(self.board, self._our_player.hand, opponent_hand, self.side_to_move)
+
+
+    def set_position_history(self, position_history: List[int]) -> None:
+        '''
+        載入先前的局面 hash (最後一個須為目前的局面)，用於判斷千日手
+        '''
+        self.position_history = list(position_history)
+        self.position_counts = Counter(self.position_history)
+
+
+    def _reset_position_history(self, side_to_move: int = 1) -> None:
+        self._check_cache = {}
+        self.side_to_move = side_to_move
+        self.zobrist_hash = self._compute_zobrist_hash()
+        self.position_history = [self.zobrist_hash]
+        self.position_counts = Counter(self.position_history)
+
+
+    def _compute_zobrist_hash(self) -> int:
+        '''
+        從頭計算局面的 hash: 盤上的棋子、雙方的持駒與輪到哪一方
+        '''
+        zobrist_hash = ZOBRIST_SIDE_KEY if self.side_to_move == -1 else 0
+
+        for r, row in enumerate(self.board):
+            for c, piece in enumerate(row):
+                if piece:
+                    zobrist_hash ^= ZOBRIST_PIECE_KEYS[piece.kind, piece.team, piece.promoted][r * 9 + c]
+
+        for player in (self._our_player, self._opponent_player):
+            if player:
+                for kind in player.hand:
+                    for n in range(1, player.hand.count(kind) + 1):
+                        zobrist_hash ^= ZOBRIST_HAND_KEYS[player.team, kind][n]
+
+        return zobrist_hash
+
+
+    def get_repetition_count(self) -> int:
+        '''
+        目前局面在這局中出現的次數，O(1)
+        '''
+        return self.position_counts[self.zobrist_hash]
+
+
+    def is_repetition(self) -> bool:
+        return self.get_repetition_count() >= self.REPETITION_LIMIT
 
 
     def _has_piece(self, board, position: Tuple[int, int]) -> bool:
@@ -117,9 +255,9 @@ class ShogiBoard:
         return True if board[r][c] else False
     
     
-    def execute_move(self, move_command: str, player: ShogiPlayer) -> None:
+    def execute_move(self, move: int, player: ShogiPlayer) -> None:
         '''
-        實際的移動步
+        實際的移動步，move 為 move.py 編碼後的 int (字串 notation 請先用 parse_move 轉換)
 
         Move ex: a3a4
         Promotion move ex: h6h7+
@@ -127,14 +265,14 @@ class ShogiBoard:
         Drops are written as a piece letter in upper case
         Drop ex: P*d4 or R*g5
         '''
-        board = copy.deepcopy(self.board)
+        src, dst, is_promoted, drop_piece = decode_move(move)
 
-        if move_command[1] != '*':
-            src_r, src_c, _ = parse_string_to_pos(move_command[:2])
-            dst_r, dst_c, is_promoted = parse_string_to_pos(move_command[2:])
+        if not drop_piece:
+            src_r, src_c = src
+            dst_r, dst_c = dst
 
             # Execute move
-            if not self._has_piece(board, (src_r, src_c)):
+            if not self._has_piece(self.board, (src_r, src_c)):
                 raise Exception("No piece in the position!")
             obj_piece = self.board[src_r][src_c]
             
@@ -143,61 +281,126 @@ class ShogiBoard:
             
             valid_moves = obj_piece.get_valid_moves((src_r, src_c), self.board)
 
-            if move_command not in valid_moves:
+            if move not in valid_moves:
                 raise Exception("This move is invalid!")
-            elif self.board[dst_r][dst_c] and self.board[dst_r][dst_c].team == -player.team:
-                player.capture(self.board[dst_r][dst_c])
             
             # Promote!
             if is_promoted:
                 if obj_piece.promoted or (player.team == 1 and dst_r not in self.OUR_PROMOTION_ZONE) or (player.team == -1 and dst_r not in self.OPPONENT_PROMOTION_ZONE):
                     raise Exception("This move can't promote!")
-                obj_piece.promoted = True
+        else:
+            # Check the pos and piece could drop?
+            if not self._can_drop_piece(drop_piece, dst, player):
+                raise Exception("Can't drop to the position!")
             
+            if drop_piece not in player.hand:
+                raise Exception("You don't have this piece to drop!")
+
+        self.make_move(move, player)
+        self._undo_stack.clear()  # 實際走步不需要復原
+
+        self.position_history.append(self.zobrist_hash)
+        self.position_counts[self.zobrist_hash] += 1
+
+
+    def make_move(self, move: int, player: ShogiPlayer) -> None:
+        '''
+        可復原的走步，不做合法性檢查，用於試走後再以 unmake_move 復原
+
+        Undo stack 紀錄: (player, src, dst, 移動的棋子 (升變前), 被吃掉的棋子, 打入的棋子種類, 王將/玉將的位置, 走步前的 hash)
+        '''
+        king_pos = (self.our_king_pos, self.opponent_king_pos)
+        prev_hash = self.zobrist_hash
+        src, dst, is_promoted, drop_piece = decode_move(move)
+        dst_r, dst_c = dst
+        dst_sq = dst_r * 9 + dst_c
+        zobrist_hash = prev_hash ^ ZOBRIST_SIDE_KEY
+
+        if not drop_piece:
+            src_r, src_c = src
+
+            obj_piece = self.board[src_r][src_c]
+            captured_piece = self.board[dst_r][dst_c]
+
+            if captured_piece:
+                player.capture(captured_piece)
+                zobrist_hash ^= ZOBRIST_PIECE_KEYS[captured_piece.kind, captured_piece.team, captured_piece.promoted][dst_sq]
+                if captured_piece.kind != 'K':
+                    zobrist_hash ^= ZOBRIST_HAND_KEYS[player.team, captured_piece.kind][player.hand.count(captured_piece.kind)]
+
+            placed_piece = obj_piece.promote() if is_promoted else obj_piece
             self.board[src_r][src_c] = None
-            self.board[dst_r][dst_c] = obj_piece
+            self.board[dst_r][dst_c] = placed_piece
+
+            zobrist_hash ^= ZOBRIST_PIECE_KEYS[obj_piece.kind, obj_piece.team, obj_piece.promoted][src_r * 9 + src_c]
+            zobrist_hash ^= ZOBRIST_PIECE_KEYS[placed_piece.kind, placed_piece.team, placed_piece.promoted][dst_sq]
 
             # 紀錄王將/玉將的位置
             if obj_piece.name == 'k':
                 self.our_king_pos = (dst_r, dst_c)
             elif obj_piece.name == 'K':
                 self.opponent_king_pos = (dst_r, dst_c)
-        else:
-            piece_name, _ = move_command[:2]
-            dst_r, dst_c, _ = parse_string_to_pos(move_command[2:])  # Drop piece hasn't promotion.
 
-            # Check the pos and piece could drop?
-            if not self._can_drop_piece(piece_name, (dst_r, dst_c), player):
-                raise Exception("Can't drop to the position!")
-            
+            self._undo_stack.append((player, src, dst, obj_piece, captured_piece, None, king_pos, prev_hash))
+        else:
             if player.team == 1:
-                obj_piece = self.PIECES[piece_name.upper()](piece_name.lower(), player.team)
+                obj_piece = self.PIECES[drop_piece](drop_piece.lower(), player.team)
             else:
-                obj_piece = self.PIECES[piece_name.upper()](piece_name.upper(), player.team)
+                obj_piece = self.PIECES[drop_piece](drop_piece.upper(), player.team)
+
+            zobrist_hash ^= ZOBRIST_HAND_KEYS[player.team, drop_piece][player.hand.count(drop_piece)]
+            zobrist_hash ^= ZOBRIST_PIECE_KEYS[obj_piece.kind, obj_piece.team, False][dst_sq]
 
-            player.drop(piece_name)
+            player.drop(drop_piece)
             self.board[dst_r][dst_c] = obj_piece
 
+            self._undo_stack.append((player, None, dst, None, None, drop_piece, king_pos, prev_hash))
+
+        self.zobrist_hash = zobrist_hash
+        self.side_to_move = -self.side_to_move
+        self._check_cache.clear()
+
+
+    def unmake_move(self) -> None:
+        '''
+        復原最後一個 make_move
+        '''
+        player, src, dst, obj_piece, captured_piece, drop, king_pos, prev_hash = self._undo_stack.pop()
+        dst_r, dst_c = dst
+
+        if src is None:
+            player.hand.add(drop)
+            self.board[dst_r][dst_c] = None
+        else:
+            src_r, src_c = src
+
+            if captured_piece:
+                player.uncapture(captured_piece)
+
+            self.board[src_r][src_c] = obj_piece  # 升變前的棋子
+            self.board[dst_r][dst_c] = captured_piece
+
+        self.our_king_pos, self.opponent_king_pos = king_pos
+        self.zobrist_hash = prev_hash
+        self.side_to_move = -self.side_to_move
+        self._check_cache.clear()
+
 
     def _can_drop_piece(self, piece_name: str, drop_pos: Tuple[int, int], player: ShogiPlayer) -> bool:
         # 1. 檢查是否可以在指定位置打入棋子
         drop_r, drop_c = drop_pos
-        board = copy.deepcopy(self.board)
+        board = self.board
 
         if self._has_piece(board, (drop_r, drop_c)):
             return False
 
-        # 2. 禁止打入無法移動的棋子
-        if piece_name in self.KINGHT_LANCE_PIECE_NAME:  # 檢查桂馬與香車
-            if (player.team == 1 and drop_r in self.OUR_NL_DROP_FORBIDDEN_ZONE) or (player.team == -1 and drop_r in self.OPPONENT_NL_DROP_FORBIDDEN_ZONE):
-                return False
-        elif piece_name in self.PAWN_PIECE_NAME:  # 檢查步兵
-            if (player.team == 1 and drop_r == self.OUR_P_DROP_FORBIDDEN_ZONE) or (player.team == -1 and drop_r == self.OPPONENT_P_DROP_FORBIDDEN_ZONE):
-                return False
+        # 2. 禁止打入無法移動的棋子 (桂馬、香車與步兵)
+        if drop_r in self._get_drop_forbidden_rows(piece_name, player.team):
+            return False
 
         if piece_name in self.PAWN_PIECE_NAME:
-            # 3. 二步規則
-            if (player.team == 1 and any(str(board[rol][drop_c]) == 'p' for rol in range(9))) or (player.team == -1 and any(str(board[rol][drop_c]) == 'P' for rol in range(9))):
+            # 3. 二步規則 (と金不算)
+            if any(self._is_unpromoted_pawn(board[rol][drop_c], player.team) for rol in range(9)):
                 return False
             
             # 4. 打步詰規則 (先不檢查，發生機率低)
@@ -216,121 +419,260 @@ class ShogiBoard:
         return True
 
 
-    def is_in_check(self, player: ShogiPlayer) -> bool:
+    def get_attackers(self, position: Tuple[int, int], team: int) -> List[Tuple[Tuple[int, int], ShogiPiece]]:
         '''
-        檢查王將/玉將是否被將軍
+        從目標格子往外查詢，回傳所有攻擊該格子的 team 方棋子: [((r, c), piece), ...]
+
+        一步的棋子只需檢查固定的相對位置，飛車、角行、香車則沿著射線找到第一個棋子
+        '''
+        r, c = position
+        attackers = []
+
+        # 1. 固定位移: 王、金、銀、桂、步與升變後的棋子
+        for pr, pc in self.ATTACK_STEP_OFFSETS:
+            src_r, src_c = r - pr * team, c - pc
+            if is_in_board((src_r, src_c)):
+                piece = self.board[src_r][src_c]
+                if piece and piece.team == team and (pr, pc) in self.ATTACK_STEP_PATTERNS.get((piece.name.upper(), piece.promoted), ()):
+                    attackers.append(((src_r, src_c), piece))
+
+        # 2. 射線: 飛車、角行、香車
+        for rays, slider_name in ((self.ROOK_RAYS, 'R'), (self.BISHOP_RAYS, 'B')):
+            for dr, dc in rays:
+                piece_pos, piece = self._get_first_piece(position, (dr, dc))
+                if piece and piece.team == team:
+                    name = piece.name.upper()
+                    if name == slider_name or (name == 'L' and not piece.promoted and (dr, dc) == (team, 0)):
+                        attackers.append((piece_pos, piece))
+
+        return attackers
+
+
+    def _get_first_piece(self, position: Tuple[int, int], direction: Tuple[int, int]):
+        r, c = position
+        dr, dc = direction
+        r, c = r + dr, c + dc
+
+        while is_in_board((r, c)):
+            if self.board[r][c]:
+                return (r, c), self.board[r][c]
+            r, c = r + dr, c + dc
+
+        return None, None
+
+
+    def get_checkers(self, player: ShogiPlayer) -> List[Tuple[Tuple[int, int], ShogiPiece]]:
+        '''
+        所有正在將軍 player 的王將/玉將的敵方棋子
         '''
         king_pos = self.our_king_pos if player.team == 1 else self.opponent_king_pos
-        all_opponent_pieces_name = self.OPPONENT_PIECES_NAME if player.team == 1 else self.OUR_PIECES_NAME
-        all_opponent_moves = []
-        board = copy.deepcopy(self.board)
+        return self.get_attackers(king_pos, -player.team)
 
-        for r, row in enumerate(board):
-            for c, cell in enumerate(row):
-                if cell and (cell.name in all_opponent_pieces_name):
-                    valid_moves = cell.get_valid_moves((r, c), board)
-                    all_opponent_moves.extend(valid_moves)
 
-        king_r, king_c = king_pos
-        king = self.board[king_r][king_c]
+    def is_in_check(self, player: ShogiPlayer) -> bool:
+        '''
+        檢查王將/玉將是否被將軍，結果會保留到下一次 make_move / unmake_move
+        '''
+        is_check = self._check_cache.get(player.team)
 
-        king_valid_moves = king.get_valid_moves((king_r, king_c), self.board)
-        king_src_pos = king_valid_moves[-1][:2]  # 隨機取一個移動步，然後取前半段，即為當前位置(src)的 notation
-        all_opponent_dst = [move[2:4] for move in all_opponent_moves]  # 取 dst 且不取升變步的 notation
+        if is_check is None:
+            is_check = self._check_cache[player.team] = len(self.get_checkers(player)) > 0
 
-        return king_src_pos in set(all_opponent_dst)
+        return is_check
     
 
-    def _get_king_evade_moves(self, player: ShogiPlayer) -> Set[str]:
+    def legal_moves(self, player: ShogiPlayer) -> List[int]:
         '''
-        王將/玉將不會被將軍的移動
+        player 所有的合法走步 (包含打入)
+
+        先找出將軍的棋子與被牽制的棋子，直接產生合法走步，不需要試走後再檢查是否被將軍
         '''
-        king_pos = self.our_king_pos if player.team == 1 else self.opponent_king_pos
-        all_opponent_pieces_name = self.OPPONENT_PIECES_NAME if player.team == 1 else self.OUR_PIECES_NAME
-        all_opponent_moves = []
-        board = copy.deepcopy(self.board)
+        team = player.team
+        king_pos = self.our_king_pos if team == 1 else self.opponent_king_pos
+        checkers = self.get_attackers(king_pos, -team)
+        self._check_cache[team] = len(checkers) > 0
+        moves = self._get_king_moves(king_pos, team)
+
+        # 雙將: 只能移動王將/玉將
+        if len(checkers) > 1:
+            return moves
+
+        pins = self._get_pins(king_pos, team)
+
+        # 被將軍: 只能吃掉將軍的棋子，或是擋在兩者之間
+        if checkers:
+            checker_pos, _ = checkers[0]
+            between_squares = self._get_between_squares(king_pos, checker_pos)
+            targets = set(between_squares)
+            targets.add(checker_pos[0] * 9 + checker_pos[1])
+
+            moves.extend(self._get_piece_moves(king_pos, team, targets, pins))
+            moves.extend(self._get_drop_evade_moves(player, between_squares))
+        else:
+            moves.extend(self._get_piece_moves(king_pos, team, None, pins))
+            moves.extend(self._get_drop_moves(player, [r * 9 + c for r, c in self._get_all_empty_cells()]))
 
-        for r, row in enumerate(board):
-            for c, cell in enumerate(row):
-                if cell and (cell.name in all_opponent_pieces_name):
-                    valid_moves = cell.get_valid_moves((r, c), board)
-                    all_opponent_moves.extend(valid_moves)
-        
+        return moves
+
+
+    def _get_king_moves(self, king_pos: Tuple[int, int], team: int) -> List[int]:
+        '''
+        王將/玉將移動到不被攻擊的格子，查詢時先拿開王將，避免沿著將軍的射線後退
+        '''
         king_r, king_c = king_pos
         king = self.board[king_r][king_c]
+        self.board[king_r][king_c] = None
 
-        king_valid_moves = king.get_valid_moves((king_r, king_c), self.board)
-        king_src_pos = king_valid_moves[-1][:2]  # 隨機取一個移動步，然後取前半段，即為當前位置(src)的 notation
-        all_king_dst = [king_src_pos] + [move[2:] for move in king_valid_moves]
-        all_opponent_dst = [move[2:4] for move in all_opponent_moves]  # 取所有 dst 且不取升變步的 notation
-        king_safe_pos = list(set(all_king_dst) - set(all_opponent_dst))
+        king_moves = [
+            move for move in king.get_valid_moves(king_pos, self.board)
+            if not self.get_attackers(SQUARE_POS[move >> MOVE_DST_SHIFT & MOVE_SQUARE_MASK], -team)
+        ]
 
-        king_evade_moves = set([king_src_pos + king_dst_pos for king_dst_pos in king_safe_pos])  # concate back to king evade move
-        return king_evade_moves
+        self.board[king_r][king_c] = king
+        return king_moves
 
 
-    def _get_piece_evade_moves(self, player: ShogiPlayer) -> Set[str]:
+    def _get_piece_moves(self, king_pos: Tuple[int, int], team: int, targets: Optional[Set[int]], pins: Dict[int, Set[int]]) -> List[int]:
         '''
-        檢查一般棋子移動後是否仍然被將軍，如果王將不再被將軍，則該移動是一個有效的閃避走步
+        王將/玉將以外的棋子: 被將軍時只能走到 targets，被牽制時只能沿著牽制的直線移動
         '''
-        piece_evade_moves = []
-        all_our_moves = []
-        all_our_pieces_name = self.OUR_PIECES_NAME if player.team == 1 else self.OPPONENT_PIECES_NAME
-        board = copy.deepcopy(self.board)
+        moves = []
 
-        for src_r, row in enumerate(board):
-            for src_c, cell in enumerate(row):
-                if cell and (cell.name in all_our_pieces_name):
-                    valid_moves = cell.get_valid_moves((src_r, src_c), board)
-                    all_our_moves.extend(valid_moves)
+        for src_r, row in enumerate(self.board):
+            for src_c, piece in enumerate(row):
+                if not piece or piece.team != team or (src_r, src_c) == king_pos:
+                    continue
 
-        for move in all_our_moves:
-            src_r, src_c, _ = parse_string_to_pos(move[:2])
-            dst_r, dst_c, is_promoted = parse_string_to_pos(move[2:])
+                pin_line = pins.get(src_r * 9 + src_c)
 
-            # 先移動看看
-            piece = board[src_r][src_c]
-            if is_promoted:
-                piece.promoted = True
-            board[src_r][src_c] = None
-            board[dst_r][dst_c] = piece
+                for move in piece.get_valid_moves((src_r, src_c), self.board):
+                    dst_sq = move >> MOVE_DST_SHIFT & MOVE_SQUARE_MASK
+                    if (targets is None or dst_sq in targets) and (pin_line is None or dst_sq in pin_line):
+                        moves.append(move)
 
-            if not self.is_in_check(player):  # 檢查移動後王將是否仍然被將軍
-                piece_evade_moves.append(move)
+        return moves
 
-            # 檢查後盤面需復原
-            piece = board[dst_r][dst_c]
-            if is_promoted:
-                piece.promoted = False
-            board[dst_r][dst_c] = None
-            board[src_r][src_c] = piece
 
-        return set(piece_evade_moves)
+    def _get_drop_moves(self, player: ShogiPlayer, drop_squares: List[int]) -> List[int]:
+        '''
+        打入到 drop_squares (皆為空格): 每種持駒只產生一次，並套用二步與不能打入無法移動位置的規則
+        '''
+        team = player.team
+        pawn_files = {}  # 直行 -> 是否已有未升變的步兵 (と金不算)，只檢查用到的直行
+        moves = []
+
+        for kind in player.hand:
+            forbidden_rows = self._get_drop_forbidden_rows(kind, team)
+            is_pawn = kind == 'P'
 
+            for sq in drop_squares:
+                drop_r, drop_c = SQUARE_POS[sq]
+                if drop_r in forbidden_rows:
+                    continue
 
-    def _get_drop_evade_moves(self, player: ShogiPlayer) -> Set[str]:
-        all_evade_drops = []
-        all_our_captured = player.captured
-        all_empty_cells = self._get_all_empty_cells()
-        board = copy.deepcopy(self.board)
+                if is_pawn:
+                    if drop_c not in pawn_files:
+                        pawn_files[drop_c] = any(self._is_unpromoted_pawn(self.board[r][drop_c], team) for r in range(9))
+                    if pawn_files[drop_c]:
+                        continue
 
-        for piece_name in all_our_captured:
-            for drop_pos in all_empty_cells:
-                dst_r, dst_c = drop_pos
+                moves.append(encode_drop(kind, (drop_r, drop_c)))
 
-                # 先打入看看
-                if self._can_drop_piece(piece_name, drop_pos, player):
-                    board[dst_r][dst_c] = self.PIECES[piece_name.upper()](piece_name, player.team)
+        return moves
 
-                if not self.is_in_check(player):  # 檢查移動後王將是否仍然被將軍
-                    move = parse_drop_to_string(piece_name, drop_pos)
-                    all_evade_drops.append(move)
 
-                # 檢查後盤面需復原
-                board[dst_r][dst_c] = None
+    def _get_drop_evade_moves(self, player: ShogiPlayer, between_squares: List[int]) -> List[int]:
+        '''
+        被將軍時的打入: 只有擋在滑行將軍的棋子與王將/玉將之間才有用，只走訪兩者之間的格子
+        (桂馬或相鄰棋子的將軍沒有可以打入的格子)
+        '''
+        if not between_squares or not player.hand:
+            return []
+
+        return self._get_drop_moves(player, between_squares)
+
+
+    def _get_drop_forbidden_rows(self, piece_name: str, team: int) -> List[int]:
+        '''
+        桂馬、香車與步兵不能打入之後無法移動的位置
+        '''
+        if piece_name in self.KINGHT_LANCE_PIECE_NAME:
+            return self.OUR_NL_DROP_FORBIDDEN_ZONE if team == 1 else self.OPPONENT_NL_DROP_FORBIDDEN_ZONE
+        if piece_name in self.PAWN_PIECE_NAME:
+            return [self.OUR_P_DROP_FORBIDDEN_ZONE if team == 1 else self.OPPONENT_P_DROP_FORBIDDEN_ZONE]
+        return []
+
+
+    def _get_pins(self, king_pos: Tuple[int, int], team: int) -> Dict[int, Set[int]]:
+        '''
+        被牽制的棋子: 格子 -> 可以移動的格子 (王將/玉將與牽制的棋子之間，包含吃掉牽制的棋子)
+        '''
+        king_r, king_c = king_pos
+        pins = {}
+
+        for dr, dc in self.ROOK_RAYS + self.BISHOP_RAYS:
+            line = []
+            pinned_sq = None
+            r, c = king_r + dr, king_c + dc
+
+            while is_in_board((r, c)):
+                line.append(r * 9 + c)
+                piece = self.board[r][c]
+
+                if piece:
+                    if piece.team == team and pinned_sq is None:
+                        pinned_sq = r * 9 + c
+                    else:
+                        if piece.team != team and pinned_sq is not None and self._is_sliding_attacker(piece, (-dr, -dc)):
+                            pins[pinned_sq] = set(line)
+                        break
+
+                r, c = r + dr, c + dc
+
+        return pins
+
+
+    @staticmethod
+    def _is_unpromoted_pawn(piece: ShogiPiece, team: int) -> bool:
+        return piece is not None and piece.kind == 'P' and piece.team == team and not piece.promoted
+
+
+    @staticmethod
+    def _is_sliding_attacker(piece: ShogiPiece, direction: Tuple[int, int]) -> bool:
+        '''
+        piece 是否能沿著 direction 滑行攻擊 (飛車、角行與未升變的香車)
+        '''
+        dr, dc = direction
+
+        if piece.kind == 'R':
+            return dr == 0 or dc == 0
+        if piece.kind == 'B':
+            return dr != 0 and dc != 0
+        return piece.kind == 'L' and not piece.promoted and direction == (-piece.team, 0)
+
+
+    @staticmethod
+    def _get_between_squares(from_pos: Tuple[int, int], to_pos: Tuple[int, int]) -> List[int]:
+        '''
+        同一直線上兩個格子之間的格子，不在同一直線上 (例如桂馬) 則沒有
+        '''
+        from_r, from_c = from_pos
+        to_r, to_c = to_pos
+        dr, dc = to_r - from_r, to_c - from_c
+
+        if dr and dc and abs(dr) != abs(dc):
+            return []
+
+        step_r, step_c = (dr > 0) - (dr < 0), (dc > 0) - (dc < 0)
+        squares = []
+        r, c = from_r + step_r, from_c + step_c
+
+        while (r, c) != (to_r, to_c):
+            squares.append(r * 9 + c)
+            r, c = r + step_r, c + step_c
+
+        return squares
 
-        return set(all_evade_drops)
-    
 
     def _get_all_empty_cells(self) -> List[Tuple[int, int]]:
         all_empty_cells = []
@@ -343,9 +685,5 @@ class ShogiBoard:
         return all_empty_cells
 
 
-    def get_all_king_evade_moves(self, player: ShogiPlayer):
-        king_evade_moves = self._get_king_evade_moves(player)
-        king_evade_moves &= self._get_piece_evade_moves(player)
-        king_evade_moves |= self._get_drop_evade_moves(player)
-
-        return king_evade_moves
\ No newline at end of file
+    def get_all_king_evade_moves(self, player: ShogiPlayer) -> Set[int]:
+        return set(self.legal_moves(player))
\ No newline at end of file
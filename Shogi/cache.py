@@ -0,0 +1,101 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from django.conf import settings
+from .game import ShogiGame
+
+# 每個 worker 各自保存還原好的 ShogiGame，以 (game uid, Game.version) 驗證是否還是最新的局面
+# 設定: settings.SHOGI_GAME_CACHE = {'MAX_ENTRIES': 數量上限, 'MAX_SIZE': 估計的記憶體上限 (bytes)}
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_SIZE = 32 * 1024 * 1024
+
+HASH_ENTRY_SIZE = 100  # position_counts 每個 hash 約佔的 bytes (dict entry + int)
+
+
+def estimate_size(shogi_game: ShogiGame) -> int:
+    '''
+    ShogiGame 大約佔用的記憶體: 盤面、局面紀錄與 hash 計數 (棋子是共用的 flyweight，不計入)
+    '''
+    board = shogi_game.board
+    return (sum(sys.getsizeof(row) for row in board.board) + sys.getsizeof(board.position_history)
+            + sys.getsizeof(board.position_counts) + len(board.position_counts) * HASH_ENTRY_SIZE)
+
+
+class ShogiGameCache:
+    '''
+    LRU cache，超過數量或大小上限時移除最久沒用到的遊戲
+
+    get 會把遊戲從 cache 取出 (同一個 ShogiGame 不會同時交給兩個 request)，
+    保存成功後再以新的 version put 回來；走步失敗時不放回，下次重新從資料庫還原
+    '''
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entries: 'OrderedDict[str, Tuple[int, ShogiGame, int]]' = OrderedDict()  # uid -> (version, game, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, uid, version: int) -> Optional[ShogiGame]:
+        with self._lock:
+            entry = self._entries.pop(str(uid), None)
+            if entry:
+                self._size -= entry[2]
+
+            if entry and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, uid, version: int, shogi_game: ShogiGame) -> None:
+        size = estimate_size(shogi_game)
+
+        with self._lock:
+            old_entry = self._entries.pop(str(uid), None)
+            if old_entry:
+                self._size -= old_entry[2]
+
+            if size > self.max_size or not self.max_entries:
+                return
+
+            self._entries[str(uid)] = (version, shogi_game, size)
+            self._size += size
+
+            while len(self._entries) > self.max_entries or self._size > self.max_size:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, uid) -> None:
+        with self._lock:
+            entry = self._entries.pop(str(uid), None)
+            if entry:
+                self._size -= entry[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self._size,
+                'max_entries': self.max_entries,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_cache_settings = getattr(settings, 'SHOGI_GAME_CACHE', {})
+game_cache = ShogiGameCache(_cache_settings.get('MAX_ENTRIES', DEFAULT_MAX_ENTRIES), _cache_settings.get('MAX_SIZE', DEFAULT_MAX_SIZE))
@@ -0,0 +1,174 @@
+from typing import Iterable, List, Optional, Tuple
+from .piece import ShogiPiece
+from .player import ShogiHand
+from .move import DROP_PIECES
+from .sfen import PIECE_CLASSES
+
+# 固定 32 bytes (256 bits) 的局面編碼，以 Huffman code 表示盤面與持駒 (不包含手數)
+# bit 由低到高依序為:
+#   1. 先手 (team = 1) 與後手 (team = -1) 王將/玉將的格子，各 7 bits (81 表示不在盤上)
+#   2. 輪到的一方 1 bit (0: team = 1, 1: team = -1)，只有雙方的王都在盤上時才有
+#   3. 王以外的 79 個格子 (r * 9 + c 的順序): 空格 1 bit，棋子為 Huffman code + 升變 (金將沒有) + team
+#   4. 持駒: 先手再後手，依 R B G S N L P 的順序，每一枚為 Huffman code + 升變 (固定為 0，金將沒有) + team
+# 雙方共 40 枚棋子都在盤上或持駒中時剛好是 256 bits，少了棋子的局面無法編碼
+
+PACKED_POSITION_SIZE = 32
+PACKED_POSITION_BITS = PACKED_POSITION_SIZE * 8
+
+NO_KING = 81
+
+# 依寫入順序的 bits (左邊的 bit 先寫入)
+BOARD_CODES = {None: '0', 'P': '10', 'L': '1100', 'N': '1101', 'S': '1110', 'G': '11110', 'B': '111110', 'R': '111111'}
+HAND_CODES = {kind: code[1:] for kind, code in BOARD_CODES.items() if kind}  # 持駒不會是空格，省略第一個 bit
+
+Position = Tuple[List[List[ShogiPiece]], ShogiHand, ShogiHand, int]
+
+
+def _to_bits(code: str) -> Tuple[int, int]:
+    '''把依寫入順序的 bits 轉為 (值, 長度)，第一個 bit 放在最低位'''
+    return int(code[::-1], 2), len(code)
+
+
+def _piece_bits(code: str, kind: str, team: int, promoted: bool) -> Tuple[int, int]:
+    code += ('1' if promoted else '0') if kind != 'G' else ''
+    code += '0' if team == 1 else '1'
+    return _to_bits(code)
+
+
+# (棋子種類, team, 是否升變) -> 盤上棋子的 (值, 長度)
+BOARD_PIECE_BITS = {
+    (kind, team, promoted): _piece_bits(code, kind, team, promoted)
+    for kind, code in BOARD_CODES.items() if kind
+    for team in (1, -1)
+    for promoted in ((False, True) if kind != 'G' else (False,))
+}
+# (棋子種類, team) -> 持駒的 (值, 長度)
+HAND_PIECE_BITS = {(kind, team): _piece_bits(HAND_CODES[kind], kind, team, False) for kind in DROP_PIECES for team in (1, -1)}
+
+
+def _build_decode_table(codes) -> List[Tuple[Optional[str], int]]:
+    '''
+    以最長 code 長度的 bits 直接查表: 低位的 bits -> (棋子種類, code 長度)
+    '''
+    max_len = max(len(code) for code in codes.values())
+    table = [None] * (1 << max_len)
+
+    for kind, code in codes.items():
+        value, length = _to_bits(code)
+        for high in range(1 << (max_len - length)):
+            table[value | high << length] = (kind, length)
+
+    return table
+
+
+BOARD_DECODE_TABLE = _build_decode_table(BOARD_CODES)
+HAND_DECODE_TABLE = _build_decode_table(HAND_CODES)
+BOARD_DECODE_MASK = len(BOARD_DECODE_TABLE) - 1
+HAND_DECODE_MASK = len(HAND_DECODE_TABLE) - 1
+
+
+def pack_position(board: List[List[ShogiPiece]], our_hand: ShogiHand, opponent_hand: Optional[ShogiHand], side_to_move: int) -> bytes:
+    king_sq = {1: NO_KING, -1: NO_KING}
+
+    for r, row in enumerate(board):
+        for c, piece in enumerate(row):
+            if piece and piece.kind == 'K':
+                king_sq[piece.team] = r * 9 + c
+
+    packed = king_sq[1] | king_sq[-1] << 7
+    pos = 14
+
+    if king_sq[1] != NO_KING and king_sq[-1] != NO_KING:
+        packed |= (0 if side_to_move == 1 else 1) << pos
+        pos += 1
+
+    for r, row in enumerate(board):
+        for c, piece in enumerate(row):
+            if not piece:
+                pos += 1  # 空格為 0
+            elif piece.kind != 'K':
+                value, length = BOARD_PIECE_BITS[piece.kind, piece.team, piece.promoted]
+                packed |= value << pos
+                pos += length
+
+    for team, hand in ((1, our_hand), (-1, opponent_hand)):
+        for kind in hand or ():
+            value, length = HAND_PIECE_BITS[kind, team]
+            for _ in range(hand.count(kind)):
+                packed |= value << pos
+                pos += length
+
+    if pos != PACKED_POSITION_BITS:
+        raise Exception("Position can't be packed!")
+
+    return packed.to_bytes(PACKED_POSITION_SIZE, 'little')
+
+
+def unpack_position(data: bytes) -> Position:
+    '''
+    Returns (board, 先手的持駒, 後手的持駒, 輪到的一方)
+    '''
+    if len(data) != PACKED_POSITION_SIZE:
+        raise Exception("Incorrect packed position!")
+
+    packed = int.from_bytes(data, 'little')
+    our_king_sq, opponent_king_sq = packed & 0x7F, packed >> 7 & 0x7F
+    pos = 14
+
+    if our_king_sq > NO_KING or opponent_king_sq > NO_KING or our_king_sq == opponent_king_sq:
+        raise Exception("Incorrect packed position!")
+
+    side_to_move = 1
+    if our_king_sq != NO_KING and opponent_king_sq != NO_KING:
+        side_to_move = -1 if packed >> pos & 1 else 1
+        pos += 1
+
+    board = [[None for _ in range(9)] for _ in range(9)]
+
+    for sq in range(81):
+        r, c = divmod(sq, 9)
+
+        if sq == our_king_sq or sq == opponent_king_sq:
+            team = 1 if sq == our_king_sq else -1
+            board[r][c] = PIECE_CLASSES['K']('k' if team == 1 else 'K', team)
+            continue
+
+        kind, length = BOARD_DECODE_TABLE[packed >> pos & BOARD_DECODE_MASK]
+        pos += length
+
+        if kind:
+            promoted = False
+            if kind != 'G':
+                promoted = bool(packed >> pos & 1)
+                pos += 1
+            team = -1 if packed >> pos & 1 else 1
+            pos += 1
+            board[r][c] = PIECE_CLASSES[kind](kind.lower() if team == 1 else kind, team, promoted)
+
+    hands = {1: ShogiHand(), -1: ShogiHand()}
+
+    while pos < PACKED_POSITION_BITS:
+        kind, length = HAND_DECODE_TABLE[packed >> pos & HAND_DECODE_MASK]
+        pos += length if kind == 'G' else length + 1  # 持駒的升變 bit 固定為 0
+        hands[-1 if packed >> pos & 1 else 1].add(kind)
+        pos += 1
+
+    if pos != PACKED_POSITION_BITS:
+        raise Exception("Incorrect packed position!")
+
+    return board, hands[1], hands[-1], side_to_move
+
+
+def pack_positions(positions: Iterable[Position]) -> bytes:
+    '''
+    多個局面一次編碼，每個局面固定 PACKED_POSITION_SIZE bytes，直接串接
+    '''
+    return b"".join(pack_position(*position) for position in positions)
+
+
+def unpack_positions(data: bytes) -> List[Position]:
+    if len(data) % PACKED_POSITION_SIZE:
+        raise Exception("Incorrect packed position!")
+
+    view = memoryview(data)
+    return [unpack_position(bytes(view[idx:idx + PACKED_POSITION_SIZE])) for idx in range(0, len(data), PACKED_POSITION_SIZE)]
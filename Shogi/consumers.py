@@ -1,12 +1,28 @@
 import json
+import uuid
+from urllib.parse import parse_qs
 
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+from .services import MoveError, check_game_player, check_game_exists, submit_move, load_snapshot, load_resync, game_group_name
+from .spectators import spectator_hub
+
+MULTIPLEX_MAX_GAMES = 100  # 一個多工連線最多追蹤的遊戲數量
+
 
 class GameConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.game_uid = self.scope["url_route"]["kwargs"]["game_uid"]
-        self.game_group_name = f"game_{self.game_uid}"
+        self.game_group_name = game_group_name(self.game_uid)
+
+        # 只有玩家可以加入 game group，其他人收到錯誤 (指向觀戰用的 watch/ 連線) 後關閉
+        try:
+            await database_sync_to_async(check_game_player)(self.game_uid, self.scope.get("user"))
+        except MoveError as e:
+            await self.accept()
+            await self.send_error(e.detail, e.status_code)
+            return await self.close(code=4000 + e.status_code)
 
         # Join game group
         await self.channel_layer.group_add(
@@ -16,6 +32,11 @@ class GameConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        # 連線時先傳完整的局面，之後只傳每一手的變動
+        # 重新連線的玩家以 ?since=<收到的最後一個 seq> 只取得漏掉的幾手
+        since = parse_qs(self.scope.get("query_string", b"").decode()).get("since")
+        await self.send_resync(since[0] if since else None)
+
     async def disconnect(self, close_code):
         # Leave game group
         await self.channel_layer.group_discard(
@@ -24,18 +45,180 @@ class GameConsumer(AsyncWebsocketConsumer):
         )
 
     # Receive message from WebSocket
+    # 玩家送出走步: {"type": "move", "move": "c3c4"}，錯誤只回傳給送出的玩家
+    # 要求重新同步: {"type": "resync"} 傳送完整局面，{"type": "resync", "since": 12} 只傳第 12 手之後的走步
     async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json["message"]
+        try:
+            text_data_json = json.loads(text_data)
+        except json.JSONDecodeError:
+            return await self.send_error('Invalid JSON.', 400)
+
+        message_type = text_data_json.get("type") if isinstance(text_data_json, dict) else None
+        if message_type == "resync":
+            return await self.send_resync(text_data_json.get("since"))
+        if message_type != "move":
+            return await self.send_error('Unknown message type.', 400)
+
+        user = self.scope.get("user")
+        if not user or not user.is_authenticated:
+            return await self.send_error('Authentication credentials were not provided.', 403)
+
+        # 驗證與保存走步會存取資料庫，在 thread pool 中執行，不阻塞 event loop
+        try:
+            shogi_board_data, _, _ = await database_sync_to_async(submit_move)(self.game_uid, user.username, text_data_json.get("move"))
+        except MoveError as e:
+            return await self.send_error(e.detail, e.status_code)
 
         # Send message to game group
         await self.channel_layer.group_send(
-            self.game_group_name, {"type": "game_update", "message": message}
+            self.game_group_name, {"type": "game_update", "message": shogi_board_data}
         )
 
+    async def send_resync(self, since=None, game_uid=None) -> bool:
+        '''
+        傳送 game_uid (預設為這個連線的遊戲) 的 snapshot 或第 since 手之後的走步，失敗時傳送錯誤並回傳 False
+        '''
+        game_uid = game_uid or self.game_uid
+
+        if since is not None:
+            try:
+                since = int(since)
+            except (TypeError, ValueError):
+                await self.send_error('since must be an integer.', 400, game_uid)
+                return False
+
+        try:
+            if since is None:
+                messages = [await database_sync_to_async(load_snapshot)(game_uid)]
+            else:
+                messages = await database_sync_to_async(load_resync)(game_uid, since)
+        except MoveError as e:
+            await self.send_error(e.detail, e.status_code, game_uid)
+            return False
+
+        for message in messages:
+            await self.send_message(message)
+        return True
+
+    async def send_message(self, message: dict):
+        await self.send(text_data=json.dumps(message))
+
+    async def send_error(self, detail: str, status_code: int, game_uid=None):
+        error = {"type": "error", "detail": detail, "status": status_code}
+        if game_uid and game_uid != self.game_uid:
+            error["game_id"] = str(game_uid)  # 多工連線的錯誤標示是哪一場遊戲
+        await self.send(text_data=json.dumps(error))
+
     # Receive message from room group
     async def game_update(self, event):
-        message = event["message"]
+        # Send message to WebSocket (messages.py 的 move 訊息)
+        await self.send_message(event["message"])
+
+
+class SpectatorConsumer(GameConsumer):
+    '''
+    觀戰者: 不加入 game group，由這個 worker 的 spectator_hub 合併走步後轉發，不影響玩家收到走步的延遲
+    只能要求 resync，不能走步
+    '''
+    async def connect(self):
+        self.game_uid = self.scope["url_route"]["kwargs"]["game_uid"]
+
+        # 遊戲不存在時收到錯誤後關閉，不會在 spectator_hub 留下訂閱
+        try:
+            await database_sync_to_async(check_game_exists)(self.game_uid)
+        except MoveError as e:
+            await self.accept()
+            await self.send_error(e.detail, e.status_code)
+            return await self.close(code=4000 + e.status_code)
+
+        await self.accept()
+
+        # 先訂閱再傳目前的局面，之間的走步 seq 不大於 snapshot 的會被用戶端略過
+        await spectator_hub.subscribe(self.game_uid, self)
+        since = parse_qs(self.scope.get("query_string", b"").decode()).get("since")
+        await self.send_resync(since[0] if since else None)
+
+    async def disconnect(self, close_code):
+        await spectator_hub.unsubscribe(self.game_uid, self)
+
+    async def receive(self, text_data):
+        try:
+            text_data_json = json.loads(text_data)
+        except json.JSONDecodeError:
+            return await self.send_error('Invalid JSON.', 400)
+
+        if not isinstance(text_data_json, dict) or text_data_json.get("type") != "resync":
+            return await self.send_error('Spectators can only request a resync.', 403)
+
+        await self.send_resync(text_data_json.get("since"))
+
+
+class MultiplexConsumer(GameConsumer):
+    '''
+    一個連線追蹤多場遊戲 (觀戰)，每個訊息都帶有 game_id
+        {"type": "subscribe", "game_id": uid, "since": 12}  (since 可省略，省略時傳 snapshot)
+        {"type": "unsubscribe", "game_id": uid}
+        {"type": "resync", "game_id": uid, "since": 12}
+    走步與觀戰者相同，經由 spectator_hub 轉發，連線本身不加入任何 group
+    '''
+    game_uid = None
+
+    async def connect(self):
+        self.game_uids = set()
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for game_uid in self.game_uids:
+            await spectator_hub.unsubscribe(game_uid, self)
+        self.game_uids.clear()
+
+    async def receive(self, text_data):
+        try:
+            text_data_json = json.loads(text_data)
+        except json.JSONDecodeError:
+            return await self.send_error('Invalid JSON.', 400)
+
+        if not isinstance(text_data_json, dict):
+            return await self.send_error('Unknown message type.', 400)
+
+        try:
+            game_uid = str(uuid.UUID(str(text_data_json.get("game_id"))))
+        except ValueError:
+            return await self.send_error('game_id must be a game uid.', 400)
+
+        message_type = text_data_json.get("type")
+        if message_type == "subscribe":
+            await self.subscribe(game_uid, text_data_json.get("since"))
+        elif message_type == "unsubscribe":
+            await self.unsubscribe(game_uid)
+        elif message_type == "resync" and game_uid in self.game_uids:
+            await self.send_resync(text_data_json.get("since"), game_uid)
+        elif message_type == "resync":
+            await self.send_error('Not subscribed to this game.', 400, game_uid)
+        else:
+            await self.send_error('Unknown message type.', 400, game_uid)
+
+    async def subscribe(self, game_uid: str, since=None):
+        if game_uid not in self.game_uids:
+            if len(self.game_uids) >= MULTIPLEX_MAX_GAMES:
+                return await self.send_error(f'At most {MULTIPLEX_MAX_GAMES} games per connection.', 400, game_uid)
+
+            try:
+                await database_sync_to_async(check_game_exists)(game_uid)
+            except MoveError as e:
+                return await self.send_error(e.detail, e.status_code, game_uid)
+
+            await spectator_hub.subscribe(game_uid, self)
+            self.game_uids.add(game_uid)
+
+        # since 不正確時取消訂閱
+        if not await self.send_resync(since, game_uid):
+            await self.unsubscribe(game_uid, notify=False)
+
+    async def unsubscribe(self, game_uid: str, notify: bool = True):
+        if game_uid in self.game_uids:
+            self.game_uids.discard(game_uid)
+            await spectator_hub.unsubscribe(game_uid, self)
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({"message": message}))
\ No newline at end of file
+        if notify:
+            await self.send_message({"type": "unsubscribed", "game_id": game_uid})
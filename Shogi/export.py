@@ -0,0 +1,68 @@
+import json
+import zlib
+from typing import AsyncIterator, Iterable, Iterator
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch, QuerySet
+from .models import Game, GameStatus, Move
+from .move import move_to_string
+
+EXPORT_CHUNK_SIZE = 500  # 每次從資料庫取出的遊戲數量
+
+
+def finished_games() -> QuerySet:
+    '''
+    已結束的遊戲，依 (timestamp, uid) 排序，不載入局面編碼，棋譜以 prefetch 一起取出
+    '''
+    return (Game.objects.filter(status=GameStatus.FINISHED)
+            .select_related('our_player__user', 'opponent_player__user', 'winner__user')
+            .prefetch_related(Prefetch('moves', queryset=Move.objects.only('game_id', 'ply', 'move')))
+            .defer('binary_game')
+            .order_by('timestamp', 'uid'))
+
+
+def game_to_dict(game: Game) -> dict:
+    return {
+        'uid': str(game.uid),
+        'our_player': game.our_player.user.username if game.our_player else None,
+        'opponent_player': game.opponent_player.user.username if game.opponent_player else None,
+        'winner': game.winner.user.username if game.winner else None,  # None 為和局
+        'move_count': game.move_count,
+        'moves': [move_to_string(game_move.move) for game_move in game.moves.all()],
+        'sfen': game.sfen,
+        'timestamp': game.timestamp.isoformat(),
+    }
+
+
+def iter_ndjson(queryset: QuerySet, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    '''
+    每個遊戲一行 JSON，以 iterator 分批取出，記憶體用量與遊戲總數無關
+    '''
+    for game in queryset.iterator(chunk_size=chunk_size):
+        yield (json.dumps(game_to_dict(game), ensure_ascii=False) + "\n").encode('utf-8')
+
+
+def iter_gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    '''
+    邊產生邊壓縮成 gzip 格式
+    '''
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip header
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+async def aiter_chunks(chunks: Iterable[bytes]) -> AsyncIterator[bytes]:
+    '''
+    ASGI 下 StreamingHttpResponse 會以 sync_to_async(list) 一次讀完同步的 iterator，整份輸出都在記憶體中
+    改為每個 chunk 各自以 sync_to_async(next) 取出 (thread_sensitive: 資料庫的 cursor 一直在同一個 thread)
+    '''
+    chunks = iter(chunks)
+    while True:
+        chunk = await sync_to_async(next, thread_sensitive=True)(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
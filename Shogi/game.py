@@ -1,5 +1,8 @@
 from .player import ShogiPlayer
 from .board import ShogiBoard
+from .move import parse_move
+
+DRAW = 1e-4  # 千日手和局，get_game_ended 回傳的非零小數
 
 class ShogiGame:
     def __init__(self, our_player: ShogiPlayer, opponent_player: ShogiPlayer=None) -> None:
@@ -9,30 +12,81 @@ class ShogiGame:
         self.game_round = 0
 
 
-    def get_game_ended(self, our_player: ShogiPlayer, opponent_player: ShogiPlayer) -> int:            
+    @classmethod
+    def from_sfen(cls, sfen: str, our_player: ShogiPlayer, opponent_player: ShogiPlayer=None) -> 'ShogiGame':
+        game = cls(our_player, opponent_player)
+        game.game_round = game.board.insert_sfen(sfen) - 1
+        game.current_player, game.next_player = game.players[game.game_round % 2], game.players[1 - game.game_round % 2]
+
+        return game
+
+
+    @classmethod
+    def from_packed(cls, data: bytes, game_round: int, our_player: ShogiPlayer, opponent_player: ShogiPlayer=None,
+                    side_to_move: int = None, king_captured_by: int = 0) -> 'ShogiGame':
+        '''
+        packed 編碼不包含手數，也不包含王被吃掉的一方 (王不會進入持駒)
+        side_to_move 預設由 game_round 決定 (先手在偶數手走步)，king_captured_by 為吃掉王的 team (0 表示沒有)
+        '''
+        game = cls(our_player, opponent_player)
+        game.board.insert_packed(data, side_to_move or (1 if game_round % 2 == 0 else -1))
+        game.game_round = game_round
+        for player in game.players:
+            if player and player.team == king_captured_by:
+                player.king_captured = True
+        game.current_player, game.next_player = game.players[game.game_round % 2], game.players[1 - game.game_round % 2]
+
+        return game
+
+
+    def to_sfen(self) -> str:
+        return self.board.to_sfen(self.game_round + 1)
+
+
+    def to_packed(self) -> bytes:
+        return self.board.to_packed()
+
+
+    @property
+    def king_captured_by(self) -> int:
+        '''
+        吃掉對方王將/玉將的 team，0 表示沒有 (與 to_packed 一起保存，from_packed 時還原)
+        '''
+        for player in self.players:
+            if player and player.king_captured:
+                return player.team
+        return 0
+
+
+    def get_game_ended(self, our_player: ShogiPlayer, opponent_player: ShogiPlayer) -> int:
         '''
         Input:
-            player: current player (1 or -1)
+            our_player / opponent_player: the two players, in either order
 
         Returns:
-            result: 0 if game has not ended. 1 if player won, -1 if player lost,
+            result: 0 if game has not ended, otherwise the team of the winner,
                     small non-zero value for draw.
+
+        只有輪到走步的一方可能被上一步將死，且只有在被將軍時才需要找合法走步
         '''
-        result = 0
+        if our_player.team == self.board.side_to_move:
+            player, last_player = our_player, opponent_player
+        else:
+            player, last_player = opponent_player, our_player
+
+        # 上一步吃掉了王將/玉將 (execute_move 不禁止讓自己被將軍的走步)
+        if last_player.king_captured:
+            return last_player.team
 
-        # 先檢查我方是否被將死
-        is_our_king_check = self.board.is_in_check(our_player)
-        our_all_evade_moves = self.board.get_all_king_evade_moves(our_player)
-        if 'k' in opponent_player.captured or (is_our_king_check and len(our_all_evade_moves) == 0):
-            result = opponent_player.team
+        # 輪到的一方被將死
+        if self.board.is_in_check(player) and not self.board.legal_moves(player):
+            return last_player.team
 
-        # 再檢查敵方是否被將死
-        is_opponent_king_check = self.board.is_in_check(opponent_player)
-        opponent_all_evade_moves = self.board.get_all_king_evade_moves(opponent_player)
-        if 'K' in our_player.captured or (is_opponent_king_check and len(opponent_all_evade_moves) == 0):
-            result = our_player.team
+        # 千日手: 同一局面出現四次為和局
+        if self.board.is_repetition():
+            return DRAW
 
-        return result
+        return 0
 
 
     def play(self):
@@ -46,7 +100,7 @@ class ShogiGame:
             input_move = input('Input your move: ').strip()
 
             try:
-                self.board.execute_move(input_move, self.current_player)
+                self.board.execute_move(parse_move(input_move), self.current_player)
                 result = self.get_game_ended(self.current_player, self.next_player)
 
                 if result:
@@ -55,7 +109,9 @@ class ShogiGame:
                     # Final board
                     print(self.board)
 
-                    if winner == 1:
+                    if winner == DRAW:
+                        print("Draw by repetition (千日手)")
+                    elif winner == self.current_player.team:
                         print(f"Winner is {self.current_player.name}")
                     else:
                         print(f"Winner is {self.next_player.name}")
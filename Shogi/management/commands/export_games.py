@@ -0,0 +1,33 @@
+import sys
+from django.core.management.base import BaseCommand
+from Shogi.export import EXPORT_CHUNK_SIZE, finished_games, iter_ndjson, iter_gzip
+
+
+class Command(BaseCommand):
+    help = "Stream every finished game as NDJSON (one game per line)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="Output file (default: stdout)")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help=f"Games fetched per query (default: {EXPORT_CHUNK_SIZE})")
+
+    def handle(self, *args, **options):
+        self.count = 0
+        chunks = self._counted(iter_ndjson(finished_games(), options['chunk_size']))
+        if options['gzip']:
+            chunks = iter_gzip(chunks)
+
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.buffer.writelines(chunks)
+            sys.stdout.buffer.flush()
+
+        self.stderr.write(f"Exported {self.count} games")
+
+    def _counted(self, chunks):
+        for chunk in chunks:
+            self.count += 1
+            yield chunk
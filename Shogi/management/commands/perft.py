@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from Shogi.perft import PERFT_POSITIONS, PERFT_NPS_BASELINE, run_perft
+
+
+class Command(BaseCommand):
+    help = "Run perft on the benchmark positions and report nodes per second"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=3, help="Search depth (default: 3)")
+        parser.add_argument('--position', choices=sorted(PERFT_POSITIONS), action='append',
+                            help="Position to run, can be repeated (default: all)")
+        parser.add_argument('--check', action='store_true',
+                            help="Fail on wrong node counts or throughput below the recorded baseline")
+
+    def handle(self, *args, **options):
+        depth = options['depth']
+        if depth < 1:
+            raise CommandError("Depth must be at least 1.")
+
+        total_nodes, total_seconds, errors = 0, 0.0, []
+
+        for name in options['position'] or PERFT_POSITIONS:
+            nodes, seconds = run_perft(name, depth)
+            total_nodes += nodes
+            total_seconds += seconds
+
+            expected = PERFT_POSITIONS[name][1].get(depth)
+            status = "" if expected is None else (" ok" if nodes == expected else f" expected {expected}")
+            if expected is not None and nodes != expected:
+                errors.append(f"{name}: {nodes} nodes, expected {expected}")
+
+            self.stdout.write(f"{name:<18} depth {depth}  {nodes:>10} nodes  {seconds:8.3f}s  {nodes / seconds:>10.0f} nps{status}")
+
+        nps = total_nodes / total_seconds
+        self.stdout.write(f"{'total':<18} depth {depth}  {total_nodes:>10} nodes  {total_seconds:8.3f}s  {nps:>10.0f} nps")
+
+        if options['check']:
+            if nps < PERFT_NPS_BASELINE:
+                errors.append(f"{nps:.0f} nps is below the baseline of {PERFT_NPS_BASELINE} nps")
+            if errors:
+                raise CommandError("\n".join(errors))
+            self.stdout.write(self.style.SUCCESS("Perft check passed"))
@@ -0,0 +1,76 @@
+from typing import Dict, List, Optional
+from .game import ShogiGame
+from .move import decode_move
+from .piece import ShogiPiece
+from .sfen import piece_to_sfen
+from .models import GameStatus
+
+# WebSocket 傳給玩家的訊息
+#   snapshot: 連線 (或 resync) 時的完整局面
+#     {"type": "snapshot", "game_id", "seq", "sfen", "players": {"b": 先手, "w": 後手}, "status", "winner", "draw"}
+#   move: 每一手只傳變動的部分
+#     {"type": "move", "game_id", "seq", "move", "changes": [{"square": "c4", "piece": "P"}],
+#      "hands": {"b": {"P": 1}}, "next_player", "winner", "draw"}
+#   batch: 觀戰者每隔一段時間收到的多個 move 訊息
+#     {"type": "batch", "game_id", "messages": [move, ...]}
+# seq 為局面的手數 (Game.move_count)，棋子與持駒的表示方式同 SFEN (先手大寫，piece 為 null 表示空格)
+# move 為正規化的記譜 (move.move_to_string，打入一律大寫)
+
+SIDES = {1: 'b', -1: 'w'}
+
+
+def square_name(pos) -> str:
+    r, c = pos
+    return chr(c + 97) + str(9 - r)
+
+
+def move_delta(shogi_game: ShogiGame, move: int, team: int, captured_piece: Optional[ShogiPiece]) -> Dict[str, object]:
+    '''
+    走完 move 之後盤面與持駒的變動，captured_piece 為走步前終點上的棋子
+    '''
+    src, dst, _, drop_piece = decode_move(move)
+    dst_r, dst_c = dst
+
+    changes: List[Dict[str, Optional[str]]] = []
+    if src:
+        changes.append({'square': square_name(src), 'piece': None})
+    changes.append({'square': square_name(dst), 'piece': piece_to_sfen(shogi_game.board.board[dst_r][dst_c])})
+
+    hands = {}
+    if drop_piece:
+        hands[SIDES[team]] = {drop_piece: -1}
+    elif captured_piece and captured_piece.kind != 'K':  # 吃掉的王不會進入持駒，遊戲直接結束
+        hands[SIDES[team]] = {captured_piece.kind: 1}
+
+    return {'changes': changes, 'hands': hands}
+
+
+def move_message(game_uid, seq: int, move: str, delta: Dict[str, object], next_player: str, winner: str = "", draw: bool = False) -> Dict[str, object]:
+    return {
+        'type': 'move',
+        'game_id': str(game_uid),
+        'seq': seq,
+        'move': move,
+        **delta,
+        'next_player': next_player,
+        'winner': winner,
+        'draw': draw,
+    }
+
+
+def snapshot_message(game, shogi_game: ShogiGame) -> Dict[str, object]:
+    '''
+    game: models.Game
+    '''
+    players = {side: player.name if player else None for side, player in zip(SIDES.values(), shogi_game.players)}
+
+    return {
+        'type': 'snapshot',
+        'game_id': str(game.uid),
+        'seq': shogi_game.game_round,
+        'sfen': shogi_game.to_sfen(),
+        'players': players,
+        'status': game.status,
+        'winner': game.winner.user.username if game.winner else "",
+        'draw': game.status == GameStatus.FINISHED and not game.winner_id,
+    }
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:54
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def replay_game_records(apps, schema_editor):
+    '''
+    以 game_record 重播棋譜，將原本以 pickle 保存的遊戲轉為 SFEN
+    無法重播的棋譜保留新欄位的預設值並記錄遊戲的 uid，不中斷整個 migrate
+    '''
+    from Shogi.migrations._legacy_replay import LegacyPosition, LegacyReplayError, replay_game_record
+
+    Game = apps.get_model('Shogi', 'Game')
+
+    for game in Game.objects.exclude(game_record=""):
+        try:
+            position, moves = replay_game_record(game.game_record)
+        except LegacyReplayError as e:
+            logger.warning("Game %s cannot be replayed (%s), keeping the initial position", game.uid, e)
+            continue
+
+        game.sfen = position.to_sfen()
+        game.move_count = position.ply
+        position_history = [LegacyPosition().zobrist_hash()] + [zobrist_hash for _, zobrist_hash in moves]
+        game.position_history = " ".join(f"{zobrist_hash:016x}" for zobrist_hash in position_history)
+        game.save(update_fields=['sfen', 'move_count', 'position_history'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shogi', '0008_remove_game_round'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='move_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='position_history',
+            field=models.TextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='sfen',
+            field=models.CharField(default='lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1', max_length=256),
+        ),
+        migrations.RunPython(replay_game_records, migrations.RunPython.noop),
+    ]
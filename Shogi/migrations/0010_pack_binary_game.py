@@ -0,0 +1,43 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:40
+
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+
+def pack_binary_game(apps, schema_editor):
+    '''
+    binary_game 原本是 pickle 的 ShogiGame，改為由 sfen 重新產生 32 bytes 的局面編碼
+    0009 無法重播的遊戲 (有棋譜但 move_count 為 0) 的 sfen 仍是起始局面: 保留原本的 pickle，並將遊戲標示為結束，
+    避免從第 0 手重新開始
+    '''
+    from Shogi.migrations._legacy_replay import LegacyPosition, LegacyReplayError
+
+    Game = apps.get_model('Shogi', 'Game')
+
+    for game in Game.objects.all():
+        if game.game_record.split() and not game.move_count:
+            logger.warning("Game %s was not replayed, keeping its pickled state and marking it finished", game.uid)
+            game.status = 'Finished'
+            game.save(update_fields=['status'])
+            continue
+
+        try:
+            game.binary_game = LegacyPosition.from_sfen(game.sfen).pack()
+        except LegacyReplayError as e:
+            logger.warning("Game %s cannot be packed (%s), keeping its pickled state", game.uid, e)
+            continue
+        game.save(update_fields=['binary_game'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shogi', '0009_game_move_count_game_position_history_game_sfen'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_binary_game, migrations.RunPython.noop),
+    ]
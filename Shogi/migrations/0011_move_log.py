@@ -0,0 +1,86 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:00
+
+import logging
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+logger = logging.getLogger(__name__)
+
+
+def split_game_records(apps, schema_editor):
+    '''
+    game_record 的每一手轉為一筆 Move
+    不保存 GameSnapshot: 沒有快照時 replay_shogi_game 從起始局面重播，之後的走步仍會定期保存
+    無法重播的棋譜 (0009 也已略過) 記錄遊戲的 uid，不建立 Move
+    '''
+    from Shogi.migrations._legacy_replay import LegacyReplayError, replay_game_record
+
+    Game = apps.get_model('Shogi', 'Game')
+    Move = apps.get_model('Shogi', 'Move')
+
+    for game in Game.objects.exclude(game_record=""):
+        try:
+            _, moves = replay_game_record(game.game_record)
+        except LegacyReplayError as e:
+            logger.warning("Game %s cannot be replayed (%s), no moves are logged", game.uid, e)
+            continue
+
+        Move.objects.bulk_create([
+            Move(game=game, ply=ply, move=move, position_hash=zobrist_hash - (1 << 64) if zobrist_hash >= 1 << 63 else zobrist_hash)
+            for ply, (move, zobrist_hash) in enumerate(moves, 1)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shogi', '0010_pack_binary_game'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Move',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply', models.PositiveIntegerField()),
+                ('move', models.PositiveIntegerField()),
+                ('position_hash', models.BigIntegerField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='moves', to='Shogi.game')),
+            ],
+            options={
+                'ordering': ['ply'],
+            },
+        ),
+        migrations.CreateModel(
+            name='GameSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ply', models.PositiveIntegerField()),
+                ('position', models.BinaryField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='Shogi.game')),
+            ],
+            options={
+                'ordering': ['ply'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='move',
+            constraint=models.UniqueConstraint(fields=('game', 'ply'), name='unique_game_move_ply'),
+        ),
+        migrations.AddConstraint(
+            model_name='gamesnapshot',
+            constraint=models.UniqueConstraint(fields=('game', 'ply'), name='unique_game_snapshot_ply'),
+        ),
+        migrations.RunPython(split_game_records, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='game',
+            name='game_record',
+        ),
+        migrations.RemoveField(
+            model_name='game',
+            name='position_history',
+        ),
+    ]
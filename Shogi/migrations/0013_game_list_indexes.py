@@ -0,0 +1,29 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shogi', '0012_game_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['-timestamp', '-uid'], name='game_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['status', '-timestamp', '-uid'], name='game_status_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['our_player', '-timestamp'], name='game_our_player_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['opponent_player', '-timestamp'], name='game_opponent_player_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shogi', '0013_game_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='rating',
+            field=models.FloatField(default=1500.0),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['-rating', 'id'], name='player_rating_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.6 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+def fill_king_captured_by(apps, schema_editor):
+    '''
+    快照都在偶數手保存 (輪到先手)，side_to_move 的預設值即正確
+    王被吃掉的快照: 編碼開頭的兩個 7 bits 為雙方王的格子，81 表示不在盤上 (被對方吃掉)
+    '''
+    GameSnapshot = apps.get_model('Shogi', 'GameSnapshot')
+
+    for snapshot in GameSnapshot.objects.all():
+        packed = int.from_bytes(bytes(snapshot.position), 'little')
+        if packed & 0x7F == 81:
+            snapshot.king_captured_by = -1
+        elif packed >> 7 & 0x7F == 81:
+            snapshot.king_captured_by = 1
+        else:
+            continue
+        snapshot.save(update_fields=['king_captured_by'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shogi', '0014_player_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamesnapshot',
+            name='king_captured_by',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gamesnapshot',
+            name='side_to_move',
+            field=models.SmallIntegerField(default=1),
+        ),
+        migrations.RunPython(fill_king_captured_by, migrations.RunPython.noop),
+    ]
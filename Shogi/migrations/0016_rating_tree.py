@@ -0,0 +1,46 @@
+# Generated by Django 4.2.6 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+# 同 Shogi/models.py 當時的設定
+RATING_BUCKETS = 4096
+
+
+def build_rating_tree(apps, schema_editor):
+    '''
+    由現有玩家的 rating 分布一次建立所有節點 (O(B) 的 Fenwick tree 建構)
+    '''
+    Player = apps.get_model('Shogi', 'Player')
+    RatingTreeNode = apps.get_model('Shogi', 'RatingTreeNode')
+
+    tree = [0] * (RATING_BUCKETS + 1)
+    for rating in Player.objects.values_list('rating', flat=True):
+        bucket = min(max(int(rating // 1), 0), RATING_BUCKETS - 1)
+        tree[RATING_BUCKETS - bucket] += 1
+
+    for idx in range(1, RATING_BUCKETS + 1):
+        parent = idx + (idx & -idx)
+        if parent <= RATING_BUCKETS:
+            tree[parent] += tree[idx]
+
+    RatingTreeNode.objects.bulk_create(
+        RatingTreeNode(node=idx, count=tree[idx]) for idx in range(1, RATING_BUCKETS + 1)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Shogi', '0015_gamesnapshot_side_to_move'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingTreeNode',
+            fields=[
+                ('node', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_rating_tree, migrations.RunPython.noop),
+    ]
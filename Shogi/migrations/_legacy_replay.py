@@ -0,0 +1,226 @@
+'''
+遷移專用的棋譜重播與局面編碼，凍結在 0009 ~ 0011 當時的格式，不引用 Shogi.board / Shogi.move / Shogi.codec 等會繼續修改的模組
+
+舊的引擎允許飛車、角行等穿過棋子，也允許金將升變，這些棋譜交給現在的 execute_move 會被拒絕，
+所以這裡只照棋譜搬動棋子，不檢查走法是否合法；無法表示的局面 (例如升變的金將) 丟出 LegacyReplayError
+'''
+import random
+from typing import Dict, List, Optional, Tuple
+
+INITIAL_SFEN = "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+
+DROP_PIECES = ['R', 'B', 'G', 'S', 'N', 'L', 'P']
+UNPROMOTABLE_KINDS = {'K', 'G'}
+
+# 走步的 int 編碼 (同 Shogi/move.py): src | dst << 7 | 升變 << 14 | (打入種類 index + 1) << 15
+MOVE_DST_SHIFT = 7
+MOVE_PROMOTE_FLAG = 1 << 14
+MOVE_DROP_SHIFT = 15
+
+# Zobrist keys (同 Shogi/board.py): 相同的種子與產生順序
+_zobrist_random = random.Random(20231015)
+ZOBRIST_PIECE_KEYS = {
+    (kind, team, promoted): [_zobrist_random.getrandbits(64) for _ in range(81)]
+    for kind, promoted in (('K', False), ('R', False), ('R', True), ('B', False), ('B', True), ('G', False), ('S', False),
+                           ('S', True), ('N', False), ('N', True), ('L', False), ('L', True), ('P', False), ('P', True))
+    for team in (1, -1)
+}
+ZOBRIST_HAND_KEYS = {
+    (team, kind): [_zobrist_random.getrandbits(64) for _ in range(19)]
+    for kind in 'KRBGSNLP'
+    for team in (1, -1)
+}
+ZOBRIST_SIDE_KEY = _zobrist_random.getrandbits(64)
+
+# 32 bytes 的局面編碼 (同 Shogi/codec.py): 雙方王的格子各 7 bits (81 表示不在盤上)、雙方的王都在盤上時輪到的一方 1 bit、
+# 王以外的每個格子 (空格 '0'，棋子為 Huffman code + 升變 (金將沒有) + team)、先手再後手的持駒 (code 省略第一個 bit)
+PACKED_POSITION_BITS = 256
+NO_KING = 81
+BOARD_CODES = {'P': '10', 'L': '1100', 'N': '1101', 'S': '1110', 'G': '11110', 'B': '111110', 'R': '111111'}
+
+Piece = Tuple[str, int, bool]  # (種類, team, 是否升變)
+
+
+class LegacyReplayError(Exception):
+    pass
+
+
+class LegacyPosition:
+    '''
+    board[r][c]: r = 0 為第 9 段，c = 0 為 a 行；先手 (team = 1) 先走
+    '''
+    def __init__(self) -> None:
+        self.board: List[List[Optional[Piece]]] = []
+        for sfen_row in INITIAL_SFEN.split()[0].split('/'):
+            row = []
+            for char in sfen_row:
+                if char.isdigit():
+                    row.extend([None] * int(char))
+                else:
+                    row.append((char.upper(), 1 if char.isupper() else -1, False))
+            self.board.append(row)
+
+        self.hands: Dict[int, Dict[str, int]] = {1: dict.fromkeys(DROP_PIECES, 0), -1: dict.fromkeys(DROP_PIECES, 0)}
+        self.ply = 0
+
+    @classmethod
+    def from_sfen(cls, sfen: str) -> 'LegacyPosition':
+        position = cls()
+        try:
+            sfen_board, side, sfen_hands, move_number = sfen.split()
+            position.board = []
+            for sfen_row in sfen_board.split('/'):
+                row, promoted = [], False
+                for char in sfen_row:
+                    if char == '+':
+                        promoted = True
+                    elif char.isdigit():
+                        row.extend([None] * int(char))
+                    elif char.upper() in 'KRBGSNLP' and not (promoted and char.upper() in UNPROMOTABLE_KINDS):
+                        row.append((char.upper(), 1 if char.isupper() else -1, promoted))
+                        promoted = False
+                    else:
+                        raise ValueError
+                position.board.append(row)
+
+            count = ""
+            for char in sfen_hands if sfen_hands != '-' else "":
+                if char.isdigit():
+                    count += char
+                else:
+                    position.hands[1 if char.isupper() else -1][char.upper()] += int(count or 1)
+                    count = ""
+
+            position.ply = int(move_number) - 1
+            if len(position.board) != 9 or any(len(row) != 9 for row in position.board) or side != ('b' if position.side_to_move == 1 else 'w'):
+                raise ValueError
+        except (KeyError, ValueError):
+            raise LegacyReplayError(f"incorrect SFEN {sfen}")
+
+        return position
+
+    @property
+    def side_to_move(self) -> int:
+        return 1 if self.ply % 2 == 0 else -1
+
+    def play(self, notation: str) -> int:
+        '''
+        執行一手棋譜 (a3a4 / h6h7+ / P*d4 / p*d4)，回傳走步的 int 編碼
+        '''
+        team = self.side_to_move
+
+        if len(notation) == 4 and notation[1] == '*':
+            kind, dst = notation[0].upper(), self._square(notation[2:])
+            if kind not in DROP_PIECES or not self.hands[team][kind] or self.board[dst[0]][dst[1]]:
+                raise LegacyReplayError(f"cannot drop {notation}")
+
+            self.hands[team][kind] -= 1
+            self.board[dst[0]][dst[1]] = (kind, team, False)
+            move = (dst[0] * 9 + dst[1]) << MOVE_DST_SHIFT | (DROP_PIECES.index(kind) + 1) << MOVE_DROP_SHIFT
+        elif len(notation) in (4, 5) and notation[4:] in ('', '+'):
+            src, dst, promote = self._square(notation[0:2]), self._square(notation[2:4]), notation[4:] == '+'
+            piece, captured = self.board[src[0]][src[1]], self.board[dst[0]][dst[1]]
+            if not piece or piece[1] != team or (captured and captured[1] == team):
+                raise LegacyReplayError(f"cannot move {notation}")
+            if promote and (piece[0] in UNPROMOTABLE_KINDS or piece[2]):
+                raise LegacyReplayError(f"cannot promote {notation}")
+
+            # 吃掉的棋子以未升變的種類放入持駒，王將只從盤上移除
+            if captured and captured[0] != 'K':
+                self.hands[team][captured[0]] += 1
+
+            self.board[src[0]][src[1]] = None
+            self.board[dst[0]][dst[1]] = (piece[0], team, piece[2] or promote)
+            move = (src[0] * 9 + src[1]) | (dst[0] * 9 + dst[1]) << MOVE_DST_SHIFT | (MOVE_PROMOTE_FLAG if promote else 0)
+        else:
+            raise LegacyReplayError(f"incorrect notation {notation}")
+
+        self.ply += 1
+        return move
+
+    @staticmethod
+    def _square(notation: str) -> Tuple[int, int]:
+        if len(notation) != 2 or notation[0] not in 'abcdefghi' or notation[1] not in '123456789':
+            raise LegacyReplayError(f"incorrect square {notation}")
+        return 9 - int(notation[1]), ord(notation[0]) - 97
+
+    def zobrist_hash(self) -> int:
+        zobrist_hash = ZOBRIST_SIDE_KEY if self.side_to_move == -1 else 0
+
+        for r, row in enumerate(self.board):
+            for c, piece in enumerate(row):
+                if piece:
+                    zobrist_hash ^= ZOBRIST_PIECE_KEYS[piece][r * 9 + c]
+
+        for team, hand in self.hands.items():
+            for kind, count in hand.items():
+                for n in range(1, count + 1):
+                    zobrist_hash ^= ZOBRIST_HAND_KEYS[team, kind][n]
+
+        return zobrist_hash
+
+    def pack(self) -> bytes:
+        king_sq = {1: NO_KING, -1: NO_KING}
+        for r, row in enumerate(self.board):
+            for c, piece in enumerate(row):
+                if piece and piece[0] == 'K':
+                    king_sq[piece[1]] = r * 9 + c
+
+        # 依寫入順序的 bits，第一個 bit 放在最低位
+        bits = ""
+        if king_sq[1] != NO_KING and king_sq[-1] != NO_KING:
+            bits += '0' if self.side_to_move == 1 else '1'
+
+        for row in self.board:
+            for piece in row:
+                if not piece:
+                    bits += '0'
+                elif piece[0] != 'K':
+                    kind, team, promoted = piece
+                    bits += BOARD_CODES[kind] + ('' if kind == 'G' else '1' if promoted else '0') + ('0' if team == 1 else '1')
+
+        for team in (1, -1):
+            for kind in DROP_PIECES:
+                bits += (BOARD_CODES[kind][1:] + ('' if kind == 'G' else '0') + ('0' if team == 1 else '1')) * self.hands[team][kind]
+
+        if 14 + len(bits) != PACKED_POSITION_BITS:
+            raise LegacyReplayError("position can't be packed")
+
+        packed = king_sq[1] | king_sq[-1] << 7 | (int(bits[::-1], 2) << 14)
+        return packed.to_bytes(PACKED_POSITION_BITS // 8, 'little')
+
+    def to_sfen(self) -> str:
+        rows = []
+        for row in self.board:
+            sfen_row, empty = "", 0
+            for piece in row:
+                if piece:
+                    letter = piece[0] if piece[1] == 1 else piece[0].lower()
+                    sfen_row += (str(empty) if empty else "") + ('+' + letter if piece[2] else letter)
+                    empty = 0
+                else:
+                    empty += 1
+            rows.append(sfen_row + (str(empty) if empty else ""))
+
+        hands = ""
+        for team in (1, -1):
+            for kind in DROP_PIECES:
+                count = self.hands[team][kind]
+                if count:
+                    hands += (str(count) if count > 1 else "") + (kind if team == 1 else kind.lower())
+
+        return f"{'/'.join(rows)} {'b' if self.side_to_move == 1 else 'w'} {hands or '-'} {self.ply + 1}"
+
+
+def replay_game_record(game_record: str) -> Tuple[LegacyPosition, List[Tuple[int, int]]]:
+    '''
+    Returns (最後的局面, 每一手的 (走步編碼, 走完後的 Zobrist hash))
+    '''
+    position = LegacyPosition()
+    moves = []
+
+    for notation in game_record.split():
+        move = position.play(notation)
+        moves.append((move, position.zobrist_hash()))
+
+    return position, moves
@@ -1,16 +1,159 @@
 import uuid
-from django.db import models
-from django.db.models import F
+from typing import List, Optional
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.core.cache import cache
 from django.contrib.auth.models import User
+from .game import ShogiGame
+from .player import ShogiPlayer
+from .move import move_to_string
+from .sfen import INITIAL_SFEN
+from .codec import PACKED_POSITION_SIZE
+from .cache import game_cache
+
+SNAPSHOT_INTERVAL = 16  # 每 16 手保存一次局面快照
+
+# 起始局面的 Zobrist hash，所有遊戲都從起始局面開始
+INITIAL_POSITION_HASH = ShogiGame.from_sfen(INITIAL_SFEN, ShogiPlayer("", 1), ShogiPlayer("", -1)).board.zobrist_hash
+
+
+def to_signed_hash(zobrist_hash: int) -> int:
+    '''64 bits 的 Zobrist hash 轉為 BigIntegerField 可保存的有號整數'''
+    return zobrist_hash - (1 << 64) if zobrist_hash >= 1 << 63 else zobrist_hash
+
+
+def to_unsigned_hash(zobrist_hash: int) -> int:
+    return zobrist_hash + (1 << 64) if zobrist_hash < 0 else zobrist_hash
+
+
+INITIAL_RATING = 1500.0
+ELO_K_FACTOR = 32
+
+# 排行榜前 LEADERBOARD_CACHE_SIZE 名保存在 Django cache，遊戲結束時清除
+LEADERBOARD_CACHE_KEY = 'shogi:leaderboard'
+LEADERBOARD_CACHE_SIZE = 100
+
+
+# 名次用的 Fenwick tree: rating 取整數為一個 bucket (超出 0 ~ RATING_BUCKETS - 1 的算在兩端)，由高分往低分累加玩家數量
+# rating 改變時更新 O(log B) 個節點，查詢比某個 bucket 高分的玩家數量讀 O(log B) 個節點，都只需要一個 query
+RATING_BUCKETS = 4096
+
+
+def rating_bucket(rating: float) -> int:
+    return min(max(int(rating // 1), 0), RATING_BUCKETS - 1)
+
+
+def elo_delta(rating: float, opponent_rating: float, score: float) -> float:
+    '''
+    score: 1 勝、0.5 和、0 負，回傳 rating 的變化 (對手的變化為相反數)
+    '''
+    expected = 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+    return ELO_K_FACTOR * (score - expected)
+
 
 class Player(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     wins = models.PositiveIntegerField(default=0)
     losses = models.PositiveIntegerField(default=0)
+    rating = models.FloatField(default=INITIAL_RATING)  # Elo rating
+
+    class Meta:
+        # 排行榜依 rating 排序，前 N 名直接讀 index 的開頭
+        indexes = [models.Index(fields=['-rating', 'id'], name='player_rating_idx')]
 
     def __str__(self) -> str:
         return self.user.username
 
+    def get_rank(self) -> int:
+        '''
+        名次: rating 比自己高的玩家數量加一 (同分同名次)
+        較高的 bucket 由 RatingTreeNode 加總 (O(log B))，同一個 bucket 內 (rating 差距小於 1) 才在 index 上計算
+        '''
+        bucket = rating_bucket(self.rating)
+        same_bucket = Player.objects.filter(rating__gt=self.rating)
+        if bucket < RATING_BUCKETS - 1:
+            same_bucket = same_bucket.filter(rating__lt=bucket + 1)
+
+        return RatingTreeNode.count_above(bucket) + same_bucket.count() + 1
+
+    @classmethod
+    def leaderboard(cls, limit: int = 10) -> List['Player']:
+        '''
+        rating 前 limit 名的玩家，每位玩家的 rank 屬性為名次
+        '''
+        if limit > LEADERBOARD_CACHE_SIZE:
+            return cls._ranked_players(limit)
+
+        players = cache.get(LEADERBOARD_CACHE_KEY)
+        if players is None:
+            players = cls._ranked_players(LEADERBOARD_CACHE_SIZE)
+            cache.set(LEADERBOARD_CACHE_KEY, players)
+
+        return players[:limit]
+
+    @classmethod
+    def _ranked_players(cls, limit: int) -> List['Player']:
+        players = list(cls.objects.select_related('user').order_by('-rating', 'id')[:limit])
+
+        for idx, player in enumerate(players):
+            player.rank = players[idx - 1].rank if idx and player.rating == players[idx - 1].rating else idx + 1
+
+        return players
+
+class RatingTreeNode(models.Model):
+    '''
+    Fenwick tree 的一個節點 (node 從 1 開始，node 1 為最高分的 bucket)，count 為節點涵蓋的 bucket 中的玩家數量
+    所有節點由 migration 建立，玩家新增、刪除與 update_ratings 時更新
+    '''
+    node = models.PositiveIntegerField(primary_key=True)
+    count = models.IntegerField(default=0)
+
+    @staticmethod
+    def tree_index(bucket: int) -> int:
+        return RATING_BUCKETS - bucket
+
+    @classmethod
+    def add(cls, rating: float, count: int) -> None:
+        nodes, idx = [], cls.tree_index(rating_bucket(rating))
+        while idx <= RATING_BUCKETS:
+            nodes.append(idx)
+            idx += idx & -idx
+
+        cls.objects.filter(node__in=nodes).update(count=F('count') + count)
+
+    @classmethod
+    def move(cls, old_rating: float, new_rating: float) -> None:
+        if rating_bucket(old_rating) != rating_bucket(new_rating):
+            cls.add(old_rating, -1)
+            cls.add(new_rating, 1)
+
+    @classmethod
+    def count_above(cls, bucket: int) -> int:
+        '''
+        rating 在比 bucket 高的 bucket 中的玩家數量
+        '''
+        nodes, idx = [], cls.tree_index(bucket) - 1
+        while idx > 0:
+            nodes.append(idx)
+            idx -= idx & -idx
+
+        return cls.objects.filter(node__in=nodes).aggregate(total=Sum('count'))['total'] or 0
+
+
+@receiver(post_save, sender=Player)
+def add_player_rating(sender, instance: Player, created: bool, **kwargs):
+    # rating 之後只由 update_ratings 修改
+    if created:
+        RatingTreeNode.add(instance.rating, 1)
+
+
+@receiver(post_delete, sender=Player)
+def remove_player_rating(sender, instance: Player, **kwargs):
+    RatingTreeNode.add(instance.rating, -1)
+
+
 class GameStatus(models.TextChoices):
     ONGOING = "Ongoing", "Ongoing"
     FINISHED = "Finished", "Finished"
@@ -22,26 +165,204 @@ class Game(models.Model):
     winner = models.ForeignKey(Player, related_name="games_won", null=True, on_delete=models.SET_NULL)
     loser = models.ForeignKey(Player, related_name="games_lost", null=True, on_delete=models.SET_NULL)
     status = models.CharField(max_length=10, choices=GameStatus.choices, default=GameStatus.ONGOING)
-    game_record = models.TextField(default="")
-    binary_game = models.BinaryField(default=b"")
+    binary_game = models.BinaryField(default=b"")  # 目前局面的 32 bytes 編碼 (codec.py)，空的表示從 sfen 載入
+    sfen = models.CharField(max_length=256, default=INITIAL_SFEN)  # 目前局面
+    move_count = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=0)  # 每次保存局面加一，用於驗證 cache 中的 ShogiGame
     timestamp = models.DateTimeField(auto_now_add=True)
 
-    def end_game(self, winner: Player):
+    class Meta:
+        # 遊戲列表的篩選與 keyset pagination 使用的 index
+        indexes = [
+            models.Index(fields=['-timestamp', '-uid'], name='game_timestamp_idx'),
+            models.Index(fields=['status', '-timestamp', '-uid'], name='game_status_timestamp_idx'),
+            models.Index(fields=['our_player', '-timestamp'], name='game_our_player_idx'),
+            models.Index(fields=['opponent_player', '-timestamp'], name='game_opponent_player_idx'),
+        ]
+
+    def load_shogi_game(self) -> ShogiGame:
+        '''
+        從 binary_game (或 SFEN) 與局面紀錄還原 ShogiGame，玩家名稱來自 our_player / opponent_player
+        version 相同時直接使用 cache 中的 ShogiGame，用完後以 cache_shogi_game 放回
+        '''
+        shogi_game = game_cache.get(self.uid, self.version)
+        if shogi_game:
+            return shogi_game
+
+        our_player = ShogiPlayer(self.our_player.user.username, 1)
+        opponent_player = ShogiPlayer(self.opponent_player.user.username, -1) if self.opponent_player else None
+
+        if len(self.binary_game) == PACKED_POSITION_SIZE:
+            shogi_game = ShogiGame.from_packed(bytes(self.binary_game), self.move_count, our_player, opponent_player)
+        else:
+            shogi_game = ShogiGame.from_sfen(self.sfen, our_player, opponent_player)
+        # 千日手用的局面紀錄來自 Move 的 position_hash
+        position_hashes = list(self.moves.values_list('position_hash', flat=True))
+        if position_hashes:
+            shogi_game.board.set_position_history([INITIAL_POSITION_HASH] + [to_unsigned_hash(zobrist_hash) for zobrist_hash in position_hashes])
+
+        return shogi_game
+
+    def store_shogi_game(self, shogi_game: ShogiGame):
+        '''
+        保存目前的局面到 sfen / binary_game / move_count 並增加 version (不呼叫 save)，每一手的紀錄請用 record_move
+        '''
+        self.sfen = shogi_game.to_sfen()
+        self.binary_game = shogi_game.to_packed()
+        self.move_count = shogi_game.game_round
+        self.version += 1
+
+    def save_shogi_game(self, shogi_game: ShogiGame, **fields) -> bool:
+        '''
+        Optimistic concurrency: 只有資料庫中的 version 仍是載入時的值才寫入局面 (與 fields 中的其他欄位)
+        UPDATE ... WHERE version = n 只會有一個 request 成功，不需要鎖住整列
+
+        Returns:
+            False 表示遊戲已被其他 request 更新，這次的變動沒有寫入
+        '''
+        version = self.version
+        self.store_shogi_game(shogi_game)
+        updated = Game.objects.filter(uid=self.uid, version=version).update(
+            sfen=self.sfen, binary_game=self.binary_game, move_count=self.move_count, version=self.version, **fields)
+
+        if not updated:
+            self.version = version
+            return False
+
+        for field, value in fields.items():
+            setattr(self, field, value)
+        return True
+
+    def cache_shogi_game(self, shogi_game: ShogiGame):
+        '''
+        save 之後把 ShogiGame 放回 cache，已結束的遊戲不需要保留
+        '''
+        if self.status == GameStatus.FINISHED:
+            game_cache.invalidate(self.uid)
+        else:
+            game_cache.put(self.uid, self.version, shogi_game)
+
+    def record_move(self, shogi_game: ShogiGame, move: int) -> 'Move':
+        '''
+        新增剛走完的一手 (shogi_game.game_round 為這一手的手數)，每 SNAPSHOT_INTERVAL 手另外保存局面快照
+        只會 insert，不會改寫先前的紀錄
+        '''
+        ply = shogi_game.game_round
+        game_move = Move.objects.create(game=self, ply=ply, move=move, position_hash=to_signed_hash(shogi_game.board.zobrist_hash))
+
+        if ply % SNAPSHOT_INTERVAL == 0:
+            GameSnapshot.objects.create(game=self, ply=ply, position=shogi_game.to_packed(),
+                                        side_to_move=shogi_game.board.side_to_move, king_captured_by=shogi_game.king_captured_by)
+
+        return game_move
+
+    def replay_shogi_game(self, ply: Optional[int] = None) -> ShogiGame:
+        '''
+        從 ply 之前最近的快照 (沒有則為起始局面) 重播 Move 紀錄，還原第 ply 手 (預設為最新) 的局面
+        '''
+        ply = self.move_count if ply is None else ply
+        our_player = ShogiPlayer(self.our_player.user.username, 1)
+        opponent_player = ShogiPlayer(self.opponent_player.user.username, -1) if self.opponent_player else None
+
+        snapshot = self.snapshots.filter(ply__lte=ply).last()
+        if snapshot:
+            shogi_game = ShogiGame.from_packed(bytes(snapshot.position), snapshot.ply, our_player, opponent_player,
+                                               snapshot.side_to_move, snapshot.king_captured_by)
+        else:
+            shogi_game = ShogiGame.from_sfen(INITIAL_SFEN, our_player, opponent_player)
+
+        moves = list(self.moves.filter(ply__lte=ply).values_list('ply', 'move', 'position_hash'))
+        board = shogi_game.board
+
+        for move_ply, move, _ in moves:
+            if move_ply > shogi_game.game_round:
+                board.make_move(move, shogi_game.players[shogi_game.game_round % 2])
+                shogi_game.game_round += 1
+
+        board._undo_stack.clear()
+        board.set_position_history([INITIAL_POSITION_HASH] + [to_unsigned_hash(zobrist_hash) for _, _, zobrist_hash in moves])
+        shogi_game.current_player, shogi_game.next_player = shogi_game.players[shogi_game.game_round % 2], shogi_game.players[1 - shogi_game.game_round % 2]
+
+        return shogi_game
+
+    @property
+    def game_record(self) -> str:
+        '''
+        以空白分隔的棋譜，由 Move 紀錄產生
+        '''
+        return "".join(f"{move_to_string(game_move.move)} " for game_move in self.moves.all())
+
+    def end_game(self, winner: Optional[Player]):
         # 檢查遊戲是否已有結果
         if self.status == GameStatus.FINISHED:
             raise ValueError("This game has already finished. Cannot set the result again.")
 
         self.status = GameStatus.FINISHED
-        self.winner = winner
-        if winner == self.our_player:
-            self.loser = self.opponent_player
-        else:
-            self.loser = self.our_player
 
-        # 紀錄勝者與敗者玩家的紀錄，利用 Djagno model 的 F 來做原子操作
-        self.winner.wins = F('wins') + 1
-        self.winner.save()        
-        self.loser.losses = F('losses') + 1
-        self.loser.save()
+        with transaction.atomic():
+            # winner 為 None 表示和局 (千日手)，不更新勝敗紀錄
+            if winner is not None:
+                self.winner = winner
+                if winner == self.our_player:
+                    self.loser = self.opponent_player
+                else:
+                    self.loser = self.our_player
+
+                # 紀錄勝者與敗者玩家的紀錄，利用 Djagno model 的 F 來做原子操作
+                self.winner.wins = F('wins') + 1
+                self.winner.save(update_fields=['wins'])
+                self.loser.losses = F('losses') + 1
+                self.loser.save(update_fields=['losses'])
+
+            self.update_ratings(winner)
+            self.save()
+
+    def update_ratings(self, winner: Optional[Player]):
+        '''
+        依結果更新雙方的 Elo rating (和局各得 0.5 分)，並在 commit 後清除排行榜 cache
+        '''
+        if not (self.our_player_id and self.opponent_player_id):
+            return
+
+        # 鎖住雙方 (依 id 排序避免 deadlock) 後以最新的 rating 計算
+        players = {player.id: player for player in Player.objects.select_for_update().filter(id__in=[self.our_player_id, self.opponent_player_id]).order_by('id')}
+        our_player, opponent_player = players[self.our_player_id], players[self.opponent_player_id]
+
+        score = 0.5 if winner is None else 1.0 if winner.id == our_player.id else 0.0
+        delta = elo_delta(our_player.rating, opponent_player.rating, score)
+
+        Player.objects.filter(id=our_player.id).update(rating=F('rating') + delta)
+        Player.objects.filter(id=opponent_player.id).update(rating=F('rating') - delta)
+        RatingTreeNode.move(our_player.rating, our_player.rating + delta)
+        RatingTreeNode.move(opponent_player.rating, opponent_player.rating - delta)
+
+        transaction.on_commit(lambda: cache.delete(LEADERBOARD_CACHE_KEY))
+
+
+class Move(models.Model):
+    game = models.ForeignKey(Game, related_name="moves", on_delete=models.CASCADE)
+    ply = models.PositiveIntegerField()  # 第幾手，從 1 開始
+    move = models.PositiveIntegerField()  # move.py 編碼後的走步
+    position_hash = models.BigIntegerField()  # 走完後局面的 Zobrist hash (有號)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['ply']
+        constraints = [models.UniqueConstraint(fields=['game', 'ply'], name='unique_game_move_ply')]
+
+    def __str__(self) -> str:
+        return f"{self.game_id} #{self.ply} {move_to_string(self.move)}"
+
+
+class GameSnapshot(models.Model):
+    game = models.ForeignKey(Game, related_name="snapshots", on_delete=models.CASCADE)
+    ply = models.PositiveIntegerField()
+    position = models.BinaryField()  # codec.py 的 32 bytes 局面編碼
+    # 王被吃掉時 position 不包含輪到的一方，兩者都另外保存
+    side_to_move = models.SmallIntegerField(default=1)
+    king_captured_by = models.SmallIntegerField(default=0)  # 吃掉王的 team，0 表示沒有
+    timestamp = models.DateTimeField(auto_now_add=True)
 
-        self.save()
\ No newline at end of file
+    class Meta:
+        ordering = ['ply']
+        constraints = [models.UniqueConstraint(fields=['game', 'ply'], name='unique_game_snapshot_ply')]
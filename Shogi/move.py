@@ -0,0 +1,80 @@
+from typing import Dict, List, Tuple
+from .utils import parse_pos_to_string, parse_drop_to_string
+
+# 走步以 int 表示:
+#   bits 0-6   : 起點格子 src = r * 9 + c (打入時為 0)
+#   bits 7-13  : 終點格子 dst = r * 9 + c
+#   bit  14    : 是否升變
+#   bits 15-17 : 打入的棋子種類 (DROP_PIECES 的 index + 1)，0 表示不是打入
+
+MOVE_DST_SHIFT = 7
+MOVE_SQUARE_MASK = 0x7F
+MOVE_PROMOTE_FLAG = 1 << 14
+MOVE_DROP_SHIFT = 15
+
+DROP_PIECES = ['R', 'B', 'G', 'S', 'N', 'L', 'P']
+
+SQUARE_POS: List[Tuple[int, int]] = [(r, c) for r in range(9) for c in range(9)]
+
+
+def encode_move(src: Tuple[int, int], dst: Tuple[int, int], is_promoted: bool = False) -> int:
+    src_r, src_c = src
+    dst_r, dst_c = dst
+    move = (src_r * 9 + src_c) | (dst_r * 9 + dst_c) << MOVE_DST_SHIFT
+    return move | MOVE_PROMOTE_FLAG if is_promoted else move
+
+
+def encode_drop(piece_name: str, dst: Tuple[int, int]) -> int:
+    dst_r, dst_c = dst
+    return (dst_r * 9 + dst_c) << MOVE_DST_SHIFT | (DROP_PIECES.index(piece_name.upper()) + 1) << MOVE_DROP_SHIFT
+
+
+def decode_move(move: int) -> Tuple[Tuple[int, int], Tuple[int, int], bool, str]:
+    '''
+    Returns (src, dst, is_promoted, drop piece name)
+    一般走步的 drop piece name 為 None，打入的 src 為 None
+    '''
+    dst = SQUARE_POS[move >> MOVE_DST_SHIFT & MOVE_SQUARE_MASK]
+    drop = move >> MOVE_DROP_SHIFT
+
+    if drop:
+        return None, dst, False, DROP_PIECES[drop - 1]
+    return SQUARE_POS[move & MOVE_SQUARE_MASK], dst, bool(move & MOVE_PROMOTE_FLAG), None
+
+
+def _build_codec() -> Tuple[Dict[int, str], Dict[str, int]]:
+    move_to_string, string_to_move = {}, {}
+
+    for src in SQUARE_POS:
+        for dst in SQUARE_POS:
+            for is_promoted in (False, True):
+                move = encode_move(src, dst, is_promoted)
+                notation = parse_pos_to_string(src, dst, is_promoted)
+                move_to_string[move] = notation
+                string_to_move[notation] = move
+
+    for piece_name in DROP_PIECES:
+        for dst in SQUARE_POS:
+            move = encode_drop(piece_name, dst)
+            move_to_string[move] = parse_drop_to_string(piece_name, dst)
+            string_to_move[parse_drop_to_string(piece_name, dst)] = move
+            string_to_move[parse_drop_to_string(piece_name.lower(), dst)] = move  # 敵方玩家以小寫打入
+
+    return move_to_string, string_to_move
+
+
+MOVE_TO_STRING, STRING_TO_MOVE = _build_codec()
+
+
+def parse_move(notation: str) -> int:
+    '''
+    Move ex: a3a4 / Promotion move ex: h6h7+ / Drop ex: P*d4 or p*d4
+    '''
+    try:
+        return STRING_TO_MOVE[notation]
+    except (KeyError, TypeError):
+        raise Exception("Incorrect move notation!")
+
+
+def move_to_string(move: int) -> str:
+    return MOVE_TO_STRING[move]
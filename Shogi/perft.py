@@ -0,0 +1,73 @@
+from typing import Dict, List, Tuple
+from .board import ShogiBoard
+from .player import ShogiPlayer
+from .move import parse_move
+
+import time
+
+# 中盤局面用的棋譜 (雙方都有持駒、升變的角行與打入的棋子)
+MIDGAME_MOVES = [
+    'c1d2', 'g7g6', 'f1f2', 'f7f6', 'f2g2', 'b8e8', 'f3f4', 'e7e6', 'g1f2', 'f9g8',
+    'e1f1', 'h9g7', 'g2g1', 'c9c8', 'c3c4', 'b7b6', 'b2f6', 'i7i6', 'f6g7+', 'h8g7',
+    'N*e1', 'g7a1', 'h2i2', 'e9f9', 'i2g2', 'g9f8', 'f4f5', 'f8e9', 'g3g4', 'L*i4',
+    'i3i4', 'B*g5', 'g4g5', 'g6g5', 'g2g5', 'a1d4', 'B*f6', 'e9d8', 'f6d8+', 'd4b2',
+]
+
+# 局面名稱 -> (從起始局面走的棋步, {depth: 已知節點數})
+# 起始局面的節點數與一般將棋引擎相同，其餘局面的節點數已和逐步試走再檢查是否被將軍的結果核對過
+PERFT_POSITIONS: Dict[str, Tuple[List[str], Dict[int, int]]] = {
+    'initial': ([], {1: 30, 2: 900, 3: 25470, 4: 719731}),
+    'bishop-exchange': (['c3c4', 'g7g6', 'b2h8+', 'g9h8'], {1: 77, 2: 5390, 3: 280630}),
+    'drop-evasion': (['c3c4', 'g7g6', 'b2h8+', 'g9h8', 'B*e5', 'b*e6', 'e5c7+'], {1: 6, 2: 262, 3: 9943}),
+    'midgame-opponent': (MIDGAME_MOVES[:-1], {1: 49, 2: 6433, 3: 292785}),
+    'midgame': (MIDGAME_MOVES, {1: 132, 2: 6120, 3: 649789}),
+}
+
+# 所有局面 depth 3 的每秒節點數下限，低於此值代表走步產生變慢了
+# (記錄時約為 360k nodes/s，保留空間給較慢的機器)
+PERFT_NPS_BASELINE = 100000
+
+
+def setup_position(moves: List[str]) -> Tuple[ShogiBoard, ShogiPlayer, ShogiPlayer]:
+    '''
+    從起始局面依序走 moves，回傳 (board, 輪到的玩家, 另一位玩家)
+    '''
+    players = [ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)]
+    board = ShogiBoard(*players)
+
+    for idx, move in enumerate(moves):
+        board.execute_move(parse_move(move), players[idx % 2])
+
+    return board, players[len(moves) % 2], players[1 - len(moves) % 2]
+
+
+def perft(board: ShogiBoard, player: ShogiPlayer, opponent_player: ShogiPlayer, depth: int) -> int:
+    '''
+    從目前局面往下 depth 層的葉節點數量，用 make_move / unmake_move 走訪
+    最後一層直接以合法走步的數量計算
+    '''
+    moves = board.legal_moves(player)
+
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        board.make_move(move, player)
+        nodes += perft(board, opponent_player, player, depth - 1)
+        board.unmake_move()
+
+    return nodes
+
+
+def run_perft(name: str, depth: int) -> Tuple[int, float]:
+    '''
+    Returns (nodes, seconds)
+    '''
+    moves, _ = PERFT_POSITIONS[name]
+    board, player, opponent_player = setup_position(moves)
+
+    start = time.perf_counter()
+    nodes = perft(board, player, opponent_player, depth)
+
+    return nodes, time.perf_counter() - start
@@ -1,78 +1,94 @@
-from typing import Tuple, List
-from abc import ABCMeta, abstractmethod
-from .utils import is_in_board, parse_pos_to_string
+from typing import Tuple, List, Dict, Set
+from abc import ABCMeta
+from .utils import is_in_board
+from .move import encode_move
 
 class ShogiPiece:
+    '''
+    棋子為不可變的 flyweight: 每個 (棋子種類, team, 是否升變) 只有一個實例，
+    升變時以 promote() 換成另一個實例，而不是修改 promoted
+    '''
     __metaclass__ = ABCMeta
+    __slots__ = ('name', 'team', 'promoted', '_move_table')
+
+    kind = None
 
     _GGeneral_pattern = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, 0)]
 
     OUR_PROMOTION_ZONE = [0, 1, 2]
     OPPONENT_PROMOTION_ZONE = [6, 7, 8]
 
-    def __init__(self, name: str, team: int, promoted: bool = False) -> None:
-        self.name = name
-        self.team = team          # 1: Our team, -1: Opponent team
-        self.promoted = promoted
+    _instances = {}
+
+    def __new__(cls, name: str, team: int, promoted: bool = False):
+        key = (cls, team, bool(promoted))
+        instance = cls._instances.get(key)
+
+        if instance is None:
+            instance = super().__new__(cls)
+            object.__setattr__(instance, 'name', cls.kind.lower() if team == 1 else cls.kind)
+            object.__setattr__(instance, 'team', team)  # 1: Our team, -1: Opponent team
+            object.__setattr__(instance, 'promoted', bool(promoted))
+            object.__setattr__(instance, '_move_table', MOVE_TABLES.get((cls.kind, team, bool(promoted))))
+            cls._instances[key] = instance
+
+        return instance
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ShogiPiece is immutable, use promote() instead.")
+
+
+    def __reduce__(self):
+        return (self.__class__, (self.name, self.team, self.promoted))
+
+
+    def __copy__(self):
+        return self
+
+
+    def __deepcopy__(self, memo):
+        return self
 
 
     def __repr__(self):
         return self.name
 
 
-    @abstractmethod
-    def get_valid_moves(self):
-        pass
-    
+    def promote(self) -> 'ShogiPiece':
+        return self.__class__(self.name, self.team, True)
 
-    # Pattern provided to this function dictates the directions in which the piece may move
-    def pattern_check(self, pattern: List[Tuple[int, int]], position: Tuple[int, int], board) -> List[str]:
-        src_r, src_c = position
-        opponent_team = -self.team
-        possible_moves = []
-
-        for pr, pc in pattern:
-            dst_r, dst_c = src_r + pr, src_c + pc
-
-            if is_in_board((dst_r, dst_c)):
-                if not board[dst_r][dst_c] or board[dst_r][dst_c].team == opponent_team:
-                    move_notation = parse_pos_to_string((src_r, src_c), (dst_r, dst_c))
-                    possible_moves.append(move_notation)
-
-                    # 加上能升變的 move
-                    if not board[src_r][src_c].promoted:
-                        if (self.team == 1 and dst_r in self.OUR_PROMOTION_ZONE) or (self.team == -1 and dst_r in self.OPPONENT_PROMOTION_ZONE):
-                            move_notation += '+'
-                            possible_moves.append(move_notation)
-        
-        return possible_moves
-    
 
-    # Loop check diagonals or cardinal directions in the case of a rook or bishop that can move like this
-    def loop_pattern_check(self, pattern: List[Tuple[int, int]], position: Tuple[int, int], board) -> List[str]:
+    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> Set[int]:
+        '''
+        查表取得目標格子，只需再檢查格子上是否有棋子
+        回傳 set，execute_move 檢查走步是否合法為 O(1)
+        '''
         src_r, src_c = position
-        opponent_team = -self.team
-        possible_moves = []
-
-        for pr, pc in pattern:
-            dst_r, dst_c = src_r + pr, src_c + pc
-
-            while is_in_board((dst_r, dst_c)):
-                if not board[dst_r][dst_c] or board[dst_r][dst_c].team == opponent_team:
-                    move_notation = parse_pos_to_string((src_r, src_c), (dst_r, dst_c))
-                    possible_moves.append(move_notation)
-
-                    # 加上能升變的 move
-                    if not board[src_r][src_c].promoted:
-                        if (self.team == 1 and dst_r in self.OUR_PROMOTION_ZONE) or (self.team == -1 and dst_r in self.OPPONENT_PROMOTION_ZONE):
-                            move_notation += '+'
-                            possible_moves.append(move_notation)
-                else:
+        steps, rays = self._move_table[src_r * 9 + src_c]
+        possible_moves = set()
+
+        for dst_r, dst_c, move, promoted_move in steps:
+            target = board[dst_r][dst_c]
+            if not target or target.team != self.team:
+                possible_moves.add(move)
+                if promoted_move:
+                    possible_moves.add(promoted_move)
+
+        for ray in rays:
+            for dst_r, dst_c, move, promoted_move in ray:
+                target = board[dst_r][dst_c]
+                if target and target.team == self.team:
+                    break
+
+                possible_moves.add(move)
+                if promoted_move:
+                    possible_moves.add(promoted_move)
+
+                # 吃子後不能再往前滑行
+                if target:
                     break
 
-                dst_r += pr
-                dst_c += pc
-        
         return possible_moves
 
 
@@ -83,11 +99,9 @@ class King(ShogiPiece):
     [D, S, D],
     [D, D, D]
     '''
+    __slots__ = ()
+    kind = 'K'
     _king_pattern = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
-    
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        moves = self.pattern_check(self._king_pattern, position, board)
-        return moves
 
 
 class Rook(ShogiPiece):
@@ -97,15 +111,11 @@ class Rook(ShogiPiece):
     [E, S, E],
     [D, E, D]
     '''
+    __slots__ = ()
+    kind = 'R'
     _rook_pattern = [(-1, 0), (0, -1), (0, 1), (1, 0)]
     _king_pattern = [(-1, -1), (-1, 1), (1, -1), (1, 1)]  # Including promoted pattern.
 
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        moves = self.loop_pattern_check(self._rook_pattern, position, board)
-        if self.promoted:
-            moves.extend(self.pattern_check(self._king_pattern, position, board))
-        return moves
-
 
 class Bishop(ShogiPiece):
     '''
@@ -114,15 +124,11 @@ class Bishop(ShogiPiece):
     [E, S, E],
     [D, E, D]
     '''
+    __slots__ = ()
+    kind = 'B'
     _bishop_pattern = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
     _king_pattern = [(-1, 0), (0, -1), (0, 1), (1, 0)]  # Including promoted pattern.
 
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        moves = self.loop_pattern_check(self._bishop_pattern, position, board)
-        if self.promoted:
-            moves.extend(self.pattern_check(self._king_pattern, position, board))
-        return moves
-
 
 class GGeneral(ShogiPiece):
     '''
@@ -131,16 +137,10 @@ class GGeneral(ShogiPiece):
     [D, S, D],
     [E, D, E]
     '''
+    __slots__ = ()
+    kind = 'G'
     _GGeneral_pattern = ShogiPiece._GGeneral_pattern
 
-    @property
-    def _pattern(self):
-        return self._GGeneral_pattern if self.team == 1 else [(-r, c) for r, c in self._GGeneral_pattern]
-
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        moves = self.pattern_check(self._pattern, position, board)
-        return moves
-
 
 class SGeneral(ShogiPiece):
     '''
@@ -149,20 +149,9 @@ class SGeneral(ShogiPiece):
     [E, S, E],
     [D, E, D]
     '''
+    __slots__ = ()
+    kind = 'S'
     _SGeneral_pattern = [(-1, -1), (-1, 0), (-1, 1), (1, -1), (1, 1)]
-    
-    @property
-    def _pattern(self):
-        return self._SGeneral_pattern if self.team == 1 else [(-r, c) for r, c in self._SGeneral_pattern]
-    
-    @property
-    def _pattern_promoted(self):
-        return self._GGeneral_pattern if self.team == 1 else [(-r, c) for r, c in self._GGeneral_pattern]
-    
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        pattern = self._pattern_promoted if self.promoted else self._pattern
-        moves = self.pattern_check(pattern, position, board)
-        return moves
 
 
 class Knight(ShogiPiece):
@@ -172,21 +161,9 @@ class Knight(ShogiPiece):
     [E, E, E],
     [E, S, E]
     '''
+    __slots__ = ()
+    kind = 'N'
     _Kinght_pattern = [(-2, -1), (-2, 1)]
-    _GGeneral_pattern = ShogiPiece._GGeneral_pattern
-    
-    @property
-    def _pattern(self):
-        return self._Kinght_pattern if self.team == 1 else [(-r, c) for r, c in self._Kinght_pattern]
-    
-    @property
-    def _pattern_promoted(self):
-        return self._GGeneral_pattern if self.team == 1 else [(-r, c) for r, c in self._GGeneral_pattern]
-    
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        pattern = self._pattern_promoted if self.promoted else self._pattern
-        moves = self.pattern_check(pattern, position, board)
-        return moves
 
 
 class Lance(ShogiPiece):
@@ -196,21 +173,9 @@ class Lance(ShogiPiece):
     [E, S, E],
     [E, E, E]
     '''
+    __slots__ = ()
+    kind = 'L'
     _Lance_pattern = [(-1, 0)]
-    _GGeneral_pattern = ShogiPiece._GGeneral_pattern
-
-    @property
-    def _pattern(self):
-        return self._Lance_pattern if self.team == 1 else [(-r, c) for r, c in self._Lance_pattern]
-    
-    @property
-    def _pattern_promoted(self):
-        return self._GGeneral_pattern if self.team == 1 else [(-r, c) for r, c in self._GGeneral_pattern]
-    
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        pattern = self._pattern_promoted if self.promoted else self._pattern
-        moves = self.loop_pattern_check(pattern, position, board)
-        return moves
 
 
 class Pawn(ShogiPiece):
@@ -220,18 +185,72 @@ class Pawn(ShogiPiece):
     [E, S, E],
     [E, E, E]
     '''
+    __slots__ = ()
+    kind = 'P'
     _Pawn_pattern = [(-1, 0)]
-    _GGeneral_pattern = ShogiPiece._GGeneral_pattern
 
-    @property
-    def _pattern(self):
-        return self._Pawn_pattern if self.team == 1 else [(-r, c) for r, c in self._Pawn_pattern]
-    
-    @property
-    def _pattern_promoted(self):
-        return self._GGeneral_pattern if self.team == 1 else [(-r, c) for r, c in self._GGeneral_pattern]
-    
-    def get_valid_moves(self, position: Tuple[int, int], board: List[List[int]]) -> List[str]:
-        pattern = self._pattern_promoted if self.promoted else self._pattern
-        moves = self.pattern_check(pattern, position, board)
-        return moves
\ No newline at end of file
+
+# (棋子種類, 是否升變) -> (走一步的方向, 滑行的方向)，以 team = 1 的視角
+MOVE_PATTERNS = {
+    ('K', False): (King._king_pattern, []),
+    ('R', False): ([], Rook._rook_pattern),
+    ('R', True): (Rook._king_pattern, Rook._rook_pattern),
+    ('B', False): ([], Bishop._bishop_pattern),
+    ('B', True): (Bishop._king_pattern, Bishop._bishop_pattern),
+    ('G', False): (GGeneral._GGeneral_pattern, []),
+    ('S', False): (SGeneral._SGeneral_pattern, []),
+    ('S', True): (ShogiPiece._GGeneral_pattern, []),
+    ('N', False): (Knight._Kinght_pattern, []),
+    ('N', True): (ShogiPiece._GGeneral_pattern, []),
+    ('L', False): ([], Lance._Lance_pattern),
+    ('L', True): (ShogiPiece._GGeneral_pattern, []),
+    ('P', False): (Pawn._Pawn_pattern, []),
+    ('P', True): (ShogiPiece._GGeneral_pattern, []),
+}
+
+PROMOTABLE_KINDS = {'R', 'B', 'S', 'N', 'L', 'P'}
+
+
+def _build_target(src: Tuple[int, int], dst: Tuple[int, int], team: int, can_promote: bool) -> Tuple[int, int, int, int]:
+    dst_r, dst_c = dst
+    zone = ShogiPiece.OUR_PROMOTION_ZONE if team == 1 else ShogiPiece.OPPONENT_PROMOTION_ZONE
+    promoted_move = encode_move(src, dst, True) if can_promote and dst_r in zone else None
+
+    return dst_r, dst_c, encode_move(src, dst), promoted_move
+
+
+def _build_move_table(kind: str, team: int, promoted: bool):
+    step_pattern, ray_pattern = MOVE_PATTERNS[kind, promoted]
+    can_promote = not promoted and kind in PROMOTABLE_KINDS
+    table = []
+
+    for src_r in range(9):
+        for src_c in range(9):
+            steps = []
+            for pr, pc in step_pattern:
+                dst = (src_r + pr * team, src_c + pc)
+                if is_in_board(dst):
+                    steps.append(_build_target((src_r, src_c), dst, team, can_promote))
+
+            rays = []
+            for pr, pc in ray_pattern:
+                ray = []
+                dst = (src_r + pr * team, src_c + pc)
+                while is_in_board(dst):
+                    ray.append(_build_target((src_r, src_c), dst, team, can_promote))
+                    dst = (dst[0] + pr * team, dst[1] + pc)
+                if ray:
+                    rays.append(tuple(ray))
+
+            table.append((tuple(steps), tuple(rays)))
+
+    return tuple(table)
+
+
+# (棋子種類, team, 是否升變) -> 每個格子 (r * 9 + c) 的 (一步可到的目標, 各方向的射線)
+# 目標為 (dst_r, dst_c, move, 升變的 move 或 None)
+MOVE_TABLES: Dict[Tuple[str, int, bool], tuple] = {
+    (kind, team, promoted): _build_move_table(kind, team, promoted)
+    for kind, promoted in MOVE_PATTERNS
+    for team in (1, -1)
+}
@@ -1,19 +1,85 @@
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from .piece import ShogiPiece
+from .move import DROP_PIECES
+
+# 持駒的七個欄位，順序與 move.py 的 DROP_PIECES 相同 (R, B, G, S, N, L, P)
+HAND_SLOTS = {kind: idx for idx, kind in enumerate(DROP_PIECES)}
+
+
+class ShogiHand:
+    '''
+    持駒: 七種棋子各一個計數，新增、移除與查詢皆為 O(1)
+    吃掉的棋子一律以未升變的種類 (大寫，例如 'P') 存放
+    '''
+    __slots__ = ('counts',)
+
+    def __init__(self, counts: Optional[List[int]] = None) -> None:
+        self.counts = list(counts) if counts else [0] * len(DROP_PIECES)
+
+    def __repr__(self) -> str:
+        return ' '.join(self.names(1))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ShogiHand) and self.counts == other.counts
+
+    def __contains__(self, kind: str) -> bool:
+        return self.counts[HAND_SLOTS[kind]] > 0
+
+    def __iter__(self) -> Iterator[str]:
+        '''持有的棋子種類 (不重複)'''
+        return (kind for kind, count in zip(DROP_PIECES, self.counts) if count)
+
+    def __bool__(self) -> bool:
+        return any(self.counts)
+
+    def count(self, kind: str) -> int:
+        return self.counts[HAND_SLOTS[kind]]
+
+    def add(self, kind: str) -> None:
+        self.counts[HAND_SLOTS[kind]] += 1
+
+    def remove(self, kind: str) -> None:
+        slot = HAND_SLOTS[kind]
+        if not self.counts[slot]:
+            raise Exception("You don't have this piece to drop!")
+        self.counts[slot] -= 1
+
+    def names(self, team: int) -> List[str]:
+        '''
+        以被吃掉的棋子名稱列出 (team 1 吃掉的是敵方的大寫棋子，team -1 為小寫)
+        '''
+        return [kind if team == 1 else kind.lower() for kind, count in zip(DROP_PIECES, self.counts) for _ in range(count)]
+
 
 class ShogiPlayer:
-    def __init__(self, name, team: int, captured: Optional[List[str]] = None) -> None:
+    def __init__(self, name, team: int, hand: Optional[ShogiHand] = None) -> None:
         self.name = name
         self.team = team
-        self.captured = captured if captured else []
+        self.hand = hand if hand else ShogiHand()
+        self.king_captured = False
 
     def __repr__(self) -> str:
         return self.name
 
     # Pieces that the player has captured, printed every turn
+    @property
+    def captured(self) -> List[str]:
+        return self.hand.names(self.team) + (['K' if self.team == 1 else 'k'] if self.king_captured else [])
+
+    # Captured pieces go into the hand unpromoted
     def capture(self, piece: ShogiPiece) -> None:
-        self.captured.append(piece.name)
+        if piece.kind == 'K':
+            self.king_captured = True
+        else:
+            self.hand.add(piece.kind)
+
+    # Undo capture() when a move is taken back
+    def uncapture(self, piece: ShogiPiece) -> None:
+        if piece.kind == 'K':
+            self.king_captured = False
+        else:
+            self.hand.remove(piece.kind)
 
-    # Piece that has been placed on to the board and removed from captured
-    def drop(self, piece: ShogiPiece) -> None:
-        self.captured.remove(piece)
\ No newline at end of file
+    # Piece that has been placed on to the board and removed from the hand
+    def drop(self, kind: str) -> None:
+        self.hand.remove(kind)
@@ -4,4 +4,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r"ws/game/(?P<game_uid>[^/]+)/$", consumers.GameConsumer.as_asgi()),
+    re_path(r"ws/game/(?P<game_uid>[^/]+)/watch/$", consumers.SpectatorConsumer.as_asgi()),
+    re_path(r"ws/games/$", consumers.MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -42,11 +42,34 @@ class PlayerSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class LeaderboardSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True)
+    rank = serializers.IntegerField(read_only=True)
+    rating = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Player
+        fields = ['rank', 'username', 'rating', 'wins', 'losses']
+
+    def get_rating(self, player) -> int:
+        return round(player.rating)
+
+
 class GameSerializer(serializers.ModelSerializer):
+    game_record = serializers.ReadOnlyField()  # 由 Move 紀錄產生
+
     class Meta:
         model = Game
         fields = '__all__'
-        read_only_fields = ('our_player', 'opponent_player', 'winner', 'loser', 'status', 'game_record', 'binary_game', 'timestamp')
+        read_only_fields = ('our_player', 'opponent_player', 'winner', 'loser', 'status', 'binary_game', 'sfen', 'move_count', 'version', 'timestamp')
+
+
+class GameListSerializer(serializers.ModelSerializer):
+    # 列表不包含局面編碼與棋譜，查詢時以 defer 略過
+    class Meta:
+        model = Game
+        fields = ['uid', 'our_player', 'opponent_player', 'winner', 'loser', 'status', 'sfen', 'move_count', 'timestamp']
+        read_only_fields = fields
 
 
 class GameJoinSerializer(serializers.ModelSerializer):
@@ -67,7 +90,8 @@ class GameMoveSerializer(serializers.ModelSerializer):
 
 
 class GameMovesSerializer(serializers.ModelSerializer):
+    game_record = serializers.ReadOnlyField()
+
     class Meta:
         model = Game
-        fields = ['game_record']
-        read_only_fields = ('game_record',)
\ No newline at end of file
+        fields = ['game_record']
\ No newline at end of file
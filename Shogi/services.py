@@ -0,0 +1,185 @@
+from typing import List, Optional, Tuple
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from rest_framework import status
+
+from .game import DRAW
+from .move import parse_move, decode_move, move_to_string
+from .models import Game, GameStatus
+from .messages import move_delta, move_message, snapshot_message
+
+OUR_PLAYER, OPPONENT_PLAYER = 0, 1
+
+# 重新連線時漏掉的手數超過此值就直接傳 snapshot，不逐手重播
+RESYNC_REPLAY_LIMIT = 32
+
+
+class MoveError(Exception):
+    '''
+    走步無法執行，status_code 為對應的 HTTP 狀態碼 (WebSocket 也一起回傳給玩家)
+    '''
+    def __init__(self, detail: str, status_code: int) -> None:
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def game_group_name(game_uid) -> str:
+    return f'game_{game_uid}'
+
+
+def submit_move(game_uid, username: str, move: str, render_board: bool = False) -> Tuple[dict, int, Optional[str]]:
+    '''
+    驗證並執行 username 的走步，保存局面與這一手的紀錄
+    HTTP (GameMoveView) 與 WebSocket (GameConsumer) 共用
+
+    Returns:
+        (廣播給遊戲 group 的 move 訊息 (messages.py), get_game_ended 的結果,
+         render_board 時為走步後的 str(board)，否則為 None)
+    '''
+    # 根據 game_uid 獲取遊戲實例
+    try:
+        game = Game.objects.get(uid=game_uid)
+    except (Game.DoesNotExist, ValidationError):
+        raise MoveError('Game not found.', status.HTTP_404_NOT_FOUND)
+
+    if game.status == GameStatus.FINISHED:
+        raise MoveError('The game is over.', status.HTTP_200_OK)
+
+    # 還沒有對手加入時沒有後手玩家，不能開始走步
+    if game.opponent_player is None:
+        raise MoveError('This game has not yet been joined by another player.', status.HTTP_403_FORBIDDEN)
+
+    shogi_game = game.load_shogi_game()
+    shogi_game.current_player = shogi_game.players[shogi_game.game_round % 2]
+    shogi_game.next_player = shogi_game.players[1 - shogi_game.game_round % 2]
+
+    # 檢查玩家是否是遊戲的一部分
+    shogi_players_name = [player.name for player in shogi_game.players if player]
+    if username not in shogi_players_name:
+        raise MoveError('You are not a player of this game.', status.HTTP_403_FORBIDDEN)
+
+    # 檢查執行走步時，request user 是不是當前的 player
+    if username != shogi_game.current_player.name:
+        game.cache_shogi_game(shogi_game)  # 局面沒有改變，放回 cache
+        raise MoveError('This is not your turn!', status.HTTP_403_FORBIDDEN)
+
+    # 執行棋步，並更新遊戲狀態，如果例外會回傳 400
+    try:
+        encoded_move = parse_move(move)
+        dst_r, dst_c = decode_move(encoded_move)[1]
+        captured_piece = shogi_game.board.board[dst_r][dst_c]
+        shogi_game.board.execute_move(encoded_move, shogi_game.current_player)
+        shogi_game.game_round += 1
+    except Exception as e:
+        raise MoveError(f'{e}', status.HTTP_400_BAD_REQUEST)
+
+    winner = 0  # 不會有玩家 id 為 0
+    result = shogi_game.get_game_ended(shogi_game.players[OUR_PLAYER], shogi_game.players[OPPONENT_PLAYER])
+    if result:
+        if result == DRAW:
+            winner = None  # 千日手和局
+        elif result == 1:
+            winner = game.our_player
+        else:
+            winner = game.opponent_player
+
+    # 保存遊戲的變動: 目前局面與新增的一手 (棋譜只 insert 一筆 Move)
+    # 載入後若有其他走步先保存 (version 已改變)，這一步不寫入並回傳 409
+    with transaction.atomic():
+        if not game.save_shogi_game(shogi_game):
+            raise MoveError('The game has been updated by another move, please reload.', status.HTTP_409_CONFLICT)
+
+        game.record_move(shogi_game, encoded_move)
+        if result:
+            game.end_game(winner)
+    board = str(shogi_game.board) if render_board else None  # 放回 cache 之前，之後可能被其他 request 取走
+    game.cache_shogi_game(shogi_game)
+
+    # 廣播正規化的記譜 (例如先手以小寫打入的 p*e5 廣播為 P*e5)
+    shogi_board_data = move_message(
+        game.uid, shogi_game.game_round, move_to_string(encoded_move),
+        move_delta(shogi_game, encoded_move, shogi_game.current_player.team, captured_piece),
+        shogi_game.next_player.name,
+        "" if not winner else shogi_players_name[OUR_PLAYER] if result == 1 else shogi_players_name[OPPONENT_PLAYER],
+        result == DRAW
+    )
+
+    return shogi_board_data, result, board
+
+
+def check_game_player(game_uid, user) -> None:
+    '''
+    ws/game/<uid>/ 只接受遊戲的兩位玩家，其他人 (包含未登入) 丟出 MoveError 並指向觀戰用的連線
+    '''
+    try:
+        player_user_ids = Game.objects.values_list('our_player__user_id', 'opponent_player__user_id').get(uid=game_uid)
+    except (Game.DoesNotExist, ValidationError):
+        raise MoveError('Game not found.', status.HTTP_404_NOT_FOUND)
+
+    if not user or not user.is_authenticated or user.id not in player_user_ids:
+        raise MoveError(f'Only the players can connect to this game, watch it at /ws/game/{game_uid}/watch/ instead.', status.HTTP_403_FORBIDDEN)
+
+
+def check_game_exists(game_uid) -> None:
+    '''
+    觀戰者訂閱 spectator_hub 之前先確認遊戲存在，不存在時丟出 MoveError
+    '''
+    try:
+        if Game.objects.filter(uid=game_uid).exists():
+            return
+    except ValidationError:
+        pass
+    raise MoveError('Game not found.', status.HTTP_404_NOT_FOUND)
+
+
+def _get_game(game_uid) -> Game:
+    try:
+        return Game.objects.select_related('our_player__user', 'opponent_player__user', 'winner__user').get(uid=game_uid)
+    except (Game.DoesNotExist, ValidationError):
+        raise MoveError('Game not found.', status.HTTP_404_NOT_FOUND)
+
+
+def load_snapshot(game_uid) -> dict:
+    '''
+    目前局面的 snapshot 訊息，玩家連線或要求 resync 時傳送
+    '''
+    game = _get_game(game_uid)
+    shogi_game = game.load_shogi_game()
+    game.cache_shogi_game(shogi_game)  # 只有讀取，放回 cache
+
+    return snapshot_message(game, shogi_game)
+
+
+def load_resync(game_uid, since: int) -> List[dict]:
+    '''
+    已收到第 since 手的玩家重新連線: 從 Move 紀錄重播漏掉的每一手 (從 since 之前最近的快照開始)
+    漏掉太多手 (或 since 不合理) 時改傳 snapshot，已是最新局面時不需要傳送任何訊息
+    '''
+    game = _get_game(game_uid)
+
+    if since == game.move_count:
+        return []
+    if not 0 <= since < game.move_count or game.move_count - since > RESYNC_REPLAY_LIMIT:
+        return [load_snapshot(game_uid)]
+
+    shogi_game = game.replay_shogi_game(since)
+    board, players = shogi_game.board, shogi_game.players
+    messages = []
+
+    for game_move in game.moves.filter(ply__gt=since):
+        player, next_player = players[shogi_game.game_round % 2], players[1 - shogi_game.game_round % 2]
+        dst_r, dst_c = decode_move(game_move.move)[1]
+        captured_piece = board.board[dst_r][dst_c]
+
+        board.make_move(game_move.move, player)
+        shogi_game.game_round += 1
+        messages.append(move_message(game.uid, game_move.ply, move_to_string(game_move.move),
+                                     move_delta(shogi_game, game_move.move, player.team, captured_piece), next_player.name))
+
+    # 最後一手帶上遊戲結果
+    if game.status == GameStatus.FINISHED:
+        messages[-1]['winner'] = game.winner.user.username if game.winner else ""
+        messages[-1]['draw'] = not game.winner_id
+
+    return messages
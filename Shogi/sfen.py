@@ -0,0 +1,110 @@
+from typing import List, Optional, Tuple
+from .piece import ShogiPiece, King, Rook, Bishop, GGeneral, SGeneral, Knight, Lance, Pawn
+from .player import ShogiHand
+from .move import DROP_PIECES
+
+# SFEN: <盤面> <輪到的一方> <持駒> <手數>
+#   盤面從第 9 段 (board[0]) 開始，每段由 a 行到 i 行 (board[r][0] ~ board[r][8])，以 '/' 分隔
+#   先手 (team = 1) 為大寫、後手 (team = -1) 為小寫，與 ShogiPiece.name 的大小寫相反
+#   輪到的一方: 'b' 為 team = 1，'w' 為 team = -1
+#   持駒依 R B G S N L P 的順序，先手在前，數量大於 1 時加上數字，沒有持駒為 '-'
+
+INITIAL_SFEN = "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+
+PIECE_CLASSES = {cls.kind: cls for cls in (King, Rook, Bishop, GGeneral, SGeneral, Knight, Lance, Pawn)}
+SIDE_TO_MOVE = {'b': 1, 'w': -1}
+
+
+def piece_to_sfen(piece: ShogiPiece) -> str:
+    letter = piece.kind if piece.team == 1 else piece.kind.lower()
+    return '+' + letter if piece.promoted else letter
+
+
+def _hand_to_sfen(hand: ShogiHand, team: int) -> str:
+    sfen = ""
+    for kind in DROP_PIECES:
+        count = hand.count(kind)
+        if count:
+            sfen += (str(count) if count > 1 else "") + (kind if team == 1 else kind.lower())
+    return sfen
+
+
+def board_to_sfen(board: List[List[ShogiPiece]], our_hand: ShogiHand, opponent_hand: Optional[ShogiHand], side_to_move: int, move_number: int) -> str:
+    rows = []
+
+    for row in board:
+        sfen_row, empty = "", 0
+        for piece in row:
+            if piece:
+                sfen_row += (str(empty) if empty else "") + piece_to_sfen(piece)
+                empty = 0
+            else:
+                empty += 1
+        rows.append(sfen_row + (str(empty) if empty else ""))
+
+    hands = _hand_to_sfen(our_hand, 1) + (_hand_to_sfen(opponent_hand, -1) if opponent_hand else "")
+    side = 'b' if side_to_move == 1 else 'w'
+
+    return f"{'/'.join(rows)} {side} {hands or '-'} {move_number}"
+
+
+def parse_sfen(sfen: str) -> Tuple[List[List[ShogiPiece]], ShogiHand, ShogiHand, int, int]:
+    '''
+    Returns (board, 先手的持駒, 後手的持駒, 輪到的一方, 手數)
+    '''
+    try:
+        sfen_board, side, sfen_hands, move_number = sfen.split()
+        board = [_parse_row(sfen_row) for sfen_row in sfen_board.split('/')]
+        our_hand, opponent_hand = _parse_hands(sfen_hands)
+
+        if len(board) != 9 or side not in SIDE_TO_MOVE or int(move_number) < 1:
+            raise ValueError
+
+        return board, our_hand, opponent_hand, SIDE_TO_MOVE[side], int(move_number)
+    except (AttributeError, KeyError, ValueError):
+        raise Exception("Incorrect SFEN!")
+
+
+def _parse_row(sfen_row: str) -> List[ShogiPiece]:
+    row, promoted = [], False
+
+    for char in sfen_row:
+        if char == '+':
+            promoted = True
+        elif char.isdigit():
+            row.extend([None] * int(char))
+        else:
+            team = 1 if char.isupper() else -1
+            kind = char.upper()
+            if promoted and kind in ('K', 'G'):
+                raise ValueError
+            row.append(PIECE_CLASSES[kind](kind if team == -1 else kind.lower(), team, promoted))
+            promoted = False
+
+    if len(row) != 9 or promoted:
+        raise ValueError
+
+    return row
+
+
+def _parse_hands(sfen_hands: str) -> Tuple[ShogiHand, ShogiHand]:
+    our_hand, opponent_hand = ShogiHand(), ShogiHand()
+
+    if sfen_hands == '-':
+        return our_hand, opponent_hand
+
+    count = ""
+    for char in sfen_hands:
+        if char.isdigit():
+            count += char
+            continue
+
+        hand = our_hand if char.isupper() else opponent_hand
+        for _ in range(int(count or 1)):
+            hand.add(char.upper())
+        count = ""
+
+    if count:
+        raise ValueError
+
+    return our_hand, opponent_hand
@@ -0,0 +1,88 @@
+import asyncio
+from typing import Dict, List, Optional, Set
+
+from channels.layers import get_channel_layer
+
+from .services import game_group_name
+
+# 觀戰者不加入 game_{uid} group: 每個 worker 對每場遊戲只訂閱一次，再由 worker 自己轉發給本地的觀戰者
+# 同一段時間內的走步合併成一個訊息送出
+# ASGI 的 send 只是交給 server 的緩衝區，不會等待用戶端收到，這裡無法得知觀戰者是否跟得上，所以不做 backpressure；
+# 用戶端依 seq 發現漏掉的手數時自行要求 resync
+SPECTATOR_COALESCE_INTERVAL = 0.25  # 秒
+
+
+class GameFeed:
+    '''
+    一場遊戲在這個 worker 的上游訂閱: 一個 channel 加入 game group，收到的走步每隔一段時間合併後轉發
+    '''
+    def __init__(self, game_uid) -> None:
+        self.game_uid = game_uid
+        self.spectators: Set[object] = set()  # 本地的觀戰者 consumer
+        self.pending: List[dict] = []
+        self.channel_layer = get_channel_layer()
+        self.channel_name: Optional[str] = None
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        self.channel_name = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(game_group_name(self.game_uid), self.channel_name)
+        self.tasks = {asyncio.create_task(self._read()), asyncio.create_task(self._flush())}
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await self.channel_layer.group_discard(game_group_name(self.game_uid), self.channel_name)
+
+    async def _read(self) -> None:
+        while True:
+            event = await self.channel_layer.receive(self.channel_name)
+            if event.get("type") == "game_update":
+                self.pending.append(event["message"])
+
+    async def _flush(self) -> None:
+        while True:
+            await asyncio.sleep(SPECTATOR_COALESCE_INTERVAL)
+            if not self.pending:
+                continue
+
+            messages, self.pending = self.pending, []
+            message = messages[0] if len(messages) == 1 else {"type": "batch", "game_id": str(self.game_uid), "messages": messages}
+
+            # 連線已關閉的觀戰者送出失敗時略過，由 disconnect 取消訂閱
+            await asyncio.gather(*(consumer.send_message(message) for consumer in list(self.spectators)), return_exceptions=True)
+
+
+class SpectatorHub:
+    '''
+    這個 worker 所有觀戰中的遊戲 (game uid -> GameFeed)
+    '''
+    def __init__(self) -> None:
+        self.feeds: Dict[str, GameFeed] = {}
+        self.lock = asyncio.Lock()
+
+    async def subscribe(self, game_uid, consumer) -> None:
+        async with self.lock:
+            feed = self.feeds.get(str(game_uid))
+            if not feed:
+                feed = self.feeds[str(game_uid)] = GameFeed(game_uid)
+                await feed.start()
+            feed.spectators.add(consumer)
+
+    async def unsubscribe(self, game_uid, consumer) -> None:
+        async with self.lock:
+            feed = self.feeds.get(str(game_uid))
+            if not feed or consumer not in feed.spectators:
+                return
+
+            feed.spectators.discard(consumer)
+            if not feed.spectators:
+                del self.feeds[str(game_uid)]
+                await feed.stop()
+
+    def spectator_count(self, game_uid) -> int:
+        feed = self.feeds.get(str(game_uid))
+        return len(feed.spectators) if feed else 0
+
+
+spectator_hub = SpectatorHub()
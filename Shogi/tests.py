@@ -1,15 +1,42 @@
-from django.test import TestCase
+from django.test import TestCase, tag, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
 
+from unittest import skipUnless
 from unittest.mock import patch
 
-from .game import ShogiGame
-from .player import ShogiPlayer
-from .models import Player, Game
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
 
+from .game import ShogiGame, DRAW
+from .board import ShogiBoard
+from .piece import King, Rook, Bishop, GGeneral, SGeneral, Knight, Lance, Pawn, MOVE_TABLES
+from .player import ShogiPlayer, ShogiHand
+from .move import parse_move, move_to_string, encode_move, encode_drop, decode_move
+from .sfen import INITIAL_SFEN
+from .codec import PACKED_POSITION_SIZE, pack_position, unpack_position, pack_positions, unpack_positions
+from .perft import PERFT_POSITIONS, PERFT_NPS_BASELINE, MIDGAME_MOVES, perft, run_perft, setup_position
+from .models import RATING_BUCKETS, Player, Game, RatingTreeNode
+from .migrations._legacy_replay import LegacyPosition, LegacyReplayError, replay_game_record
+from .routing import websocket_urlpatterns
+from .services import RESYNC_REPLAY_LIMIT, submit_move, game_group_name
+from .spectators import spectator_hub
+from .cache import ShogiGameCache, game_cache, estimate_size
+
+import gzip
+import io
+import json
+import os
 import pickle
+import tempfile
+import uuid
 
 class CheckLoginStatusViewTest(TestCase):
     def setUp(self):
@@ -62,7 +89,7 @@ class GameJoinViewTest(TestCase):
         opponent_player = ShogiPlayer(self.opponent_player.user.username, -1)  # obj opponent_player
 
         shogi_game = ShogiGame(our_player, opponent_player)
-        self.game = Game.objects.create(uid="74bf3f51-2c02-4cb0-aaa2-b9e8cc74cbd7", our_player=self.our_player, binary_game=pickle.dumps(shogi_game))
+        self.game = Game.objects.create(uid="74bf3f51-2c02-4cb0-aaa2-b9e8cc74cbd7", our_player=self.our_player, sfen=shogi_game.to_sfen())
     
     def test_games_join_api_view(self):
         self.assertEqual(Player.objects.count(), 2)
@@ -99,7 +126,7 @@ class GamesMoveViewTest(TestCase):
         opponent_player = ShogiPlayer(self.opponent_player.user.username, -1)  # obj opponent_player
 
         shogi_game = ShogiGame(our_player, opponent_player)
-        self.game = Game.objects.create(our_player=self.our_player, opponent_player=self.opponent_player, binary_game=pickle.dumps(shogi_game))
+        self.game = Game.objects.create(our_player=self.our_player, opponent_player=self.opponent_player, sfen=shogi_game.to_sfen())
 
 
     def test_games_move_api_view(self):
@@ -113,6 +140,10 @@ class GamesMoveViewTest(TestCase):
         self.call_game_move(username='our_user', password='password', move='a3a4')
         self.call_game_move(username='opponent_user', password='password', move='b8e8')
 
+        # 每一手新增一筆 Move，棋譜由 Move 產生
+        self.assertEqual(list(self.game.moves.values_list('ply', flat=True)), [1, 2])
+        self.assertEqual(Game.objects.get(uid=self.game.uid).game_record, "a3a4 b8e8 ")
+
 
     def call_game_move(self, username: str, password: str, move: str):
         self.client.login(username=username, password=password)
@@ -136,4 +167,967 @@ class GamesMoveViewTest(TestCase):
             self.assertEqual(response.json()['move'], move)
 
             # Verify whether async_to_sync was called
-            mock_async.assert_called()
\ No newline at end of file
+            mock_async.assert_called()
+
+class GameListViewTest(TestCase):
+    def setUp(self):
+        self.our_player = Player.objects.create(user=User.objects.create_user('our_user', 'our_user@example.com', 'password'))
+        self.opponent_player = Player.objects.create(user=User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password'))
+
+        self.games = [Game.objects.create(our_player=self.our_player) for _ in range(4)]
+        for game in self.games[:2]:
+            game.opponent_player = self.opponent_player
+            game.save()
+        self.games[0].end_game(self.our_player)
+
+    def test_cursor_pagination(self):
+        url, uids = reverse('game-list') + '?page_size=3', []
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('binary_game', response.json()['results'][0])
+            uids += [game['uid'] for game in response.json()['results']]
+            url = response.json()['next']
+
+        self.assertEqual(uids, [str(game.uid) for game in sorted(self.games, key=lambda game: (game.timestamp, game.uid), reverse=True)])
+
+    def test_cursor_pagination_with_equal_timestamps(self):
+        # 同一時間的遊戲以 uid 排序，翻頁途中新增遊戲也不會重複或漏掉
+        Game.objects.update(timestamp=self.games[0].timestamp)
+        response = self.client.get(reverse('game-list'), {'page_size': 3})
+        uids = [game['uid'] for game in response.json()['results']]
+
+        new_game = Game.objects.create(uid=uuid.UUID(int=1), our_player=self.our_player)
+        Game.objects.update(timestamp=self.games[0].timestamp)
+        next_page = self.client.get(response.json()['next']).json()
+        last_uid = min(str(game.uid) for game in self.games)
+        self.assertEqual([game['uid'] for game in next_page['results']], [last_uid, str(new_game.uid)])
+
+        previous_page = self.client.get(next_page['previous']).json()
+        self.assertEqual([game['uid'] for game in previous_page['results']], uids)
+        self.assertIsNone(previous_page['previous'])
+        self.assertEqual(self.client.get(reverse('game-list'), {'cursor': 'bad'}).status_code, 404)
+
+    def test_filters(self):
+        url = reverse('game-list')
+        response = self.client.get(url, {'status': 'Finished'})
+        self.assertEqual([game['uid'] for game in response.json()['results']], [str(self.games[0].uid)])
+
+        response = self.client.get(url, {'player': 'opponent_user', 'status': 'Ongoing'})
+        self.assertEqual([game['uid'] for game in response.json()['results']], [str(self.games[1].uid)])
+
+        self.assertEqual(len(self.client.get(url, {'player': 'our_user'}).json()['results']), 4)
+        self.assertEqual(self.client.get(url, {'status': 'Paused'}).status_code, 400)
+
+
+# 測試環境沒有 Redis，改用單一 process 的快取
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LeaderboardTest(TestCase):
+    def setUp(self):
+        self.players = [Player.objects.create(user=User.objects.create_user(name, f'{name}@example.com', 'password')) for name in ('foo', 'bar', 'baz')]
+        cache.clear()
+
+    def play(self, our_player, opponent_player, winner):
+        game = Game.objects.create(our_player=our_player, opponent_player=opponent_player)
+        with self.captureOnCommitCallbacks(execute=True):
+            game.end_game(winner)
+
+    def test_elo_ratings(self):
+        foo, bar, baz = self.players
+        self.play(foo, bar, foo)
+        self.play(bar, baz, None)  # 和局
+
+        for player, rating in zip(self.players, (1516, 1484.74, 1499.26)):
+            player.refresh_from_db()
+            self.assertAlmostEqual(player.rating, rating, places=2)
+        self.assertEqual((foo.wins, bar.losses, baz.wins), (1, 1, 0))
+        self.assertEqual([player.get_rank() for player in self.players], [1, 3, 2])
+
+    def test_leaderboard_cache(self):
+        foo, bar, baz = self.players
+        response = self.client.get(reverse('leaderboard'))
+        self.assertEqual([entry['rank'] for entry in response.json()], [1, 1, 1])
+
+        self.play(bar, baz, bar)  # 清除 cache
+        with self.assertNumQueries(1):
+            self.client.get(reverse('leaderboard'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('leaderboard'), {'limit': 2})
+        self.assertEqual(response.json(), [
+            {'rank': 1, 'username': 'bar', 'rating': 1516, 'wins': 1, 'losses': 0},
+            {'rank': 2, 'username': 'foo', 'rating': 1500, 'wins': 0, 'losses': 0},
+        ])
+        self.assertEqual(self.client.get(reverse('leaderboard-player', args=['baz'])).json()['rank'], 3)
+        self.assertEqual(self.client.get(reverse('leaderboard'), {'limit': 0}).status_code, 400)
+
+    def test_rating_tree(self):
+        # 名次與直接 COUNT 相同: 同分、同一個 bucket、超出 bucket 範圍的 rating
+        ratings = [1500, 1500.5, 1500.25, 1499.9, 1501, 2000, -20, 5000, 4200, RATING_BUCKETS - 0.5]
+        for n, rating in enumerate(ratings[3:]):
+            Player.objects.create(user=User.objects.create_user(f'player{n}', f'player{n}@example.com', 'password'))
+        players = list(Player.objects.order_by('id'))
+        for player, rating in zip(players, ratings):
+            Player.objects.filter(id=player.id).update(rating=rating)
+            RatingTreeNode.move(player.rating, rating)
+            player.rating = rating
+
+        def assert_ranks():
+            for player in Player.objects.all():
+                self.assertEqual(player.get_rank(), Player.objects.filter(rating__gt=player.rating).count() + 1)
+        assert_ranks()
+
+        foo, bar = players[:2]
+        self.play(foo, bar, bar)
+        assert_ranks()
+        self.assertEqual(RatingTreeNode.count_above(-1), len(players))
+
+        players[-1].delete()
+        self.assertEqual(RatingTreeNode.count_above(-1), len(players) - 1)
+        assert_ranks()
+
+
+class GameExportTest(TestCase):
+    def setUp(self):
+        self.our_player = Player.objects.create(user=User.objects.create_user('our_user', 'our_user@example.com', 'password'))
+        self.opponent_player = Player.objects.create(user=User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password'))
+
+        for winner in (self.our_player, None):
+            game = Game.objects.create(our_player=self.our_player, opponent_player=self.opponent_player)
+            shogi_game = game.load_shogi_game()
+            for move in ['c3c4', 'g7g6']:
+                shogi_game.board.execute_move(parse_move(move), shogi_game.players[shogi_game.game_round % 2])
+                shogi_game.game_round += 1
+                game.record_move(shogi_game, parse_move(move))
+            game.save_shogi_game(shogi_game)
+            game.end_game(winner)
+        Game.objects.create(our_player=self.our_player)  # 進行中的遊戲不輸出
+
+    def test_export_view(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.get(reverse('game-export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        games = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([game['winner'] for game in games], ['our_user', None])
+        self.assertEqual(games[0]['moves'], ['c3c4', 'g7g6'])
+
+        response = self.client.get(reverse('game-export'), {'compress': 'gzip'})
+        self.assertEqual([json.loads(line) for line in gzip.decompress(b"".join(response.streaming_content)).splitlines()], games)
+
+    async def test_export_view_asgi(self):
+        # 經過 ASGI handler 時以 async iterator 串流，不會先把整份輸出讀進記憶體
+        admin = await database_sync_to_async(User.objects.create_superuser)('admin', 'admin@example.com', 'password')
+        await database_sync_to_async(self.async_client.force_login)(admin)
+
+        response = await self.async_client.get(reverse('game-export'), {'compress': 'gzip'})
+        self.assertTrue(response.is_async)
+        content = gzip.decompress(b"".join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual([json.loads(line)['winner'] for line in content.splitlines()], ['our_user', None])
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'games.ndjson.gz')
+            call_command('export_games', output=path, gzip=True, chunk_size=1, stderr=io.StringIO())
+            with gzip.open(path) as export_file:
+                self.assertEqual(len(export_file.readlines()), 2)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class GameConsumerTest(TestCase):
+    def setUp(self):
+        self.our_user = User.objects.create_user('our_user', 'our_user@example.com', 'password')
+        self.opponent_user = User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password')
+        self.game = Game.objects.create(our_player=Player.objects.create(user=self.our_user), opponent_player=Player.objects.create(user=self.opponent_user))
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.uid}/')
+        communicator.scope['user'] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        snapshot = await communicator.receive_json_from()  # 連線時的完整局面
+        self.assertEqual(snapshot['type'], 'snapshot')
+        return communicator, snapshot
+
+    def test_move_over_websocket(self):
+        async def run():
+            (our_socket, snapshot), (opponent_socket, _) = await self.connect(self.our_user), await self.connect(self.opponent_user)
+            self.assertEqual((snapshot['seq'], snapshot['sfen'], snapshot['players']), (0, INITIAL_SFEN, {'b': 'our_user', 'w': 'opponent_user'}))
+
+            await opponent_socket.send_json_to({'type': 'move', 'move': 'c3c4'})
+            self.assertEqual(await opponent_socket.receive_json_from(), {'type': 'error', 'detail': 'This is not your turn!', 'status': 403})
+
+            await our_socket.send_json_to({'type': 'move', 'move': 'c3c4'})
+            for communicator in (our_socket, opponent_socket):
+                message = await communicator.receive_json_from()
+                self.assertEqual((message['type'], message['seq'], message['move'], message['next_player']), ('move', 1, 'c3c4', 'opponent_user'))
+                self.assertEqual(message['changes'], [{'square': 'c3', 'piece': None}, {'square': 'c4', 'piece': 'P'}])
+
+            await opponent_socket.send_json_to({'type': 'resync'})
+            self.assertEqual((await opponent_socket.receive_json_from())['seq'], 1)
+
+            await our_socket.disconnect()
+            await opponent_socket.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(Game.objects.get(uid=self.game.uid).game_record, "c3c4 ")
+
+    def test_move_before_opponent_joins(self):
+        game = Game.objects.create(our_player=Player.objects.get(user=self.our_user))
+        detail = 'This game has not yet been joined by another player.'
+
+        self.client.login(username='our_user', password='password')
+        response = self.client.put(reverse('game-move'), {'uid': game.uid, 'move': 'c3c4'}, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['detail']), (403, detail))
+
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{game.uid}/')
+            communicator.scope['user'] = self.our_user
+            await communicator.connect()
+            await communicator.receive_json_from()  # snapshot
+
+            await communicator.send_json_to({'type': 'move', 'move': 'c3c4'})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'detail': detail, 'status': 403})
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+        self.assertFalse(game.moves.exists())
+
+    def test_non_players_are_closed(self):
+        outsider = User.objects.create_user('outsider', 'outsider@example.com', 'password')
+
+        async def run(user):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.uid}/')
+            communicator.scope['user'] = user
+            await communicator.connect()
+
+            # 不是玩家: 收到指向觀戰連線的錯誤後關閉，不會加入 game group
+            error = await communicator.receive_json_from()
+            self.assertEqual(error['status'], 403)
+            self.assertIn(f'/ws/game/{self.game.uid}/watch/', error['detail'])
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4403})
+
+        for user in (AnonymousUser(), outsider):
+            async_to_sync(run)(user)
+        self.assertFalse(self.game.moves.exists())
+
+    def test_capture_and_drop_deltas(self):
+        moves = ['c3c4', 'g7g6', 'b2h8+', 'g9h8', 'B*e5', 'b*e6']
+        with patch('Shogi.views.async_to_sync') as mock_async_to_sync:
+            for idx, move in enumerate(moves):
+                self.client.login(username=['our_user', 'opponent_user'][idx % 2], password='password')
+                response = self.client.put(reverse('game-move'), {'uid': self.game.uid, 'move': move}, content_type='application/json')
+
+                if move == 'b2h8+':
+                    self.assertEqual(response.json()['changes'], [{'square': 'b2', 'piece': None}, {'square': 'h8', 'piece': '+B'}])
+                    self.assertEqual(response.json()['hands'], {'b': {'B': 1}})
+                elif move == 'g9h8':
+                    self.assertEqual(response.json()['hands'], {'w': {'B': 1}})
+                elif move == 'B*e5':
+                    self.assertEqual(response.json()['changes'], [{'square': 'e5', 'piece': 'B'}])
+                    self.assertEqual(response.json()['hands'], {'b': {'B': -1}})
+
+        # 後手以小寫打入，廣播與回應都是正規化的記譜；HTTP 回應另外附上棋盤與下一手的手數
+        broadcast = mock_async_to_sync.return_value.call_args[0][1]['message']
+        self.assertEqual(broadcast['move'], 'B*e6')
+        self.assertNotIn('board', broadcast)
+        self.assertEqual(response.json()['move'], 'B*e6')
+        self.assertEqual(response.json()['next_round'], len(moves) + 1)
+        self.assertEqual(response.json()['board'], str(self.game.replay_shogi_game(len(moves)).board))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class GameResyncTest(TestCase):
+    def setUp(self):
+        self.our_user = User.objects.create_user('our_user', 'our_user@example.com', 'password')
+        opponent_player = Player.objects.create(user=User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password'))
+        self.game = Game.objects.create(our_player=Player.objects.create(user=self.our_user), opponent_player=opponent_player)
+
+        shogi_game = self.game.load_shogi_game()
+        for move in MIDGAME_MOVES[:20]:
+            shogi_game.board.execute_move(parse_move(move), shogi_game.players[shogi_game.game_round % 2])
+            shogi_game.game_round += 1
+            self.game.record_move(shogi_game, parse_move(move))
+        self.game.save_shogi_game(shogi_game)
+
+    def resync(self, query_string):
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.uid}/?{query_string}')
+            communicator.scope['user'] = self.our_user
+            await communicator.connect()
+            messages = []
+            while not await communicator.receive_nothing(timeout=0.2):
+                messages.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return messages
+
+        return async_to_sync(run)()
+
+    def test_replay_missed_moves(self):
+        messages = self.resync('since=18')
+        self.assertEqual([(message['type'], message['seq'], message['move']) for message in messages], [('move', 19, 'f6g7+'), ('move', 20, 'h8g7')])
+        self.assertEqual(messages[0]['changes'], [{'square': 'f6', 'piece': None}, {'square': 'g7', 'piece': '+B'}])
+        self.assertEqual(messages[0]['hands'], {'b': {'N': 1}})
+        self.assertEqual((messages[1]['hands'], messages[1]['next_player']), ({'w': {'B': 1}}, 'our_user'))
+
+    def test_up_to_date_and_large_gap(self):
+        self.assertEqual(self.resync('since=20'), [])
+
+        for query_string in ('', 'since=-3', f'since={20 - RESYNC_REPLAY_LIMIT - 1}'):
+            messages = self.resync(query_string)
+            self.assertEqual([(message['type'], message['seq']) for message in messages], [('snapshot', 20)])
+            self.assertEqual(messages[0]['sfen'], self.game.sfen)
+
+        self.assertEqual(self.resync('since=abc')[0]['status'], 400)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SpectatorTest(TestCase):
+    def setUp(self):
+        User.objects.create_user('our_user', 'our_user@example.com', 'password')
+        User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password')
+        self.game = Game.objects.create(our_player=Player.objects.create(user=User.objects.get(username='our_user')),
+                                        opponent_player=Player.objects.create(user=User.objects.get(username='opponent_user')))
+
+    @patch('Shogi.spectators.SPECTATOR_COALESCE_INTERVAL', 0.5)
+    def test_coalesced_fan_out(self):
+        async def run():
+            spectators = [WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{self.game.uid}/watch/') for _ in range(2)]
+            for communicator in spectators:
+                await communicator.connect()
+                self.assertEqual((await communicator.receive_json_from())['type'], 'snapshot')
+            self.assertEqual(spectator_hub.spectator_count(self.game.uid), 2)
+
+            # 兩手在同一段時間內送出，觀戰者只收到一個 batch
+            for username, move in [('our_user', 'c3c4'), ('opponent_user', 'g7g6')]:
+                message, _, _ = await database_sync_to_async(submit_move)(self.game.uid, username, move)
+                await get_channel_layer().group_send(game_group_name(self.game.uid), {'type': 'game_update', 'message': message})
+
+            for communicator in spectators:
+                batch = await communicator.receive_json_from(timeout=2)
+                self.assertEqual((batch['type'], [message['seq'] for message in batch['messages']]), ('batch', [1, 2]))
+                self.assertTrue(await communicator.receive_nothing(timeout=0.6))
+
+                await communicator.send_json_to({'type': 'move', 'move': 'c4c5'})
+                self.assertEqual((await communicator.receive_json_from())['status'], 403)
+                await communicator.disconnect()
+
+            self.assertEqual(spectator_hub.spectator_count(self.game.uid), 0)
+
+        async_to_sync(run)()
+
+    def test_watch_missing_game(self):
+        async def run():
+            for game_uid in (uuid.uuid4(), 'not-a-uid'):
+                communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/game/{game_uid}/watch/')
+                await communicator.connect()
+
+                # 先確認遊戲存在才訂閱: 收到錯誤後以 4404 關閉 (用戶端不會重新連線)
+                self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'detail': 'Game not found.', 'status': 404})
+                self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4404})
+                self.assertEqual(spectator_hub.spectator_count(str(game_uid)), 0)
+
+        async_to_sync(run)()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class MultiplexConsumerTest(TestCase):
+    def setUp(self):
+        our_player = Player.objects.create(user=User.objects.create_user('our_user', 'our_user@example.com', 'password'))
+        opponent_player = Player.objects.create(user=User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password'))
+        self.games = [Game.objects.create(our_player=our_player, opponent_player=opponent_player) for _ in range(2)]
+
+    @patch('Shogi.spectators.SPECTATOR_COALESCE_INTERVAL', 0.1)
+    def test_subscribe_and_unsubscribe(self):
+        uids = [str(game.uid) for game in self.games]
+
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/games/')
+            await communicator.connect()
+
+            for uid in uids:
+                await communicator.send_json_to({'type': 'subscribe', 'game_id': uid})
+                snapshot = await communicator.receive_json_from()
+                self.assertEqual((snapshot['type'], snapshot['game_id']), ('snapshot', uid))
+
+            missing_uid = str(uuid.uuid4())
+            await communicator.send_json_to({'type': 'subscribe', 'game_id': missing_uid})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'detail': 'Game not found.', 'status': 404, 'game_id': missing_uid})
+            self.assertEqual(spectator_hub.spectator_count(missing_uid), 0)
+
+            # 走步的訊息帶有 game_id
+            message, _, _ = await database_sync_to_async(submit_move)(uids[1], 'our_user', 'c3c4')
+            await get_channel_layer().group_send(game_group_name(uids[1]), {'type': 'game_update', 'message': message})
+            message = await communicator.receive_json_from(timeout=1)
+            self.assertEqual((message['type'], message['game_id'], message['seq']), ('move', uids[1], 1))
+
+            await communicator.send_json_to({'type': 'unsubscribe', 'game_id': uids[0]})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'unsubscribed', 'game_id': uids[0]})
+            self.assertEqual([spectator_hub.spectator_count(uid) for uid in uids], [0, 1])
+
+            await communicator.send_json_to({'type': 'resync', 'game_id': uids[0]})
+            self.assertEqual((await communicator.receive_json_from())['status'], 400)
+
+            await communicator.disconnect()
+            self.assertEqual(spectator_hub.spectator_count(uids[1]), 0)
+
+        async_to_sync(run)()
+
+
+class ShogiBoardMakeUnmakeTest(TestCase):
+    def setUp(self):
+        self.players = [ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)]
+        self.board = ShogiBoard(*self.players)
+
+    def test_unmake_restores_board(self):
+        for idx, move in enumerate(['c3c4', 'g7g6']):
+            self.board.execute_move(parse_move(move), self.players[idx % 2])
+        before = repr(self.board)
+
+        self.board.make_move(parse_move('b2h8+'), self.players[0])  # 吃子並升變
+        self.board.make_move(parse_move('g9h8'), self.players[1])
+        self.board.make_move(parse_move('B*e5'), self.players[0])  # 打入
+        self.assertNotEqual(repr(self.board), before)
+
+        for _ in range(3):
+            self.board.unmake_move()
+
+        self.assertEqual(repr(self.board), before)
+        self.assertFalse(self.board.board[7][1].promoted)
+        self.assertEqual(self.players[0].captured, [])
+        self.assertEqual(self.board.opponent_king_pos, (0, 4))
+
+    def test_king_evade_moves(self):
+        board = [[None for _ in range(9)] for _ in range(9)]
+        board[0][0] = King('K', -1)
+        board[2][4] = Rook('R', -1)
+        board[8][3] = GGeneral('g', 1)
+        board[8][4] = King('k', 1)
+        self.board.insert_board(board)
+        self.board.our_king_pos, self.board.opponent_king_pos = (8, 4), (0, 0)
+        self.players[0].hand.add('P')
+
+        self.assertTrue(self.board.is_in_check(self.players[0]))
+        self.assertEqual(
+            {move_to_string(move) for move in self.board.get_all_king_evade_moves(self.players[0])},
+            {'e1d2', 'e1f2', 'e1f1', 'd1e2', 'P*e2', 'P*e3', 'P*e4', 'P*e5', 'P*e6'}
+        )
+        self.assertEqual(self.players[0].captured, ['P'])
+
+
+class ShogiBoardCheckTest(TestCase):
+    def setUp(self):
+        self.players = [ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)]
+        self.board = ShogiBoard(*self.players)
+
+    def test_get_checkers(self):
+        board = [[None for _ in range(9)] for _ in range(9)]
+        board[0][4] = King('K', -1)
+        board[4][4] = Lance('L', -1)        # 香車射線
+        board[6][3] = Knight('N', -1)       # 桂馬固定位移
+        board[4][0] = Bishop('B', -1)       # 角行射線
+        board[6][2] = Pawn('p', 1)          # 擋住角行
+        board[7][5] = Rook('R', -1, True)   # 龍王斜走一步
+        board[8][4] = King('k', 1)
+        self.board.insert_board(board)
+        self.board.our_king_pos, self.board.opponent_king_pos = (8, 4), (0, 4)
+
+        checkers = self.board.get_checkers(self.players[0])
+        self.assertEqual(sorted(pos for pos, _ in checkers), [(4, 4), (6, 3), (7, 5)])
+        self.assertTrue(self.board.is_in_check(self.players[0]))
+        self.assertFalse(self.board.is_in_check(self.players[1]))
+
+
+class ShogiPieceMoveTableTest(TestCase):
+    def setUp(self):
+        self.board = [[None for _ in range(9)] for _ in range(9)]
+
+    def test_move_tables(self):
+        steps, rays = MOVE_TABLES['N', -1, False][0 * 9 + 1]  # 敵方桂馬在 b9
+        self.assertEqual(rays, ())
+        self.assertEqual([(dst_r, dst_c) for dst_r, dst_c, _, _ in steps], [(2, 0), (2, 2)])
+
+        steps, rays = MOVE_TABLES['L', 1, False][8 * 9 + 0]  # 我方香車在 a1
+        self.assertEqual(steps, ())
+        self.assertEqual(len(rays[0]), 8)
+        self.assertEqual([move_to_string(promoted) for _, _, _, promoted in rays[0][-3:]], ['a1a7+', 'a1a8+', 'a1a9+'])
+
+    def test_get_valid_moves(self):
+        self.board[3][3] = GGeneral('g', 1)
+        self.assertEqual(sorted(map(move_to_string, self.board[3][3].get_valid_moves((3, 3), self.board))), ['d6c6', 'd6c7', 'd6d5', 'd6d7', 'd6e6', 'd6e7'])  # 金將不能升變
+
+        self.board[8][0] = Lance('l', 1, True)  # 升變後的香車走法與金將相同
+        self.assertEqual(sorted(map(move_to_string, self.board[8][0].get_valid_moves((8, 0), self.board))), ['a1a2', 'a1b1', 'a1b2'])
+
+        self.board[6][0] = Rook('r', 1)
+        self.board[2][0] = Pawn('P', -1)
+        self.assertEqual(sorted(map(move_to_string, self.board[6][0].get_valid_moves((6, 0), self.board))), ['a3a2', 'a3a4', 'a3a5', 'a3a6', 'a3a7', 'a3a7+', 'a3b3', 'a3c3', 'a3d3', 'a3e3', 'a3f3', 'a3g3', 'a3h3', 'a3i3'])
+
+
+class MoveCodecTest(TestCase):
+    def test_parse_and_format(self):
+        for notation in ['a3a4', 'h6h7+', 'P*d4', 'R*g5']:
+            self.assertEqual(move_to_string(parse_move(notation)), notation)
+
+        self.assertEqual(parse_move('r*g5'), parse_move('R*g5'))  # 敵方玩家以小寫打入
+        self.assertEqual(parse_move('a3a4'), encode_move((6, 0), (5, 0)))
+        self.assertEqual(decode_move(parse_move('h6h7+')), ((3, 7), (2, 7), True, None))
+        self.assertEqual(decode_move(parse_move('P*d4')), (None, (5, 3), False, 'P'))
+        self.assertEqual(parse_move('P*d4'), encode_drop('p', (5, 3)))
+
+    def test_parse_invalid_notation(self):
+        for notation in ['a0a4', 'z3a4', 'K*e5', '', None]:
+            with self.assertRaisesMessage(Exception, "Incorrect move notation!"):
+                parse_move(notation)
+
+
+class ShogiPieceFlyweightTest(TestCase):
+    def test_pieces_are_interned(self):
+        self.assertIs(Pawn('p', 1), Pawn('p', 1))
+        self.assertIsNot(Pawn('p', 1), Pawn('P', -1))
+        self.assertIs(Pawn('p', 1).promote(), Pawn('p', 1, True))
+        self.assertFalse(hasattr(Pawn('p', 1), '__dict__'))
+
+    def test_pieces_are_immutable(self):
+        with self.assertRaises(AttributeError):
+            Rook('r', 1).promoted = True
+
+    def test_pickle_keeps_flyweights(self):
+        shogi_game = ShogiGame(ShogiPlayer('foo', 1), ShogiPlayer('bar', -1))
+        loaded_game = pickle.loads(pickle.dumps(shogi_game))
+        self.assertIs(loaded_game.board.board[6][0], Pawn('p', 1))
+
+
+class ZobristRepetitionTest(TestCase):
+    def setUp(self):
+        self.players = [ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)]
+        self.shogi_game = ShogiGame(*self.players)
+        self.board = self.shogi_game.board
+
+    def test_incremental_hash(self):
+        start_hash = self.board.zobrist_hash
+
+        for idx, move in enumerate(['c3c4', 'g7g6', 'b2h8+', 'g9h8', 'B*e5']):
+            self.board.make_move(parse_move(move), self.players[idx % 2])
+            self.assertEqual(self.board.zobrist_hash, self.board._compute_zobrist_hash())
+
+        for _ in range(5):
+            self.board.unmake_move()
+        self.assertEqual(self.board.zobrist_hash, start_hash)
+
+    def test_fourfold_repetition_is_draw(self):
+        shuffle = ['h2g2', 'b8c8', 'g2h2', 'c8b8']
+
+        for idx, move in enumerate(shuffle * 2):
+            self.board.execute_move(parse_move(move), self.players[idx % 2])
+            self.assertEqual(self.shogi_game.get_game_ended(*self.players), 0)
+
+        self.assertEqual(self.board.get_repetition_count(), 3)
+
+        for idx, move in enumerate(shuffle):
+            self.board.execute_move(parse_move(move), self.players[idx % 2])
+
+        self.assertEqual(self.board.get_repetition_count(), 4)
+        self.assertEqual(self.shogi_game.get_game_ended(*self.players), DRAW)
+
+
+class ShogiBoardLegalMovesTest(TestCase):
+    def setUp(self):
+        self.players = [ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)]
+        self.board = ShogiBoard(*self.players)
+
+    def insert_board(self, pieces):
+        board = [[None for _ in range(9)] for _ in range(9)]
+        board[0][0] = King('K', -1)
+        board[8][4] = King('k', 1)
+        for (r, c), piece in pieces.items():
+            board[r][c] = piece
+        self.board.insert_board(board)
+        self.board.our_king_pos, self.board.opponent_king_pos = (8, 4), (0, 0)
+
+    def legal_moves(self):
+        return {move_to_string(move) for move in self.board.legal_moves(self.players[0])}
+
+    def test_initial_position(self):
+        self.assertEqual(len(self.board.legal_moves(self.players[0])), 30)
+
+    def test_pinned_piece_moves_along_pin(self):
+        self.insert_board({(6, 4): SGeneral('s', 1), (2, 4): Rook('R', -1)})
+
+        silver_moves = {move for move in self.legal_moves() if move.startswith('e3')}
+        self.assertEqual(silver_moves, {'e3e4'})
+
+    def test_interpose_and_drop_in_check(self):
+        self.insert_board({(4, 4): Rook('R', -1), (7, 0): Pawn('p', 1, True)})
+        self.players[0].hand.add('G')
+        self.players[0].hand.add('P')
+
+        moves = self.legal_moves()
+        self.assertTrue({'G*e2', 'G*e3', 'G*e4', 'P*e2', 'P*e3', 'P*e4'} <= moves)
+        self.assertFalse({'G*a5', 'e1e2'} & moves)
+        self.assertEqual({move for move in moves if move.startswith('e1')}, {'e1d1', 'e1f1', 'e1d2', 'e1f2'})
+
+    def test_drop_evasion_only_between_checker_and_king(self):
+        self.insert_board({(2, 4): Lance('L', -1)})
+        for kind in 'PPPS':
+            self.players[0].hand.add(kind)
+
+        drops = sorted(move for move in self.legal_moves() if '*' in move)
+        self.assertEqual(drops, sorted(f'{name}*e{rank}' for name in 'SP' for rank in range(2, 7)))
+
+        self.insert_board({(6, 3): Knight('N', -1)})
+        self.assertFalse(any('*' in move for move in self.legal_moves()))
+
+    def test_double_check_only_king_moves(self):
+        self.insert_board({(4, 4): Lance('L', -1), (6, 3): Knight('N', -1), (7, 0): GGeneral('g', 1)})
+        self.players[0].hand.add('G')
+
+        self.assertTrue(all(move.startswith('e1') for move in self.legal_moves()))
+
+    def test_nifu_ignores_tokin(self):
+        self.insert_board({(3, 0): Pawn('p', 1, True), (6, 1): Pawn('p', 1)})
+        self.players[0].hand.add('P')
+
+        drops = {move for move in self.legal_moves() if move.startswith('P*')}
+        self.assertIn('P*a5', drops)
+        self.assertFalse(any(move[2] == 'b' for move in drops))
+        self.assertFalse(any(move[3] == '9' for move in drops))
+
+
+class PerftTest(TestCase):
+    def test_perft_node_counts(self):
+        for name, (moves, expected) in PERFT_POSITIONS.items():
+            board, player, opponent_player = setup_position(moves)
+            for depth in (1, 2):
+                self.assertEqual(perft(board, player, opponent_player, depth), expected[depth], name)
+
+
+# 吞吐量與機器有關，預設不執行: SHOGI_BENCHMARK=1 python manage.py test Shogi --tag benchmark
+@tag('benchmark')
+@skipUnless(os.environ.get('SHOGI_BENCHMARK'), 'set SHOGI_BENCHMARK=1 to run the perft benchmark')
+class PerftBenchmarkTest(TestCase):
+    def test_perft_throughput(self):
+        total_nodes, total_seconds = 0, 0.0
+
+        for name, (_, expected) in PERFT_POSITIONS.items():
+            nodes, seconds = run_perft(name, 3)
+            self.assertEqual(nodes, expected[3], name)
+            total_nodes += nodes
+            total_seconds += seconds
+
+        self.assertGreaterEqual(total_nodes / total_seconds, PERFT_NPS_BASELINE)
+
+
+class ShogiGameEndedTest(TestCase):
+    def setUp(self):
+        self.players = [ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)]
+        self.game = ShogiGame(*self.players)
+
+    def test_skip_evasion_search_when_not_in_check(self):
+        with patch.object(self.game.board, 'legal_moves') as mock_legal_moves:
+            self.assertEqual(self.game.get_game_ended(*self.players), 0)
+            mock_legal_moves.assert_not_called()
+
+    def test_checkmate_side_to_move(self):
+        board = [[None for _ in range(9)] for _ in range(9)]
+        board[0][0] = King('K', -1)
+        board[4][4] = Lance('L', -1)
+        board[7][4] = GGeneral('G', -1)
+        board[8][4] = King('k', 1)
+        self.game.board.insert_board(board, side_to_move=1)
+        self.game.board.our_king_pos, self.game.board.opponent_king_pos = (8, 4), (0, 0)
+
+        self.assertEqual(self.game.get_game_ended(*self.players), -1)
+        self.assertEqual(self.game.get_game_ended(*reversed(self.players)), -1)
+
+    def test_check_status_cache(self):
+        board = self.game.board
+        for move in ['c3c4', 'd7d6']:
+            board.execute_move(parse_move(move), self.players[board.side_to_move == -1])
+
+        self.assertFalse(board.is_in_check(self.players[1]))
+        board.make_move(parse_move('b2g7+'), self.players[0])
+        self.assertTrue(board.is_in_check(self.players[1]))
+        board.unmake_move()
+        self.assertFalse(board.is_in_check(self.players[1]))
+
+
+class ShogiHandTest(TestCase):
+    def test_capture_demotes_and_counts(self):
+        player = ShogiPlayer('foo', 1)
+        for piece in [Pawn('P', -1, True), Pawn('P', -1), Rook('R', -1, True), SGeneral('S', -1)]:
+            player.capture(piece)
+
+        self.assertEqual(player.hand.count('P'), 2)
+        self.assertIn('R', player.hand)
+        self.assertNotIn('B', player.hand)
+        self.assertEqual(list(player.hand), ['R', 'S', 'P'])
+        self.assertEqual(player.captured, ['R', 'S', 'P', 'P'])
+
+        player.drop('P')
+        player.uncapture(Rook('R', -1, True))
+        self.assertEqual(ShogiPlayer('bar', -1, ShogiHand(player.hand.counts)).captured, ['s', 'p'])
+
+        with self.assertRaisesMessage(Exception, "You don't have this piece to drop!"):
+            player.drop('B')
+
+    def test_hand_is_not_hashable(self):
+        # 持駒會變動，不能當作 dict 的 key
+        with self.assertRaises(TypeError):
+            hash(ShogiHand())
+
+
+class SfenTest(TestCase):
+    def test_initial_position(self):
+        shogi_game = ShogiGame(ShogiPlayer('foo', 1), ShogiPlayer('bar', -1))
+        self.assertEqual(shogi_game.to_sfen(), INITIAL_SFEN)
+
+    def test_round_trip(self):
+        board, player, opponent_player = setup_position(MIDGAME_MOVES)
+        sfen = board.to_sfen(len(MIDGAME_MOVES) + 1)
+        self.assertEqual(sfen, "ln1g1k2l/2s+Br1g2/p1pp3p1/1p2p3p/5PR2/2P5P/PP1PP2P1/1b1S1S3/1N1GNKGNL b SL2Pp 41")
+
+        shogi_game = ShogiGame.from_sfen(sfen, ShogiPlayer('foo', 1), ShogiPlayer('bar', -1))
+        self.assertEqual(shogi_game.to_sfen(), sfen)
+        self.assertEqual(shogi_game.game_round, len(MIDGAME_MOVES))
+        self.assertEqual(repr(shogi_game.board), repr(board))
+        self.assertEqual(shogi_game.board.zobrist_hash, board.zobrist_hash)
+        self.assertEqual(shogi_game.board.opponent_king_pos, board.opponent_king_pos)
+        self.assertEqual(len(shogi_game.board.legal_moves(shogi_game.current_player)), PERFT_POSITIONS['midgame'][1][1])
+
+    def test_invalid_sfen(self):
+        for sfen in ["", "9/9/9 b - 1", INITIAL_SFEN.replace(' b ', ' x '), INITIAL_SFEN.replace('-', '2K'), "+k8/9/9/9/9/9/9/9/4K4 b - 1"]:
+            with self.assertRaisesMessage(Exception, "Incorrect SFEN!"):
+                ShogiGame.from_sfen(sfen, ShogiPlayer('foo', 1))
+
+    def test_game_model_store_and_load(self):
+        our_player = Player.objects.create(user=User.objects.create_user('our_user', 'our_user@example.com', 'password'))
+        opponent_player = Player.objects.create(user=User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password'))
+        game = Game.objects.create(our_player=our_player, opponent_player=opponent_player)
+
+        shogi_game = game.load_shogi_game()
+        for move in ['h2g2', 'b8c8', 'g2h2', 'c8b8']:
+            shogi_game.board.execute_move(parse_move(move), shogi_game.players[shogi_game.game_round % 2])
+            shogi_game.game_round += 1
+            game.record_move(shogi_game, parse_move(move))
+        game.store_shogi_game(shogi_game)
+        game.save()
+
+        loaded_game = Game.objects.get(uid=game.uid).load_shogi_game()
+        self.assertEqual(loaded_game.players[1].name, 'opponent_user')
+        self.assertEqual(loaded_game.to_sfen(), "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 5")
+        self.assertEqual(loaded_game.board.get_repetition_count(), 2)
+
+
+class LegacyReplayTest(TestCase):
+    def test_matches_engine_on_legal_record(self):
+        record = "c3c4 g7g6 b2h8+ g9h8 B*e5 b*e6"
+        position, moves = replay_game_record(record)
+
+        shogi_game = ShogiGame(ShogiPlayer("", 1), ShogiPlayer("", -1))
+        for notation, (move, zobrist_hash) in zip(record.split(), moves):
+            shogi_game.board.execute_move(parse_move(notation), shogi_game.players[shogi_game.game_round % 2])
+            shogi_game.game_round += 1
+            self.assertEqual((move, zobrist_hash), (parse_move(notation), shogi_game.board.zobrist_hash))
+        self.assertEqual(position.to_sfen(), shogi_game.to_sfen())
+
+    def test_pack_matches_codec(self):
+        # 最後一個棋譜吃掉玉將，編碼中沒有輪到的一方
+        for record in ["", " ".join(MIDGAME_MOVES), "c3c4 g7g6 b2h8+ a7a6 h8g9 a6a5 g9f9 a5a4 f9e9"]:
+            sfen = replay_game_record(record)[0].to_sfen()
+            shogi_game = ShogiGame.from_sfen(sfen, ShogiPlayer("", 1), ShogiPlayer("", -1))
+            self.assertEqual(LegacyPosition.from_sfen(sfen).pack(), shogi_game.to_packed())
+
+    def test_accepts_moves_the_old_engine_allowed(self):
+        # 舊的引擎允許角行穿過棋子
+        position, moves = replay_game_record("c3c4 a7a6 b2i9")
+        self.assertEqual(position.to_sfen(), "lnsgkgsnB/1r5b1/1pppppppp/p8/9/2P6/PP1PPPPPP/7R1/LNSGKGSNL w L 4")
+        self.assertEqual(len(moves), 3)
+
+    def test_rejects_unplayable_records(self):
+        # 升變的金將、走對方的棋子、沒有的持駒、空的格子、不存在的格子
+        for record in ["f1f2+", "e9e8", "P*e5", "c3c4 g7g6 c3c4", "a3a0"]:
+            with self.assertRaises(LegacyReplayError, msg=record):
+                replay_game_record(record)
+
+
+class MoveLogTest(TestCase):
+    def setUp(self):
+        our_player = Player.objects.create(user=User.objects.create_user('our_user', 'our_user@example.com', 'password'))
+        opponent_player = Player.objects.create(user=User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password'))
+        self.game = Game.objects.create(our_player=our_player, opponent_player=opponent_player)
+
+        shogi_game = self.game.load_shogi_game()
+        for move in MIDGAME_MOVES:
+            shogi_game.board.execute_move(parse_move(move), shogi_game.players[shogi_game.game_round % 2])
+            shogi_game.game_round += 1
+            self.game.record_move(shogi_game, parse_move(move))
+        self.game.store_shogi_game(shogi_game)
+        self.game.save()
+
+    def test_moves_and_snapshots(self):
+        self.assertEqual(self.game.moves.count(), len(MIDGAME_MOVES))
+        self.assertEqual(list(self.game.snapshots.values_list('ply', flat=True)), [16, 32])
+        self.assertEqual(self.game.game_record, "".join(f"{move} " for move in MIDGAME_MOVES))
+
+    def test_replay_from_snapshot(self):
+        for ply in (0, 10, 16, 20, len(MIDGAME_MOVES)):
+            board, *_ = setup_position(MIDGAME_MOVES[:ply])
+            shogi_game = self.game.replay_shogi_game(ply)
+            self.assertEqual(shogi_game.to_sfen(), board.to_sfen(ply + 1))
+            self.assertEqual(shogi_game.board.position_history, board.position_history)
+
+        loaded_game = Game.objects.get(uid=self.game.uid).load_shogi_game()
+        self.assertEqual(loaded_game.to_sfen(), self.game.replay_shogi_game().to_sfen())
+        self.assertEqual(loaded_game.board.position_history, board.position_history)
+
+    def test_snapshot_after_king_capture(self):
+        game = Game.objects.create(our_player=self.game.our_player, opponent_player=self.game.opponent_player)
+        shogi_game = game.load_shogi_game()
+
+        # 第 9 手 (先手) 吃掉玉將，快照中沒有王，輪到後手
+        with patch('Shogi.models.SNAPSHOT_INTERVAL', 9):
+            for move in ['c3c4', 'g7g6', 'b2h8+', 'a7a6', 'h8g9', 'a6a5', 'g9f9', 'a5a4', 'f9e9']:
+                shogi_game.board.execute_move(parse_move(move), shogi_game.players[shogi_game.game_round % 2])
+                shogi_game.game_round += 1
+                game.record_move(shogi_game, parse_move(move))
+        game.store_shogi_game(shogi_game)
+        game.save()
+
+        snapshot = game.snapshots.get()
+        self.assertEqual((snapshot.ply, snapshot.side_to_move, snapshot.king_captured_by), (9, -1, 1))
+
+        replayed_game = game.replay_shogi_game()
+        self.assertEqual(replayed_game.to_sfen(), shogi_game.to_sfen())
+        self.assertEqual(replayed_game.board.zobrist_hash, shogi_game.board.zobrist_hash)
+        self.assertEqual(replayed_game.get_game_ended(*replayed_game.players), 1)
+
+
+class ShogiGameCacheTest(TestCase):
+    def test_lru_eviction(self):
+        cache = ShogiGameCache(max_entries=2)
+        games = [ShogiGame(ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)) for _ in range(3)]
+        cache.put('a', 1, games[0])
+        cache.put('b', 1, games[1])
+        cache.put('c', 1, games[2])
+
+        self.assertIsNone(cache.get('a', 1))
+        self.assertIs(cache.get('b', 1), games[1])
+        self.assertIsNone(cache.get('b', 1))  # get 會取出遊戲
+        self.assertIsNone(cache.get('c', 2))  # version 不同
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_size_limit(self):
+        shogi_game = ShogiGame(ShogiPlayer('foo', 1), ShogiPlayer('bar', -1))
+        cache = ShogiGameCache(max_size=estimate_size(shogi_game) * 2)
+        for uid in range(3):
+            cache.put(uid, 1, ShogiGame(ShogiPlayer('foo', 1), ShogiPlayer('bar', -1)))
+
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.stats()['size'], cache.max_size)
+
+    def test_game_move_uses_cache(self):
+        our_user = User.objects.create_user('our_user', 'our_user@example.com', 'password')
+        opponent_user = User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password')
+        game = Game.objects.create(our_player=Player.objects.create(user=our_user), opponent_player=Player.objects.create(user=opponent_user))
+        game_cache.clear()
+
+        for username, move in [('our_user', 'c3c4'), ('opponent_user', 'g7g6')]:
+            self.client.login(username=username, password='password')
+            with patch('Shogi.views.async_to_sync'):
+                response = self.client.put(reverse('game-move'), {'uid': game.uid, 'move': move}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(game_cache.stats()['misses'], 1)
+        self.assertEqual(game_cache.stats()['hits'], 1)
+        game.refresh_from_db()
+        self.assertEqual(game.version, 2)
+        self.assertEqual(game.load_shogi_game().to_sfen(), game.sfen)
+
+
+class OptimisticConcurrencyTest(TestCase):
+    def setUp(self):
+        self.our_user = User.objects.create_user('our_user', 'our_user@example.com', 'password')
+        opponent_user = User.objects.create_user('opponent_user', 'opponent_user@example.com', 'password')
+        self.game = Game.objects.create(our_player=Player.objects.create(user=self.our_user), opponent_player=Player.objects.create(user=opponent_user))
+
+    def test_stale_version_is_not_saved(self):
+        first, second = Game.objects.get(uid=self.game.uid), Game.objects.get(uid=self.game.uid)
+        game_cache.clear()
+
+        for game, move in [(first, 'c3c4'), (second, 'g3g4')]:
+            shogi_game = game.load_shogi_game()
+            shogi_game.board.execute_move(parse_move(move), shogi_game.players[0])
+            shogi_game.game_round += 1
+            self.assertEqual(game.save_shogi_game(shogi_game), game is first)
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.version, 1)
+        self.assertEqual(self.game.sfen, first.sfen)
+        self.assertEqual(second.version, 0)
+
+    def test_game_move_conflict(self):
+        self.client.login(username='our_user', password='password')
+
+        # 載入後、保存前已有其他 request 保存了走步
+        with patch('Shogi.views.async_to_sync'), patch.object(Game, 'record_move') as record_move, \
+                patch.object(Game, 'store_shogi_game', lambda game, shogi_game: Game.objects.filter(uid=game.uid).update(version=5)):
+            response = self.client.put(reverse('game-move'), {'uid': self.game.uid, 'move': 'c3c4'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 409)
+        record_move.assert_not_called()
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.sfen, INITIAL_SFEN)
+
+
+class PackedPositionTest(TestCase):
+    def test_round_trip(self):
+        board, player, opponent_player = setup_position(MIDGAME_MOVES)
+        data = board.to_packed()
+        self.assertEqual(len(data), PACKED_POSITION_SIZE)
+
+        shogi_game = ShogiGame.from_packed(data, len(MIDGAME_MOVES), ShogiPlayer('foo', 1), ShogiPlayer('bar', -1))
+        self.assertEqual(shogi_game.to_sfen(), board.to_sfen(len(MIDGAME_MOVES) + 1))
+        self.assertEqual(shogi_game.board.zobrist_hash, board.zobrist_hash)
+
+    def test_bulk_pack_and_unpack(self):
+        positions = []
+        for moves in (MIDGAME_MOVES[:n] for n in range(0, len(MIDGAME_MOVES) + 1, 10)):
+            board, *players = setup_position(moves)
+            positions.append(unpack_position(board.to_packed()))
+
+        data = pack_positions(positions)
+        self.assertEqual(len(data), PACKED_POSITION_SIZE * len(positions))
+        self.assertEqual([pack_position(*position) for position in unpack_positions(data)], [pack_position(*position) for position in positions])
+
+    def test_captured_king(self):
+        board, player, opponent_player = setup_position(['c3c4', 'd7d6'])
+        board.make_move(encode_move((7, 1), (0, 4)), player)  # 不檢查走步，直接吃掉玉將
+
+        unpacked_board, our_hand, opponent_hand, _ = unpack_position(board.to_packed())
+        self.assertEqual(unpacked_board, board.board)
+        self.assertEqual(our_hand, player.hand)
+
+    def test_incomplete_position(self):
+        board = [[None for _ in range(9)] for _ in range(9)]
+        board[0][4], board[8][4] = King('K', -1), King('k', 1)
+
+        with self.assertRaisesMessage(Exception, "Position can't be packed!"):
+            pack_position(board, ShogiHand(), ShogiHand(), 1)
+        with self.assertRaisesMessage(Exception, "Incorrect packed position!"):
+            unpack_position(b"\xff" * PACKED_POSITION_SIZE)
+
+    def test_game_board_session(self):
+        url = reverse('game_board')
+        for move in ['c3c4', 'g7g6']:
+            self.client.post(url, {'move': move})
+
+        session_game = self.client.session['game']
+        self.assertEqual(session_game['game_round'], 2)
+        self.assertEqual(len(session_game['position_history']), 3)
+        response = self.client.post(url, {'move': 'b2h8+'})
+        self.assertEqual(response.context['board'].board[1][7].name, 'b')
@@ -1,25 +1,31 @@
-import pickle
 import base64
+import uuid
 
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib import auth
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 
 from rest_framework import views, status, permissions, exceptions, generics
 from rest_framework.response import Response
+from rest_framework.pagination import Cursor, CursorPagination
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from .serializers import RegisterSerializer, LoginSerializer, PlayerSerializer, GameSerializer, GameJoinSerializer, GameMoveSerializer, GameMovesSerializer
+from .serializers import RegisterSerializer, LoginSerializer, PlayerSerializer, GameSerializer, GameListSerializer, GameJoinSerializer, GameMoveSerializer, GameMovesSerializer, LeaderboardSerializer
 
-from .game import ShogiGame
+from .game import ShogiGame, DRAW
 from .player import ShogiPlayer
+from .move import parse_move
 
 from .models import Player, Game, GameStatus
-
-OUR_PLAYER, OPPONENT_PLAYER = 0, 1
+from .cache import game_cache
+from .services import OUR_PLAYER, OPPONENT_PLAYER, MoveError, submit_move, game_group_name
+from .export import finished_games, iter_ndjson, iter_gzip, aiter_chunks
 
 
 def index(request):
@@ -52,26 +58,22 @@ def game_socket(request, uid):
     
     # 根據 game_uid 獲取遊戲實例
     try:
-        game = Game.objects.get(uid=uid)
+        game = Game.objects.select_related('our_player__user', 'opponent_player__user').get(uid=uid)
     except Game.DoesNotExist:
         return HttpResponse('The game is not found.', status=status.HTTP_404_NOT_FOUND)
     
     if game.status == GameStatus.FINISHED:
         return HttpResponse('The game is over.', status=status.HTTP_200_OK)
-    
-    shogi_game = pickle.loads(game.binary_game)
-    shogi_game.current_player = shogi_game.players[shogi_game.game_round % 2]
 
     # 檢查玩家是否是遊戲的一部分
-    try:
-        shogi_players_name = [player.name for player in shogi_game.players]
-    except:
+    if not game.opponent_player:
         return HttpResponse('This game has not yet been joined by another player.', status=status.HTTP_403_FORBIDDEN)
     
-    if request.user.username not in shogi_players_name:
+    if request.user.username not in (game.our_player.user.username, game.opponent_player.user.username):
         return HttpResponse('You are not a player of this game', status=status.HTTP_403_FORBIDDEN)
-        
-    return render(request, 'game_socket.html', {'game_uid': uid, 'board': shogi_game.board})
+
+    # 不需要還原遊戲，局面由 WebSocket 連線時的 snapshot 傳送
+    return render(request, 'game_socket.html', {'game_uid': uid})
 
 
 def reset_session(request):
@@ -80,14 +82,15 @@ def reset_session(request):
 
 
 def game_board(request):
-    encoded_game = request.session.get('game')
+    session_game = request.session.get('game')
+    players = (ShogiPlayer("Gojo Satoru", 1), ShogiPlayer("Geto Suguru", -1))
 
-    if encoded_game:
-        game_bytes = base64.b64decode(encoded_game)
-        game = pickle.loads(game_bytes)
+    if isinstance(session_game, dict):
+        game = ShogiGame.from_packed(base64.b64decode(session_game['position']), session_game['game_round'], *players)
+        game.board.set_position_history(session_game['position_history'])
     else:
-        game = ShogiGame(ShogiPlayer("Gojo Satoru", 1), ShogiPlayer("Geto Suguru", -1))
-        
+        game = ShogiGame(*players)
+
 
     if request.method == 'POST':
         move = request.POST.get('move')
@@ -96,25 +99,28 @@ def game_board(request):
             game.current_player = game.players[game.game_round % 2]
             game.next_player = game.players[1 - game.game_round % 2]
 
-            game.board.execute_move(move, game.current_player)
+            game.board.execute_move(parse_move(move), game.current_player)
             result = game.get_game_ended(game.current_player, game.next_player)
 
             if result:
                 # Game over
                 winner = result
 
-                if winner == 1:
+                if winner == DRAW:
+                    print("Draw by repetition")
+                elif winner == game.current_player.team:
                     print(f"Winner is {game.current_player.name}")
                 else:
                     print(f"Winner is {game.next_player.name}")
 
             game.game_round += 1
 
-            # Use "pickle" to serialization shogi game object
-            # then transfer to base64
-            # Finally store to session
-            game_bytes = pickle.dumps(game)
-            request.session['game'] = base64.b64encode(game_bytes).decode('utf-8')
+            # 以 32 bytes 的局面編碼 (base64) 與局面紀錄保存到 session
+            request.session['game'] = {
+                'position': base64.b64encode(game.to_packed()).decode('utf-8'),
+                'game_round': game.game_round,
+                'position_history': game.board.position_history
+            }
         except Exception as e:
             pass
 
@@ -246,24 +252,160 @@ class PlayerView(generics.RetrieveAPIView):
             raise exceptions.NotFound("Player does not found")
 
 
+class LeaderboardView(views.APIView):
+    def get(self, request):
+        # ?limit=N 取前 N 名 (預設 10，最多 1000)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 1000)
+        except ValueError:
+            return Response({'detail': 'limit must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if limit < 1:
+            return Response({'detail': 'limit must be at least 1.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(LeaderboardSerializer(Player.leaderboard(limit), many=True).data, status=status.HTTP_200_OK)
+
+
+class PlayerRankView(views.APIView):
+    def get(self, request, username):
+        try:
+            player = Player.objects.select_related('user').get(user__username=username)
+        except Player.DoesNotExist:
+            raise exceptions.NotFound("Player does not found")
+
+        player.rank = player.get_rank()
+        return Response(LeaderboardSerializer(player).data, status=status.HTTP_200_OK)
+
+
+class GameExportView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        # 已結束的遊戲以 NDJSON 串流輸出，?compress=gzip 時壓縮
+        chunks = iter_ndjson(finished_games())
+
+        if request.query_params.get('compress') == 'gzip':
+            chunks, content_type, filename = iter_gzip(chunks), 'application/gzip', 'games.ndjson.gz'
+        else:
+            content_type, filename = 'application/x-ndjson', 'games.ndjson'
+
+        # ASGI (daphne) 需要 async iterator 才會邊產生邊傳送
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiter_chunks(chunks)
+
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+        return response
+
+
 class GameDetailDeleteView(generics.RetrieveDestroyAPIView):
-    queryset = Game.objects.all()
+    queryset = Game.objects.prefetch_related('moves')
     serializer_class = GameSerializer
     lookup_field = 'uid'
 
 
+class GamePagination(CursorPagination):
+    '''
+    Keyset pagination: 游標為頁面邊界遊戲的 (timestamp, uid)，以 (timestamp, uid) < 游標 篩選
+    DRF 的 CursorPagination 只以 ordering[0] 定位，同一時間的遊戲改用 OFFSET，有新增的遊戲時會重複或漏掉；
+    這裡兩個欄位一起比較，深的頁數也不需要 OFFSET
+    '''
+    ordering = ('-timestamp', '-uid')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+
+        if self.cursor:
+            timestamp, uid = self._decode_position(self.cursor.position)
+            if reverse:
+                queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, uid__gt=uid))
+            else:
+                queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, uid__lt=uid))
+
+        # 多取一筆判斷後面是否還有遊戲
+        results = list(queryset.order_by(*(('timestamp', 'uid') if reverse else self.ordering))[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        # 往回翻頁時，下一頁就是來源的頁面
+        self.has_next, self.has_previous = (True, has_more) if reverse else (has_more, self.cursor is not None)
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._encode_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._encode_position(self.page[0])))
+
+    @staticmethod
+    def _encode_position(game: Game) -> str:
+        return f'{game.timestamp.isoformat()}|{game.uid}'
+
+    def _decode_position(self, position):
+        try:
+            timestamp, uid = position.split('|')
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None:
+                raise ValueError
+            return timestamp, uuid.UUID(uid)
+        except (AttributeError, ValueError):
+            raise exceptions.NotFound(self.invalid_cursor_message)
+
+
 class GameListView(generics.ListAPIView):
-    queryset = Game.objects.all()
-    serializer_class = GameSerializer
+    serializer_class = GameListSerializer
+    pagination_class = GamePagination
     lookup_field = 'uid'
 
+    def get_queryset(self):
+        '''
+        ?status=Ongoing|Finished 與 ?player=<username> (我方或敵方) 篩選，不載入 binary_game
+        '''
+        queryset = Game.objects.defer('binary_game')
+
+        game_status = self.request.query_params.get('status')
+        if game_status:
+            if game_status not in GameStatus.values:
+                raise exceptions.ValidationError({'status': f"Must be one of {', '.join(GameStatus.values)}."})
+            queryset = queryset.filter(status=game_status)
+
+        username = self.request.query_params.get('player')
+        if username:
+            player_id = Player.objects.filter(user__username=username).values('id')
+            queryset = queryset.filter(Q(our_player__in=player_id) | Q(opponent_player__in=player_id))
+
+        return queryset
+
 
 class GameMovesView(generics.RetrieveAPIView):
-    queryset = Game.objects.all()
+    queryset = Game.objects.prefetch_related('moves')
     serializer_class = GameMovesSerializer
     lookup_field = 'uid'
 
 
+class GameCacheStatsView(views.APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        # 這個 worker 的 ShogiGame cache 使用狀況
+        return Response(game_cache.stats(), status=status.HTTP_200_OK)
+
+
 class GameCreateView(generics.CreateAPIView):
     queryset = Game.objects.all()
     serializer_class = GameSerializer
@@ -274,11 +416,8 @@ class GameCreateView(generics.CreateAPIView):
 
         player, _ = Player.objects.get_or_create(user=request.user)
 
-        our_player = ShogiPlayer(player.user.username, 1)
-        shogi_game = ShogiGame(our_player)
-        
-        # 保存遊戲模型的實例到資料庫
-        game = serializer.save(our_player=player, binary_game=pickle.dumps(shogi_game))
+        # 保存遊戲模型的實例到資料庫，局面預設為起始局面的 SFEN
+        game = serializer.save(our_player=player)
 
         # 返回遊戲 uid
         headers = self.get_success_headers(serializer.data)
@@ -313,12 +452,14 @@ class GameJoinView(generics.UpdateAPIView):
             return Response({'detail': 'our_player isn\'t equal to opponent_player.'}, status=status.HTTP_403_FORBIDDEN)
         game.opponent_player = player
 
-        shogi_game = pickle.loads(game.binary_game)
+        # 敵方玩家由 game.opponent_player 載入到將棋類別 (cache 中的遊戲還沒有敵方玩家)
+        game_cache.invalidate(game.uid)
+        shogi_game = game.load_shogi_game()
 
-        # Set opponent_player to shogi_game: 新增敵方玩家到將棋類別
-        opponent_player = ShogiPlayer(player.user.username, -1)
-        shogi_game.players[OPPONENT_PLAYER] = opponent_player
-        shogi_game.board.opponent_player = opponent_player
+        # 同時有其他玩家加入時只有一個會成功
+        if not game.save_shogi_game(shogi_game, opponent_player=player):
+            return Response({'detail': 'Game has already an opponent.'}, status=status.HTTP_409_CONFLICT)
+        game.cache_shogi_game(shogi_game)
 
         print(shogi_game.board)
 
@@ -328,9 +469,6 @@ class GameJoinView(generics.UpdateAPIView):
             "board": str(shogi_game.board)
         }
 
-        game.binary_game = pickle.dumps(shogi_game)
-        game.save()
-
         return Response(shogi_board_data, status=status.HTTP_200_OK)
     
 
@@ -344,78 +482,27 @@ class GameMoveView(generics.UpdateAPIView):
         game_uid = request.data.get('uid')
         if not game_uid:
             return Response({'detail': 'Game ID is required.'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # 根據 game_uid 獲取遊戲實例
-        try:
-            game = Game.objects.get(uid=game_uid)
-        except Game.DoesNotExist:
-            return Response({'detail': 'Game not found.'}, status=status.HTTP_404_NOT_FOUND)
-        
-        if game.status == GameStatus.FINISHED:
-            return Response({'detail': 'The game is over.'}, status=status.HTTP_200_OK)
-        
-        shogi_game = pickle.loads(game.binary_game)
-        shogi_game.current_player = shogi_game.players[shogi_game.game_round % 2]
-        shogi_game.next_player = shogi_game.players[1 - shogi_game.game_round % 2]
-
-        # 檢查玩家是否是遊戲的一部分
-        shogi_players_name = [player.name for player in shogi_game.players]
-        req_player = request.user.username
-        if req_player not in shogi_players_name:
-            return Response({'detail': 'You are not a player of this game.'}, status=status.HTTP_403_FORBIDDEN)
-        
-        # 檢查執行走步時，request user 是不是當前的 player
-        if req_player != shogi_game.current_player.name:
-            return Response({'detail': 'This is not your turn!'}, status=status.HTTP_403_FORBIDDEN)
 
-        # 執行棋步，並更新遊戲狀態，如果例外會回傳 400
+        # 驗證並執行走步 (與 WebSocket 的走步共用 services.submit_move)
         try:
-            move = request.data.get('move')
-            shogi_game.board.execute_move(move, shogi_game.current_player)
-            game.game_record += f"{move} "
-            shogi_game.game_round += 1
-        except Exception as e:
-            return Response({'detail': f'{e}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        print(shogi_game.board)  # 在 CMD 查看走步後的棋盤
-
-        winner = 0  # 不會有玩家 id 為 0
-        result = shogi_game.get_game_ended(shogi_game.players[OUR_PLAYER], shogi_game.players[OPPONENT_PLAYER])
-        if result:
-            if result == 1:
-                winner = game.our_player
-            else:
-                winner = game.opponent_player
-
-            game.end_game(winner)
-        
-        # 保存遊戲的變動
-        game.binary_game = pickle.dumps(shogi_game)
-        game.save()
-        
-        shogi_board_data = {
-            'game_id': str(game.uid),
-            'move': move,
-            "next_round": shogi_game.game_round + 1,
-            "next_player": shogi_game.next_player.name,
-            "board": str(shogi_game.board),
-            "winner": "" if winner == 0 else shogi_players_name[OUR_PLAYER] if winner == 1 else shogi_players_name[OPPONENT_PLAYER]
-        }
+            shogi_board_data, result, board = submit_move(game_uid, request.user.username, request.data.get('move'), render_board=True)
+        except MoveError as e:
+            return Response({'detail': e.detail}, status=e.status_code)
 
         # 一旦遊戲狀態更新，就發送一個 WebSocket 消息
         channel_layer = get_channel_layer()
-        group_name = f'game_{game.uid}'  # 需與你的 routing 名稱相符
 
         # 轉換同步代碼以進行異步通道層調用
         async_to_sync(channel_layer.group_send)(
-            group_name,
+            game_group_name(shogi_board_data['game_id']),
             {
                 'type': 'game_update',  # 對應於 consumers 中的方法名稱
                 'message': shogi_board_data
             }
         )
 
-        if winner:
+        if result:
             return Response({'detail': 'Game over'}, status=status.HTTP_200_OK)
 
-        return Response(shogi_board_data, status=status.HTTP_200_OK)
\ No newline at end of file
+        # HTTP 回應另外附上走步後的棋盤與下一手的手數 (WebSocket 廣播只有差異)
+        return Response({**shogi_board_data, 'next_round': shogi_board_data['seq'] + 1, 'board': board}, status=status.HTTP_200_OK)